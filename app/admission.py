@@ -0,0 +1,100 @@
+import threading
+import time
+
+import metrics
+
+MAX_CONCURRENT = 8  # requisições esperando o upstream ao mesmo tempo
+MAX_QUEUE = 16  # requisições aguardando uma vaga; além disso são descartadas na hora
+QUEUE_TIMEOUT = 0.5  # segundos máximos na fila (limitados também pelo deadline da requisição)
+RETRY_AFTER = 5  # segundos sugeridos no Retry-After dos 503
+
+FILA_CHEIA = "queue_full"
+TEMPO_ESGOTADO = "timeout"
+
+
+class LimitadorConcorrencia:
+    """Controle de admissão para trabalho que depende do upstream.
+
+    Até `max_concorrentes` requisições passam ao mesmo tempo; as seguintes
+    esperam numa fila de até `max_fila` posições por no máximo `timeout_fila`
+    segundos. Quem não cabe na fila ou estoura a espera é descartado na hora
+    (`adquirir` retorna False) e quem chamou decide o que servir no lugar.
+    """
+
+    def __init__(self, nome, max_concorrentes=None, max_fila=None, timeout_fila=None):
+        self.nome = nome
+        self.max_concorrentes = max_concorrentes or MAX_CONCURRENT
+        self.max_fila = MAX_QUEUE if max_fila is None else max_fila
+        self.timeout_fila = QUEUE_TIMEOUT if timeout_fila is None else timeout_fila
+
+        self.condicao = threading.Condition()
+        self._zerar()
+
+    def _zerar(self):
+        self.ativos = 0
+        self.fila = 0
+        self.maior_fila = 0
+        self.admitidas = 0
+        self.descartadas = {FILA_CHEIA: 0, TEMPO_ESGOTADO: 0}
+
+    def _descartar(self, motivo):
+        self.descartadas[motivo] += 1
+        metrics.registro.contador(
+            "middleware_admission_shed_total",
+            "Requisições descartadas pelo controle de admissão",
+            limiter=self.nome,
+            reason=motivo
+        ).incrementar()
+        return False
+
+    def adquirir(self, deadline=None):
+        # True com uma vaga reservada (liberar com `liberar`); False = descartada
+        with self.condicao:
+            if self.ativos < self.max_concorrentes:
+                self.ativos += 1
+                self.admitidas += 1
+                return True
+            if self.fila >= self.max_fila:
+                return self._descartar(FILA_CHEIA)
+
+            limite = time.time() + self.timeout_fila
+            if deadline is not None:
+                limite = min(limite, deadline)
+
+            self.fila += 1
+            self.maior_fila = max(self.maior_fila, self.fila)
+            try:
+                while self.ativos >= self.max_concorrentes:
+                    restante = limite - time.time()
+                    if restante <= 0:
+                        return self._descartar(TEMPO_ESGOTADO)
+                    self.condicao.wait(restante)
+            finally:
+                self.fila -= 1
+
+            self.ativos += 1
+            self.admitidas += 1
+            return True
+
+    def liberar(self):
+        with self.condicao:
+            self.ativos -= 1
+            self.condicao.notify()
+
+    def reset(self):
+        with self.condicao:
+            self._zerar()
+            self.condicao.notify_all()
+
+    def stats(self):
+        with self.condicao:
+            return {
+                "max_concurrency": self.max_concorrentes,
+                "max_queue": self.max_fila,
+                "in_flight": self.ativos,
+                "queue_depth": self.fila,
+                "peak_queue_depth": self.maior_fila,
+                "admitted": self.admitidas,
+                "shed": dict(self.descartadas),
+                "shed_total": sum(self.descartadas.values()),
+            }
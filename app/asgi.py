@@ -0,0 +1,182 @@
+"""Modo de serviço ASGI.
+
+    uvicorn asgi:application --workers 1
+
+As rotas e os contratos de resposta são os mesmos do app Flask: cada
+requisição HTTP é convertida em um environ WSGI e despachada para `main.app`.
+A diferença está na espera pelo upstream: nos endpoints de catálogo ela
+acontece aqui, de forma assíncrona, antes do despacho. Enquanto o upstream
+está lento, as requisições ficam aguardando uma única tarefa compartilhada
+no event loop em vez de ocupar uma thread cada, e o Flask recebe o catálogo
+pronto (ver `main._fetch_medido`).
+
+Nada que bloqueie roda no event loop: a carga do catálogo persistido (leitura
+e validação) acontece no `lifespan.startup` numa thread, e com um backend de
+cache fora da memória (SQLite) as leituras de cache e o despacho ao Flask
+também vão para threads.
+"""
+import asyncio
+import io
+import sys
+import time
+from urllib.parse import parse_qs
+
+import fetcher
+import refresher
+from config import verdadeiro
+from main import CATALOGO_ASGI, app
+
+ROTAS_CATALOGO = (
+    "/data/summary", "/data/summary-test", "/data/products", "/data/products/batch", "/data/products/export"
+)
+
+# Uma busca ao upstream por vez em cada event loop; as demais requisições
+# aguardam a mesma tarefa
+_em_andamento = {}
+
+
+def _simular_erro(caminho, query_string):
+    if caminho == "/data/summary-test":
+        return True
+    if caminho != "/data/products":
+        return False
+    valores = parse_qs(query_string, keep_blank_values=True).get("simular_erro", ["false"])
+    return verdadeiro(valores[0])
+
+
+def _cache_bloqueante():
+    # SQLite faz I/O (com busy timeout) a cada leitura; o dicionário em memória não
+    return fetcher.cache.backend.nome != "memory"
+
+
+async def obter_catalogo(simular_erro=False):
+    # Mesmo retorno de fetcher.fetch_produtos: (snapshot, status_code, is_fallback)
+    if simular_erro:
+        return await asyncio.to_thread(fetcher.fetch_produtos, True)
+
+    if _cache_bloqueante() or fetcher.disco_pendente():
+        resultado = await asyncio.to_thread(fetcher.servir_sem_upstream)
+    else:
+        resultado = fetcher.servir_sem_upstream()
+    if resultado is not None:
+        return resultado
+
+    loop = asyncio.get_running_loop()
+    tarefa = _em_andamento.get(loop)
+    if tarefa is None:
+        # Só a tarefa líder ocupa uma thread, bloqueada no pool HTTP do fetcher
+        tarefa = loop.create_task(asyncio.to_thread(fetcher.fetch_produtos))
+        _em_andamento[loop] = tarefa
+        tarefa.add_done_callback(lambda _: _em_andamento.pop(loop, None))
+
+    # shield: uma requisição cancelada (cliente desconectou) não cancela a busca das outras
+    return await asyncio.shield(tarefa)
+
+
+def _environ(scope, corpo):
+    servidor = scope.get("server") or ("localhost", 80)
+    cliente = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": servidor[0],
+        "SERVER_PORT": str(servidor[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": cliente[0],
+        "REMOTE_PORT": str(cliente[1]),
+        "CONTENT_LENGTH": str(len(corpo)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(corpo),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    for nome, valor in scope.get("headers", []):
+        nome = nome.decode("latin-1").upper().replace("-", "_")
+        valor = valor.decode("latin-1")
+        if nome == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = valor
+        elif nome != "CONTENT_LENGTH":
+            chave = f"HTTP_{nome}"
+            environ[chave] = f"{environ[chave]},{valor}" if chave in environ else valor
+    return environ
+
+
+async def _ler_corpo(receive):
+    partes = []
+    while True:
+        mensagem = await receive()
+        if mensagem["type"] == "http.disconnect":
+            return None
+        partes.append(mensagem.get("body", b""))
+        if not mensagem.get("more_body"):
+            return b"".join(partes)
+
+
+async def _lifespan(receive, send):
+    while True:
+        mensagem = await receive()
+        if mensagem["type"] == "lifespan.startup":
+            await asyncio.to_thread(fetcher.aquecer_do_disco)
+            if refresher.REFRESHER_ENABLED:
+                # Pré-aquecimento fora do event loop, uma vez por worker
+                await asyncio.to_thread(refresher.refresher.iniciar)
+            await send({"type": "lifespan.startup.complete"})
+        elif mensagem["type"] == "lifespan.shutdown":
+            # parar() espera a thread terminar a rodada em curso: também fora do loop
+            await asyncio.to_thread(refresher.refresher.parar)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    corpo = await _ler_corpo(receive)
+    if corpo is None:
+        return
+
+    environ = _environ(scope, corpo)
+    if scope["method"] in ("GET", "HEAD") and scope["path"] in ROTAS_CATALOGO:
+        simular_erro = _simular_erro(scope["path"], environ["QUERY_STRING"])
+        inicio = time.perf_counter()
+        resultado = await obter_catalogo(simular_erro)
+        environ[CATALOGO_ASGI] = (simular_erro, resultado, time.perf_counter() - inicio)
+
+    inicio_resposta = {}
+
+    def start_response(status, headers, exc_info=None):
+        inicio_resposta["status"] = int(status.split(" ", 1)[0])
+        inicio_resposta["headers"] = [
+            (nome.lower().encode("latin-1"), valor.encode("latin-1"))
+            for nome, valor in headers
+        ]
+
+    # Com o catálogo em mãos o despacho é só CPU (cache de respostas, índices),
+    # exceto quando o cache de respostas também está no SQLite
+    if _cache_bloqueante():
+        iterador = await asyncio.to_thread(app.wsgi_app, environ, start_response)
+    else:
+        iterador = app.wsgi_app(environ, start_response)
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": inicio_resposta["status"],
+            "headers": inicio_resposta["headers"],
+        })
+        for parte in iterador:
+            if parte:
+                await send({"type": "http.response.body", "body": parte, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        if hasattr(iterador, "close"):
+            iterador.close()
@@ -1,45 +1,76 @@
-import time
-import threading
+import os
+
+from cache_backends import MemoryBackend, SQLiteBackend
+
+SWEEP_INTERVAL = 60
+CACHE_MAX_ENTRIES = 1024
+
+# "memory" (padrão): cache local a cada processo
+# "sqlite": arquivo local compartilhado por todos os workers da máquina
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+
+# Arquivos locais do serviço ficam num diretório do próprio usuário (criado
+# com permissão 0700), nunca no /tmp compartilhado: o cache SQLite guarda pickle
+DATA_DIR = os.getenv(
+    "DATA_DIR",
+    os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "client_middleware")
+)
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", os.path.join(DATA_DIR, "cache.sqlite3"))
+
+
+def criar_backend(namespace, max_entries=None, max_bytes=None, sweep_interval=SWEEP_INTERVAL):
+    if CACHE_BACKEND == "sqlite":
+        return SQLiteBackend(
+            CACHE_SQLITE_PATH,
+            namespace=namespace,
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            sweep_interval=sweep_interval
+        )
+    if CACHE_BACKEND != "memory":
+        raise ValueError(f"CACHE_BACKEND inválido: '{CACHE_BACKEND}' (use 'memory' ou 'sqlite')")
+    return MemoryBackend(max_entries=max_entries, max_bytes=max_bytes, sweep_interval=sweep_interval)
+
 
 class SimpleTTLCache:
-    def __init__(self):
-        self.store = {}
-        self.last_valid = {}
-        self.lock = threading.Lock()
-        self.hits = 0
-        self.misses = 0
+    # Limites opcionais: ao passar de max_entries ou max_bytes, as entradas
+    # menos usadas recentemente (LRU) são descartadas. O armazenamento em si
+    # fica no backend (ver cache_backends)
+    def __init__(self, max_entries=None, max_bytes=None, sweep_interval=SWEEP_INTERVAL, backend=None):
+        if backend is None:
+            backend = MemoryBackend(max_entries=max_entries, max_bytes=max_bytes, sweep_interval=sweep_interval)
+        self.backend = backend
 
     def get(self, key):
-        with self.lock:
-            if key in self.store:
-                entry = self.store[key]
-                if entry["expiry"] > time.time():
-                    self.hits += 1
-                    return entry["data"]
-                else:
-                    del self.store[key]
-
-            self.misses += 1
-        return None
-
-    def set(self, key, value, ttl):
-        with self.lock:
-            self.store[key] = {
-                "data": value,
-                "expiry": time.time() + ttl
-            }
-            self.last_valid[key] = value  # salva última válida
+        return self.backend.get(key)
+
+    def set(self, key, value, ttl, size=None, fallback=True):
+        # fallback=True guarda o valor também como "última válida"; esse registro
+        # fica fora do LRU e só é substituído por um novo set da mesma chave
+        self.backend.set(key, value, ttl, size=size, fallback=fallback)
 
     def get_last_valid(self, key):
-        with self.lock:
-            return self.last_valid.get(key)
+        return self.backend.get_last_valid(key)
+
+    def get_stale(self, key, max_stale):
+        # Última versão válida, desde que não esteja expirada há mais de max_stale segundos
+        return self.backend.get_stale(key, max_stale)
+
+    def adquirir_lease(self, key, duracao):
+        # True para um único dono por vez (entre processos, no backend SQLite)
+        # até liberar_lease ou até `duracao` segundos se passarem
+        return self.backend.adquirir_lease(key, duracao)
+
+    def liberar_lease(self, key):
+        self.backend.liberar_lease(key)
+
+    def sweep(self):
+        self.backend.sweep()
+
+    def clear(self):
+        self.backend.clear()
 
     def stats(self):
-        with self.lock:
-            return {
-                "keys": len(self.store),
-                "hits": self.hits,
-                "misses": self.misses,
-            }
-
-cache = SimpleTTLCache()
\ No newline at end of file
+        return self.backend.stats()
+
+cache = SimpleTTLCache(backend=criar_backend("catalogo", max_entries=CACHE_MAX_ENTRIES))
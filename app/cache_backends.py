@@ -0,0 +1,577 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+def _estimar_tamanho(value):
+    # Só bytes/str têm tamanho conhecido; para objetos (ex.: o snapshot do
+    # catálogo) não há estimativa barata e confiável, então quem usa
+    # max_bytes com eles precisa informar size=
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return None
+
+
+def _verificar_dono(path):
+    # Banco, WAL e shm precisam ser do usuário do processo: pickle.loads de um
+    # arquivo plantado por outro usuário executaria código dele
+    if not hasattr(os, "getuid"):
+        return
+    for arquivo in (path, f"{path}-wal", f"{path}-shm"):
+        try:
+            dono = os.stat(arquivo).st_uid
+        except FileNotFoundError:
+            continue
+        if dono != os.getuid():
+            raise PermissionError(f"{arquivo} pertence a outro usuário (uid {dono}); recusando o cache SQLite")
+
+
+class CacheBackend:
+    """Interface de armazenamento usada pelo SimpleTTLCache.
+
+    Cada backend implementa TTL, limites com despejo LRU, varredura de
+    expirados, o registro de "última versão válida" e os contadores.
+    """
+
+    nome = None
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl, size=None, fallback=True):
+        raise NotImplementedError
+
+    def get_last_valid(self, key):
+        raise NotImplementedError
+
+    def get_stale(self, key, max_stale):
+        raise NotImplementedError
+
+    def adquirir_lease(self, key, duracao):
+        raise NotImplementedError
+
+    def liberar_lease(self, key):
+        raise NotImplementedError
+
+    def sweep(self):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    # Dicionário local ao processo: cada worker tem o seu
+    nome = "memory"
+
+    def __init__(self, max_entries=None, max_bytes=None, sweep_interval=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        self.store = OrderedDict()
+        self.last_valid = {}
+        self.leases = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes = 0
+        self.last_sweep = time.time()
+
+    def _remover(self, key):
+        entry = self.store.pop(key)
+        self.bytes -= entry["size"]
+
+    def _varrer_expirados(self, agora):
+        # Remove de uma vez todas as entradas vencidas, não só as relidas
+        self.last_sweep = agora
+        expirados = [key for key, entry in self.store.items() if entry["expiry"] <= agora]
+        for key in expirados:
+            self._remover(key)
+        self.expirations += len(expirados)
+
+    def _manutencao(self, agora):
+        if agora - self.last_sweep >= self.sweep_interval:
+            self._varrer_expirados(agora)
+
+    def _respeitar_limites(self):
+        while self.store and (
+            (self.max_entries is not None and len(self.store) > self.max_entries)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            key = next(iter(self.store))
+            self._remover(key)
+            self.evictions += 1
+
+    def get(self, key):
+        with self.lock:
+            agora = time.time()
+            self._manutencao(agora)
+
+            if key in self.store:
+                entry = self.store[key]
+                if entry["expiry"] > agora:
+                    self.store.move_to_end(key)
+                    self.hits += 1
+                    return entry["data"]
+                else:
+                    self._remover(key)
+                    self.expirations += 1
+
+            self.misses += 1
+        return None
+
+    def set(self, key, value, ttl, size=None, fallback=True):
+        with self.lock:
+            agora = time.time()
+            self._manutencao(agora)
+
+            if key in self.store:
+                self._remover(key)
+
+            entry_size = _estimar_tamanho(value) if size is None else size
+            if entry_size is None:
+                if self.max_bytes is not None:
+                    raise ValueError("max_bytes exige size= para valores que não são bytes/str")
+                entry_size = 0
+            self.store[key] = {
+                "data": value,
+                "expiry": agora + ttl,
+                "size": entry_size
+            }
+            self.bytes += entry_size
+            self._respeitar_limites()
+
+            if fallback:
+                self.last_valid[key] = {  # salva última válida
+                    "data": value,
+                    "expiry": agora + ttl
+                }
+
+    def get_last_valid(self, key):
+        with self.lock:
+            entry = self.last_valid.get(key)
+            return entry["data"] if entry else None
+
+    def get_stale(self, key, max_stale):
+        with self.lock:
+            entry = self.last_valid.get(key)
+            if entry and time.time() - entry["expiry"] <= max_stale:
+                return entry["data"]
+        return None
+
+    def adquirir_lease(self, key, duracao):
+        with self.lock:
+            agora = time.time()
+            if self.leases.get(key, 0) > agora:
+                return False
+            self.leases[key] = agora + duracao
+            return True
+
+    def liberar_lease(self, key):
+        with self.lock:
+            self.leases.pop(key, None)
+
+    def sweep(self):
+        with self.lock:
+            self._varrer_expirados(time.time())
+
+    def clear(self):
+        with self.lock:
+            self.store.clear()
+            self.last_valid.clear()
+            self.leases.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                "backend": self.nome,
+                "keys": len(self.store),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "fallback_keys": len(self.last_valid),
+            }
+            # Sem max_bytes os objetos não são medidos e o total não significa nada
+            if self.max_bytes is not None:
+                stats["bytes"] = self.bytes
+            return stats
+
+
+class SQLiteBackend(CacheBackend):
+    """Cache compartilhado entre processos num arquivo SQLite local.
+
+    Os valores são gravados com pickle; cada processo mantém os objetos já
+    decodificados e só desserializa de novo quando outro processo regrava a
+    chave. Os contadores ficam numa linha por pid e `stats()` soma todos.
+
+    Como desserializar o arquivo equivale a executar código de quem o
+    escreveu, o diretório é criado com permissão 0700 e um arquivo (ou WAL)
+    de outro usuário é recusado com PermissionError.
+    """
+
+    nome = "sqlite"
+
+    def __init__(self, path, namespace="default", max_entries=None, max_bytes=None,
+                 sweep_interval=60, flush_interval=1.0):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.flush_interval = flush_interval
+
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._decodificados = OrderedDict()
+        self._max_decodificados = max_entries or 256
+        self._contadores = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self._ultimo_flush = 0
+        self._ultima_varredura = 0
+
+        diretorio = os.path.dirname(os.path.abspath(path))
+        os.makedirs(diretorio, mode=0o700, exist_ok=True)
+        # Cria o arquivo só legível pelo dono antes de o SQLite abri-lo com o umask
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        _verificar_dono(path)
+        with self._conexao() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    token TEXT NOT NULL,
+                    expiry REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                );
+                CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, last_access);
+                CREATE TABLE IF NOT EXISTS last_valid (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    token TEXT NOT NULL,
+                    expiry REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                );
+                CREATE TABLE IF NOT EXISTS leases (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    owner INTEGER NOT NULL,
+                    expiry REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                );
+                CREATE TABLE IF NOT EXISTS counters (
+                    namespace TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    misses INTEGER NOT NULL DEFAULT 0,
+                    evictions INTEGER NOT NULL DEFAULT 0,
+                    expirations INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (namespace, pid)
+                );
+            """)
+
+    def _conexao(self):
+        # Uma conexão por thread e por processo (nunca herdada de um fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _contar(self, nome, quantidade=1):
+        with self.lock:
+            self._contadores[nome] += quantidade
+
+    def _flush_contadores(self, forcar=False):
+        agora = time.time()
+        with self.lock:
+            if not forcar and agora - self._ultimo_flush < self.flush_interval:
+                return
+            pendentes = self._contadores
+            self._contadores = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+            self._ultimo_flush = agora
+
+        self._conexao().execute(
+            """
+            INSERT INTO counters (namespace, pid, hits, misses, evictions, expirations)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (namespace, pid) DO UPDATE SET
+                hits = hits + excluded.hits,
+                misses = misses + excluded.misses,
+                evictions = evictions + excluded.evictions,
+                expirations = expirations + excluded.expirations
+            """,
+            (self.namespace, os.getpid(), pendentes["hits"], pendentes["misses"],
+             pendentes["evictions"], pendentes["expirations"])
+        )
+
+    def _memorizar(self, tabela, key, token, value):
+        with self.lock:
+            self._decodificados[(tabela, key)] = (token, value)
+            self._decodificados.move_to_end((tabela, key))
+            while len(self._decodificados) > self._max_decodificados:
+                self._decodificados.popitem(last=False)
+
+    def _decodificar(self, conn, tabela, key, token):
+        with self.lock:
+            memo = self._decodificados.get((tabela, key))
+        if memo is not None and memo[0] == token:
+            return memo[1]
+
+        # Token e dados lidos juntos: outro processo pode ter regravado a chave
+        linha = conn.execute(
+            f"SELECT token, data FROM {tabela} WHERE namespace = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        if linha is None:
+            return None
+        token, blob = linha
+        value = pickle.loads(blob)
+        self._memorizar(tabela, key, token, value)
+        return value
+
+    def _manutencao(self, conn, agora):
+        if agora - self._ultima_varredura >= self.sweep_interval:
+            self._varrer_expirados(conn, agora)
+
+    def _varrer_expirados(self, conn, agora):
+        self._ultima_varredura = agora
+        removidos = conn.execute(
+            "DELETE FROM entries WHERE namespace = ? AND expiry <= ?",
+            (self.namespace, agora)
+        ).rowcount
+        if removidos:
+            self._contar("expirations", removidos)
+
+    def _respeitar_limites(self, conn):
+        if self.max_entries is not None:
+            excedente = conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0] - self.max_entries
+            if excedente > 0:
+                conn.execute(
+                    """
+                    DELETE FROM entries WHERE namespace = ? AND key IN (
+                        SELECT key FROM entries WHERE namespace = ?
+                        ORDER BY last_access LIMIT ?
+                    )
+                    """,
+                    (self.namespace, self.namespace, excedente)
+                )
+                self._contar("evictions", excedente)
+
+        if self.max_bytes is not None:
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                removidos = 0
+                for key, size in conn.execute(
+                    "SELECT key, size FROM entries WHERE namespace = ? ORDER BY last_access",
+                    (self.namespace,)
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute(
+                        "DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key)
+                    )
+                    total -= size
+                    removidos += 1
+                self._contar("evictions", removidos)
+
+    def get(self, key):
+        chave = repr(key)
+        conn = self._conexao()
+        agora = time.time()
+        self._manutencao(conn, agora)
+
+        linha = conn.execute(
+            "SELECT token, expiry, last_access FROM entries WHERE namespace = ? AND key = ?",
+            (self.namespace, chave)
+        ).fetchone()
+
+        if linha is None:
+            self._contar("misses")
+            self._flush_contadores()
+            return None
+
+        token, expiry, last_access = linha
+        if expiry <= agora:
+            conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key = ? AND token = ?",
+                (self.namespace, chave, token)
+            )
+            self._contar("expirations")
+            self._contar("misses")
+            self._flush_contadores()
+            return None
+
+        # Atualiza o LRU no máximo uma vez por segundo por chave, para poupar escritas
+        if agora - last_access >= 1:
+            conn.execute(
+                "UPDATE entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                (agora, self.namespace, chave)
+            )
+
+        value = self._decodificar(conn, "entries", chave, token)
+        if value is None:
+            self._contar("misses")
+            self._flush_contadores()
+            return None
+        self._contar("hits")
+        self._flush_contadores()
+        return value
+
+    def set(self, key, value, ttl, size=None, fallback=True):
+        chave = repr(key)
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        token = uuid.uuid4().hex
+        agora = time.time()
+        entry_size = len(blob) if size is None else size
+
+        conn = self._conexao()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._manutencao(conn, agora)
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO entries (namespace, key, data, token, expiry, size, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (self.namespace, chave, blob, token, agora + ttl, entry_size, agora)
+            )
+            self._respeitar_limites(conn)
+            if fallback:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO last_valid (namespace, key, data, token, expiry)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (self.namespace, chave, blob, token, agora + ttl)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        # O próprio processo não precisa desserializar o que acabou de gravar
+        self._memorizar("entries", chave, token, value)
+        if fallback:
+            self._memorizar("last_valid", chave, token, value)
+
+    def _ler_last_valid(self, key, max_stale=None):
+        chave = repr(key)
+        conn = self._conexao()
+        linha = conn.execute(
+            "SELECT token, expiry FROM last_valid WHERE namespace = ? AND key = ?",
+            (self.namespace, chave)
+        ).fetchone()
+        if linha is None:
+            return None
+        token, expiry = linha
+        if max_stale is not None and time.time() - expiry > max_stale:
+            return None
+        return self._decodificar(conn, "last_valid", chave, token)
+
+    def get_last_valid(self, key):
+        return self._ler_last_valid(key)
+
+    def get_stale(self, key, max_stale):
+        return self._ler_last_valid(key, max_stale)
+
+    def adquirir_lease(self, key, duracao):
+        # Um único worker revalida a chave; os demais seguem servindo o que já há
+        chave = repr(key)
+        conn = self._conexao()
+        agora = time.time()
+
+        # Leitura antes da escrita: o caso comum (lease de outro) não trava o arquivo
+        linha = conn.execute(
+            "SELECT expiry FROM leases WHERE namespace = ? AND key = ?", (self.namespace, chave)
+        ).fetchone()
+        if linha is not None and linha[0] > agora:
+            return False
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM leases WHERE namespace = ? AND key = ? AND expiry <= ?",
+                (self.namespace, chave, agora)
+            )
+            inseridas = conn.execute(
+                "INSERT OR IGNORE INTO leases (namespace, key, owner, expiry) VALUES (?, ?, ?, ?)",
+                (self.namespace, chave, os.getpid(), agora + duracao)
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return inseridas == 1
+
+    def liberar_lease(self, key):
+        self._conexao().execute(
+            "DELETE FROM leases WHERE namespace = ? AND key = ? AND owner = ?",
+            (self.namespace, repr(key), os.getpid())
+        )
+
+    def sweep(self):
+        self._varrer_expirados(self._conexao(), time.time())
+
+    def clear(self):
+        conn = self._conexao()
+        conn.execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
+        conn.execute("DELETE FROM last_valid WHERE namespace = ?", (self.namespace,))
+        conn.execute("DELETE FROM leases WHERE namespace = ?", (self.namespace,))
+        with self.lock:
+            self._decodificados.clear()
+
+    def stats(self):
+        self._flush_contadores(forcar=True)
+        conn = self._conexao()
+        keys, total_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?",
+            (self.namespace,)
+        ).fetchone()
+        hits, misses, evictions, expirations, workers = conn.execute(
+            """
+            SELECT COALESCE(SUM(hits), 0), COALESCE(SUM(misses), 0),
+                   COALESCE(SUM(evictions), 0), COALESCE(SUM(expirations), 0), COUNT(*)
+            FROM counters WHERE namespace = ?
+            """,
+            (self.namespace,)
+        ).fetchone()
+        fallback_keys = conn.execute(
+            "SELECT COUNT(*) FROM last_valid WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+        return {
+            "backend": self.nome,
+            "keys": keys,
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "expirations": expirations,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "fallback_keys": fallback_keys,
+            "workers": workers,
+        }
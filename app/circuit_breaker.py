@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import deque
+
+FECHADO = "closed"
+ABERTO = "open"
+MEIO_ABERTO = "half_open"
+
+FAILURE_THRESHOLD = 5  # falhas consecutivas que abrem o circuito
+CIRCUIT_RESET_TIMEOUT = 30  # segundos aberto antes de admitir uma sonda
+FAILURE_WINDOW = 60  # janela deslizante (segundos) para a taxa de falhas
+FAILURE_RATE_THRESHOLD = 0.5
+MIN_WINDOW_REQUESTS = 10  # abaixo disso a taxa da janela não abre o circuito
+
+
+class CircuitBreaker:
+    """Circuit breaker protegido por lock, um por upstream.
+
+    Abre com FAILURE_THRESHOLD falhas seguidas ou com taxa de falhas acima de
+    FAILURE_RATE_THRESHOLD na janela deslizante. Depois de CIRCUIT_RESET_TIMEOUT
+    passa a meio-aberto e admite uma única requisição de sonda: sucesso fecha
+    o circuito, falha o reabre por mais um período.
+    """
+
+    def __init__(self, nome, failure_threshold=None, reset_timeout=None, janela=None,
+                 taxa_falhas=None, minimo_janela=None):
+        self.nome = nome
+        self.failure_threshold = failure_threshold or FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or CIRCUIT_RESET_TIMEOUT
+        self.janela = janela or FAILURE_WINDOW
+        self.taxa_falhas = taxa_falhas or FAILURE_RATE_THRESHOLD
+        self.minimo_janela = minimo_janela or MIN_WINDOW_REQUESTS
+
+        self.lock = threading.Lock()
+        self._zerar()
+
+    def _zerar(self):
+        self.estado = FECHADO
+        self.falhas_consecutivas = 0
+        self.aberto_em = 0
+        self.ultima_falha = None
+        self.sonda_em = None  # início da sonda em andamento no meio-aberto
+        self.resultados = deque()  # (timestamp, sucesso)
+        self.aberturas = 0
+        self.rejeitadas = 0
+
+    def _descartar_antigos(self, agora):
+        limite = agora - self.janela
+        while self.resultados and self.resultados[0][0] < limite:
+            self.resultados.popleft()
+
+    def _abrir(self, agora):
+        self.estado = ABERTO
+        self.aberto_em = agora
+        self.sonda_em = None
+        self.aberturas += 1
+
+    def permitir(self):
+        # True se a chamada ao upstream pode prosseguir agora
+        with self.lock:
+            if self.estado == FECHADO:
+                return True
+
+            agora = time.time()
+            if self.estado == ABERTO and agora - self.aberto_em >= self.reset_timeout:
+                self.estado = MEIO_ABERTO
+                self.sonda_em = None
+
+            # Uma sonda por vez; se ela não reportar (thread morta), outra
+            # é admitida depois de mais um reset_timeout
+            if self.estado == MEIO_ABERTO and (
+                self.sonda_em is None or agora - self.sonda_em >= self.reset_timeout
+            ):
+                self.sonda_em = agora
+                return True
+
+            self.rejeitadas += 1
+            return False
+
+    def registrar_sucesso(self):
+        with self.lock:
+            agora = time.time()
+            if self.estado != FECHADO:
+                # Sonda bem-sucedida: o histórico da janela é da queda, não do upstream atual
+                self.resultados.clear()
+            self.estado = FECHADO
+            self.falhas_consecutivas = 0
+            self.sonda_em = None
+            self.resultados.append((agora, True))
+            self._descartar_antigos(agora)
+
+    def registrar_falha(self):
+        with self.lock:
+            agora = time.time()
+            self.falhas_consecutivas += 1
+            self.ultima_falha = agora
+            self.resultados.append((agora, False))
+            self._descartar_antigos(agora)
+
+            if self.estado == MEIO_ABERTO:
+                self._abrir(agora)
+            elif self.estado == FECHADO and (
+                self.falhas_consecutivas >= self.failure_threshold
+                or self._taxa_janela() >= self.taxa_falhas
+            ):
+                self._abrir(agora)
+
+    def _taxa_janela(self):
+        if len(self.resultados) < self.minimo_janela:
+            return 0.0
+        falhas = sum(1 for _, sucesso in self.resultados if not sucesso)
+        return falhas / len(self.resultados)
+
+    @property
+    def aberto(self):
+        with self.lock:
+            return self.estado != FECHADO
+
+    def reset(self):
+        with self.lock:
+            self._zerar()
+
+    def stats(self):
+        with self.lock:
+            self._descartar_antigos(time.time())
+            return {
+                "state": self.estado,
+                "open": self.estado != FECHADO,
+                "failure_count": self.falhas_consecutivas,
+                "window_requests": len(self.resultados),
+                "window_failure_rate": round(
+                    sum(1 for _, sucesso in self.resultados if not sucesso) / len(self.resultados), 3
+                ) if self.resultados else 0.0,
+                "opened_total": self.aberturas,
+                "rejected": self.rejeitadas,
+            }
+
+
+_breakers_lock = threading.Lock()
+_breakers = {}
+
+
+def breaker_para(upstream, **config):
+    # Uma instância por upstream: a falha de uma fonte não abre o circuito das outras
+    with _breakers_lock:
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            breaker = _breakers[upstream] = CircuitBreaker(upstream, **config)
+        return breaker
+
+
+def todos():
+    with _breakers_lock:
+        return dict(_breakers)
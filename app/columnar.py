@@ -0,0 +1,130 @@
+import math
+from array import array
+from bisect import bisect_left, insort
+
+PERCENTIS = (25, 50, 75, 90, 95, 99)
+
+
+def _percentil(ordenados, p):
+    # Interpolação linear entre os vizinhos mais próximos (mesmo método do numpy)
+    if not ordenados:
+        return 0
+    posicao = (len(ordenados) - 1) * p / 100
+    inferior = math.floor(posicao)
+    superior = math.ceil(posicao)
+    if inferior == superior:
+        return ordenados[inferior]
+    fracao = posicao - inferior
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * fracao
+
+
+class ColunasProdutos:
+    """Representação colunar compacta dos produtos válidos de um snapshot.
+
+    Preços e ids ficam em arrays tipados e a categoria vira um código inteiro
+    pequeno; as estatísticas são calculadas uma única vez sobre as colunas.
+    """
+
+    def __init__(self, produtos):
+        self.ids = array("q", (p.id for p in produtos))
+        self.precos = array("d", (p.price for p in produtos))
+
+        codigos = {}
+        self.nomes_categoria = []
+        self.codigos_categoria = array("I")
+        for p in produtos:
+            codigo = codigos.get(p.category)
+            if codigo is None:
+                codigo = codigos[p.category] = len(self.nomes_categoria)
+                self.nomes_categoria.append(p.category)
+            self.codigos_categoria.append(codigo)
+
+        self.precos_ordenados = array("d", sorted(self.precos))
+        self.estatisticas_preco = self._estatisticas_preco()
+        self.estatisticas_por_categoria = self._estatisticas_por_categoria()
+
+    @classmethod
+    def derivar(cls, anterior, produtos, alteradas):
+        """Colunas para `produtos` a partir das `anterior`, com o mesmo layout.
+
+        Só as posições em `alteradas` mudaram: os preços ordenados são corrigidos
+        por busca binária em vez de reordenados e só as categorias envolvidas
+        têm as estatísticas recalculadas.
+        """
+        novo = cls.__new__(cls)
+        novo.ids = anterior.ids
+        novo.precos = precos = array("d", anterior.precos)
+        novo.codigos_categoria = codigos_categoria = array("I", anterior.codigos_categoria)
+        novo.nomes_categoria = list(anterior.nomes_categoria)
+        novo.precos_ordenados = ordenados = array("d", anterior.precos_ordenados)
+
+        codigos = {nome: codigo for codigo, nome in enumerate(novo.nomes_categoria)}
+        afetadas = set()
+        for posicao in alteradas:
+            p = produtos[posicao]
+            del ordenados[bisect_left(ordenados, precos[posicao])]
+            insort(ordenados, p.price)
+            precos[posicao] = p.price
+
+            codigo = codigos.get(p.category)
+            if codigo is None:
+                codigo = codigos[p.category] = len(novo.nomes_categoria)
+                novo.nomes_categoria.append(p.category)
+            afetadas.add(codigos_categoria[posicao])
+            afetadas.add(codigo)
+            codigos_categoria[posicao] = codigo
+
+        novo.estatisticas_preco = novo._estatisticas_preco()
+        novo.estatisticas_por_categoria = novo._estatisticas_por_categoria(
+            somente=afetadas, anteriores=anterior.estatisticas_por_categoria
+        )
+        return novo
+
+    def __len__(self):
+        return len(self.precos)
+
+    def _estatisticas_preco(self):
+        ordenados = self.precos_ordenados
+        n = len(ordenados)
+        return {
+            "min": ordenados[0] if n else 0,
+            "max": ordenados[-1] if n else 0,
+            "media": math.fsum(ordenados) / n if n else 0,
+            "mediana": _percentil(ordenados, 50),
+            "percentis": {f"p{p}": _percentil(ordenados, p) for p in PERCENTIS}
+        }
+
+    def _estatisticas_por_categoria(self, somente=None, anteriores=None):
+        # Com `somente`, recalcula só esses códigos e copia os demais de `anteriores`
+        total = len(self.nomes_categoria)
+        quantidades = [0] * total
+        somas = [0.0] * total
+        minimos = [math.inf] * total
+        maximos = [-math.inf] * total
+
+        for codigo, preco in zip(self.codigos_categoria, self.precos):
+            if somente is not None and codigo not in somente:
+                continue
+            quantidades[codigo] += 1
+            somas[codigo] += preco
+            if preco < minimos[codigo]:
+                minimos[codigo] = preco
+            if preco > maximos[codigo]:
+                maximos[codigo] = preco
+
+        estatisticas = {}
+        for codigo, nome in enumerate(self.nomes_categoria):
+            if somente is not None and codigo not in somente:
+                if nome in anteriores:
+                    estatisticas[nome] = anteriores[nome]
+            elif quantidades[codigo]:  # categoria pode ter ficado vazia num derivar()
+                estatisticas[nome] = {
+                    "quantidade": quantidades[codigo],
+                    "media": somas[codigo] / quantidades[codigo],
+                    "min": minimos[codigo],
+                    "max": maximos[codigo]
+                }
+        return estatisticas
+
+    def contagem_por_categoria(self):
+        return {nome: stats["quantidade"] for nome, stats in self.estatisticas_por_categoria.items()}
@@ -0,0 +1,13 @@
+import os
+
+# Valores aceitos como "ligado" em variáveis de ambiente e na query string
+VERDADEIROS = ("true", "1", "yes", "sim")
+
+
+def verdadeiro(valor):
+    return valor.lower() in VERDADEIROS
+
+
+def env_bool(nome, padrao):
+    # padrao é o texto usado quando a variável não está definida ("true"/"false")
+    return verdadeiro(os.getenv(nome, padrao))
@@ -1,7 +1,16 @@
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import admission
+import circuit_breaker
+import metrics
+import persistence
 from cache import cache
+from snapshot import SOURCE_URL, atualizar_snapshot, build_snapshot, build_snapshot_confiavel, calcular_versao
 
 
 DEFAULT_TTL = 120
@@ -9,98 +18,530 @@ MAX_RETRIES = 3
 BACKOFF_FACTOR = 1.5
 TIMEOUT = 5
 
-# Circuit breaker #
-failure_count = 0
-CIRCUIT_OPEN = False
-FAILURE_THRESHOLD = 5
-CIRCUIT_RESET_TIMEOUT = 30
-last_failure_time = 0
+# Paginação do upstream: a primeira página informa o "total" e as demais
+# são buscadas em paralelo por um pool de threads limitado
+PAGE_SIZE = 100
+PAGE_WORKERS = 4
+
+# Pool HTTP compartilhado (keep-alive) para o upstream
+POOL_CONNECTIONS = 4  # hosts distintos mantidos no pool
+POOL_MAXSIZE = 16  # conexões reaproveitáveis por host
+POOL_BLOCK = False  # True: espera uma conexão livre em vez de abrir uma extra
+KEEP_ALIVE = True
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = TIMEOUT
+
+# Orçamento de tempo de uma requisição de cliente: ela faz no máximo uma
+# tentativa ao upstream e nunca dorme em backoff; os retries com backoff
+# ficam a cargo do refresh em background
+REQUEST_DEADLINE = 2.0
+
+# Stale-while-revalidate: após o TTL, o valor expirado continua sendo servido
+# (por até STALE_MAX_AGE segundos) enquanto um único refresh roda em background
+STALE_WHILE_REVALIDATE = True
+STALE_MAX_AGE = 600
+# Prazo do lease de revalidação (cobre os retries com backoff); com o backend
+# SQLite ele impede que cada worker revalide a mesma entrada por conta própria
+REVALIDATION_LEASE = 30
+
+CACHE_KEY = "produtos_all"
+
+# Refresh incremental: só itens novos ou com meta.updatedAt diferente do
+# snapshot anterior são revalidados (ver snapshot.atualizar_snapshot)
+DELTA_REFRESH = True
+
+# Registrado pelo refresher em background quando ele assume a busca ao upstream:
+# enquanto a thread dele estiver viva, os handlers apenas leem o cache (ou o fallback)
+refresher_catalogo = None
+
+
+def refresher_ativo():
+    # Thread viva neste processo: após um fork (gunicorn --preload) o filho herda
+    # o objeto mas não a thread, e aí os handlers voltam a buscar no upstream
+    return refresher_catalogo is not None and refresher_catalogo.ativo
+
+# Circuit breaker do upstream do catálogo (ver circuit_breaker.py)
+breaker = circuit_breaker.breaker_para(SOURCE_URL)
+
+# Limita as requisições de cliente presas esperando o upstream; o excesso
+# é descartado para o fallback (ver admission.py)
+admissao = admission.LimitadorConcorrencia(SOURCE_URL)
 
 # LAST FETCH INFO
-LAST_FETCH_TIMESTAMP = None
-LAST_FETCH_STATUS = None
-LAST_FETCH_FALLBACK = False
+_ultimo_fetch_lock = threading.Lock()
+_ultimo_fetch = {
+    "timestamp": None,
+    "status_code": None,
+    "fallback_used": False
+}
 
 
-def fetch_produtos(simular_erro=False):
-    global failure_count, CIRCUIT_OPEN, last_failure_time
-    global LAST_FETCH_TIMESTAMP, LAST_FETCH_STATUS, LAST_FETCH_FALLBACK
+def _registrar_fetch(status_code, fallback_used):
+    with _ultimo_fetch_lock:
+        _ultimo_fetch["timestamp"] = datetime.utcnow().isoformat()
+        _ultimo_fetch["status_code"] = status_code
+        _ultimo_fetch["fallback_used"] = fallback_used
+
+
+def ultimo_fetch():
+    with _ultimo_fetch_lock:
+        return dict(_ultimo_fetch)
+
+
+class _ContadorPool:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requisicoes = 0
+        self.conexoes_abertas = 0
+
+    def registrar_requisicao(self):
+        with self.lock:
+            self.requisicoes += 1
+
+    def registrar_conexao(self):
+        with self.lock:
+            self.conexoes_abertas += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requisicoes,
+                "connections_opened": self.conexoes_abertas,
+                "connections_reused": max(self.requisicoes - self.conexoes_abertas, 0),
+                "pool_maxsize": POOL_MAXSIZE,
+                "keep_alive": KEEP_ALIVE
+            }
+
+
+_contador_pool = _ContadorPool()
+
+
+class _HTTPConnectionPoolContado(HTTPConnectionPool):
+    def _new_conn(self):
+        _contador_pool.registrar_conexao()
+        return super()._new_conn()
+
+
+class _HTTPSConnectionPoolContado(HTTPSConnectionPool):
+    def _new_conn(self):
+        _contador_pool.registrar_conexao()
+        return super()._new_conn()
+
+
+class _AdaptadorContado(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _HTTPConnectionPoolContado,
+            "https": _HTTPSConnectionPoolContado
+        }
+
+    def send(self, request, **kwargs):
+        _contador_pool.registrar_requisicao()
+        return super().send(request, **kwargs)
+
+
+def _criar_sessao():
+    # Os retries ficam com o fetcher; o adapter só cuida do pool de conexões
+    adaptador = _AdaptadorContado(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        pool_block=POOL_BLOCK,
+        max_retries=0
+    )
+    sessao = requests.Session()
+    sessao.mount("https://", adaptador)
+    sessao.mount("http://", adaptador)
+    if not KEEP_ALIVE:
+        sessao.headers["Connection"] = "close"
+    return sessao
+
+
+session = _criar_sessao()
+
+
+def pool_stats():
+    return _contador_pool.stats()
+
+
+_executor_paginas = ThreadPoolExecutor(
+    max_workers=PAGE_WORKERS,
+    thread_name_prefix="upstream-pagina"
+)
+
+
+def _buscar_pagina(skip, limit, timeout):
+    response = session.get(
+        SOURCE_URL,
+        params={"limit": limit, "skip": skip},
+        timeout=timeout
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def _buscar_catalogo(timeout, deadline=None):
+    primeira = _buscar_pagina(0, PAGE_SIZE, timeout)
+    produtos = list(primeira["products"])
+    total = primeira.get("total", len(produtos))
+
+    # O upstream pode limitar o tamanho da página abaixo de PAGE_SIZE
+    tamanho_pagina = len(produtos)
+    if tamanho_pagina == 0 or total <= tamanho_pagina:
+        return produtos
+
+    futuros = [
+        _executor_paginas.submit(_buscar_pagina, skip, tamanho_pagina, timeout)
+        for skip in range(tamanho_pagina, total, tamanho_pagina)
+    ]
+
+    # Qualquer página com falha invalida a tentativa inteira: um catálogo
+    # parcial nunca é cacheado e a falha conta para retry e circuit breaker
+    try:
+        for futuro in futuros:
+            espera = None if deadline is None else max(deadline - time.time(), 0)
+            produtos.extend(futuro.result(timeout=espera)["products"])
+    except Exception:
+        for futuro in futuros:
+            futuro.cancel()
+        raise
+
+    return produtos
+
+
+def _simular_erros(produtos):
+    # Corrompe alguns itens para exercitar o relatório de integridade
+    if len(produtos) > 10:
+        produtos[10]["price"] = -100
+    if len(produtos) > 1:
+        produtos[1].pop("title", None)
+        produtos[1].pop("description", None)
+    if len(produtos) > 2:
+        produtos[2]["price"] = "caro"
+    if len(produtos) > 4:
+        produtos[4]["meta"]["createdAt"] = "data_errada"
+
+
+def _snapshot_para(produtos, cache_key):
+    # Só revalida quando o payload do upstream muda de fato
+    versao = calcular_versao(produtos)
+    anterior = cache.get_last_valid(cache_key)
+    if anterior is not None and anterior.versao == versao:
+        return anterior
+    if DELTA_REFRESH and anterior is not None:
+        return atualizar_snapshot(anterior, produtos, versao=versao)
+    return build_snapshot(produtos, versao=versao)
+
+
+_disco_lock = threading.Lock()
+_disco_verificado = False
+_versao_persistida = None
+
+
+def _snapshot_persistido(cabecalho, produtos):
+    erros = cabecalho.get("erros")
+    # Modo confiável: o hash confere com a versão validada quando o arquivo foi gravado
+    if persistence.TRUSTED_VALIDATION and erros is not None \
+            and calcular_versao(produtos) == cabecalho["versao"]:
+        try:
+            return build_snapshot_confiavel(produtos, cabecalho["versao"], erros)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            pass  # formato que só o pydantic aceita (ex.: updatedAt em epoch): valida tudo
+    return build_snapshot(produtos, versao=cabecalho["versao"])
+
+
+def _carregar_do_disco(cache_key):
+    # Uma vez por processo: sem "última válida" em memória, usa a gravada em disco
+    global _disco_verificado, _versao_persistida
+
+    if _disco_verificado or not persistence.SNAPSHOT_PERSISTENCE:
+        return
+
+    # Quem chega durante a carga espera no lock e já encontra o snapshot no cache;
+    # a flag só vira True quando a leitura termina (com ou sem sucesso)
+    with _disco_lock:
+        if _disco_verificado:
+            return
+        try:
+            if cache.get_last_valid(cache_key) is not None:
+                return
+            carregado = persistence.carregar_catalogo(fonte=SOURCE_URL)
+            if carregado is None:
+                return
+
+            cabecalho, produtos = carregado
+            try:
+                snapshot = _snapshot_persistido(cabecalho, produtos)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                return  # arquivo com conteúdo inesperado: segue como se não existisse
+
+            # O TTL conta a partir de quando o arquivo foi salvo (nunca mais que
+            # DEFAULT_TTL): um snapshot antigo entra apenas como fallback
+            ttl = min(cabecalho["salvo_em"] + DEFAULT_TTL - time.time(), DEFAULT_TTL)
+            cache.set(cache_key, snapshot, ttl=ttl)
+            _versao_persistida = snapshot.versao
+        finally:
+            _disco_verificado = True
 
-    cache_key = "produtos_all"
+
+def aquecer_do_disco(cache_key=CACHE_KEY):
+    # Carga antecipada do arquivo persistido, fora do caminho das requisições
+    # (ex.: lifespan.startup do ASGI); só lê e valida o arquivo uma vez por processo
+    _carregar_do_disco(cache_key)
+
+
+def disco_pendente():
+    # True enquanto a primeira leitura servir_sem_upstream ainda puder carregar o disco
+    return persistence.SNAPSHOT_PERSISTENCE and not _disco_verificado
+
+
+# A gravação (com fsync) roda numa única thread dedicada, em ordem, e nunca
+# na thread da requisição que liderou a busca ao upstream
+_executor_persistencia = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistencia")
+_gravacao_pendente = None
+
+
+def _persistir(produtos, snapshot):
+    global _versao_persistida, _gravacao_pendente
+
+    versao = snapshot.versao
+    if not persistence.SNAPSHOT_PERSISTENCE or versao == _versao_persistida:
+        return
+    _versao_persistida = versao
+    _gravacao_pendente = _executor_persistencia.submit(
+        _gravar_catalogo, produtos, versao, snapshot.erros, persistence.SNAPSHOT_PATH
+    )
+
+
+def _gravar_catalogo(produtos, versao, erros, path):
+    global _versao_persistida
+
+    try:
+        persistence.salvar_catalogo(produtos, versao, path=path, erros=erros, fonte=SOURCE_URL)
+    except OSError:
+        # Sem disco o serviço segue funcionando, só não reinicia aquecido;
+        # a próxima busca com esta versão tenta gravar de novo
+        if _versao_persistida == versao:
+            _versao_persistida = None
+
+
+def aguardar_persistencia(timeout=None):
+    # Espera a última gravação agendada (testes e desligamento ordenado)
+    gravacao = _gravacao_pendente
+    if gravacao is not None:
+        gravacao.result(timeout)
+
+
+class _Chamada:
+    # Uma busca ao upstream em andamento; os demais interessados esperam por ela
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+_inflight_lock = threading.Lock()
+_inflight = {}
+
+
+def _registrar_chamada(chave):
+    with _inflight_lock:
+        chamada = _inflight.get(chave)
+        if chamada is not None:
+            return chamada, False
+        chamada = _Chamada()
+        _inflight[chave] = chamada
+        return chamada, True
+
+
+def _executar_chamada(chave, chamada, funcao):
+    try:
+        chamada.resultado = funcao()
+    except BaseException as e:
+        chamada.erro = e
+    finally:
+        with _inflight_lock:
+            _inflight.pop(chave, None)
+        chamada.evento.set()
+
+
+def _coalescer(chave, funcao, deadline):
+    # Single-flight: misses concorrentes da mesma chave compartilham uma única busca
+    chamada, lider = _registrar_chamada(chave)
+    espera = None if deadline is None else max(deadline - time.time(), 0)
+    if lider:
+        _executar_chamada(chave, chamada, funcao)
+    elif not chamada.evento.wait(espera):
+        return _fallback(chave)  # estourou o orçamento esperando a busca em andamento
+
+    if chamada.erro is not None:
+        raise chamada.erro
+    return chamada.resultado
+
+
+def _revalidar_com_lease(cache_key):
+    resultado = _buscar_upstream(cache_key)
+    # Após falha o lease só vence sozinho: vale como backoff entre os workers
+    if not resultado[2]:
+        cache.liberar_lease(cache_key)
+    return resultado
+
+
+def _revalidar_em_background(cache_key):
+    if cache_key in _inflight:
+        return  # já existe uma busca em andamento neste processo
+
+    # Com cache compartilhado, só o worker que obtém o lease revalida
+    if not cache.adquirir_lease(cache_key, REVALIDATION_LEASE):
+        return
+
+    chamada, lider = _registrar_chamada(cache_key)
+    if not lider:
+        cache.liberar_lease(cache_key)
+        return
+
+    threading.Thread(
+        target=_executar_chamada,
+        args=(cache_key, chamada, lambda: _revalidar_com_lease(cache_key)),
+        daemon=True
+    ).start()
+
+
+def atualizar_catalogo():
+    # Refresh completo, com retries e backoff; só deve rodar fora das threads de requisição
+    return _coalescer(CACHE_KEY, lambda: _buscar_upstream(CACHE_KEY), deadline=None)
+
+
+def servir_sem_upstream(cache_key=CACHE_KEY):
+    # Resultado que não depende de esperar o upstream: cache, snapshot expirado
+    # (stale-while-revalidate) ou, com o refresher ativo, o fallback.
+    # None quando a requisição precisa buscar no upstream
+    _carregar_do_disco(cache_key)
 
     cached = cache.get(cache_key)
-    if cached and not simular_erro:
-        LAST_FETCH_TIMESTAMP = datetime.utcnow().isoformat()
-        LAST_FETCH_STATUS = 200
-        LAST_FETCH_FALLBACK = False
+    if cached:
+        _registrar_fetch(200, False)
         return cached, 200, False
 
-    if CIRCUIT_OPEN:
-        if time.time() - last_failure_time < CIRCUIT_RESET_TIMEOUT:
-            fallback = cache.get_last_valid(cache_key)
-            LAST_FETCH_TIMESTAMP = datetime.utcnow().isoformat()
-            LAST_FETCH_STATUS = 503
-            LAST_FETCH_FALLBACK = True
-
-            if fallback:
-                return fallback, 200, True
-            return None, 503, True
-        else:
-            CIRCUIT_OPEN = False
-            failure_count = 0
-
-    for attempt in range(MAX_RETRIES):
-        try:
-            start = time.time()
+    if STALE_WHILE_REVALIDATE:
+        stale = cache.get_stale(cache_key, STALE_MAX_AGE)
+        if stale is not None:
+            if not refresher_ativo():
+                _revalidar_em_background(cache_key)
+            return stale, 200, False
 
-            response = requests.get(
-                "https://dummyjson.com/products/",
-                timeout=TIMEOUT
-            )
-            response.raise_for_status()
+    if refresher_ativo():
+        return _fallback(cache_key)
 
-            latency = time.time() - start
+    return None
 
-            data = response.json()
-            produtos = data["products"]
 
-            if not simular_erro:
-                cache.set(cache_key, produtos, ttl=DEFAULT_TTL)
+def fetch_produtos(simular_erro=False):
+    cache_key = CACHE_KEY
+    deadline = time.time() + REQUEST_DEADLINE
 
-            failure_count = 0
+    # Dados com erro simulado nunca são cacheados nem compartilhados
+    if simular_erro:
+        if not admissao.adquirir(deadline):
+            return _fallback(cache_key)
+        try:
+            return _buscar_upstream(cache_key, simular_erro=True, tentativas=1, deadline=deadline)
+        finally:
+            admissao.liberar()
 
-            #Atualiza last fetch 
-            LAST_FETCH_TIMESTAMP = datetime.utcnow().isoformat()
-            LAST_FETCH_STATUS = response.status_code
-            LAST_FETCH_FALLBACK = False
+    resultado = servir_sem_upstream(cache_key)
+    if resultado is not None:
+        return resultado
 
-            if simular_erro:
-                produtos[10]["price"] = -100
-                produtos[1].pop("title", None)
-                produtos[2]["price"] = "caro"
-                produtos[4]["meta"]["createdAt"] = "data_errada"
-                produtos[1].pop("description", None)
+    descartada = []
 
-            return produtos, 200, False
+    def buscar_admitida():
+        # Só o líder do single-flight ocupa uma vaga de admissão; quem espera
+        # pela mesma busca não consome vaga nem posição na fila.
+        # Sobrecarga: em vez de enfileirar sem limite atrás do upstream lento,
+        # descarta na hora para a última versão válida (ou 503)
+        if not admissao.adquirir(deadline):
+            descartada.append(True)
+            return _fallback(cache_key)
+        try:
+            # Enquanto esperava na fila, outro worker pode ter preenchido o cache compartilhado
+            resultado = servir_sem_upstream(cache_key)
+            if resultado is not None:
+                return resultado
+            return _buscar_upstream(cache_key, tentativas=1, deadline=deadline)
+        finally:
+            admissao.liberar()
 
-        except Exception as e:
-            failure_count += 1
-            last_failure_time = time.time()
+    resultado = _coalescer(cache_key, buscar_admitida, deadline)
 
-            sleep_time = BACKOFF_FACTOR ** attempt
-            time.sleep(sleep_time)
+    # Falhou dentro do orçamento: os retries continuam fora da thread da requisição
+    if resultado[2] and not descartada:
+        _revalidar_em_background(cache_key)
 
-    if failure_count >= FAILURE_THRESHOLD:
-        CIRCUIT_OPEN = True
+    return resultado
 
+
+def _fallback(cache_key):
+    _carregar_do_disco(cache_key)
     fallback = cache.get_last_valid(cache_key)
 
-    #Atualiza last fetch 
-    LAST_FETCH_TIMESTAMP = datetime.utcnow().isoformat()
-    LAST_FETCH_STATUS = 503
-    LAST_FETCH_FALLBACK = True
+    _registrar_fetch(503, True)
 
     if fallback:
         return fallback, 200, True
 
-    return None, 503, True
\ No newline at end of file
+    return None, 503, True
+
+
+def _resultado_upstream(resultado):
+    return metrics.registro.contador(
+        "middleware_upstream_fetches_total",
+        "Tentativas de busca do catálogo no upstream",
+        result=resultado
+    )
+
+
+def _buscar_upstream(cache_key, simular_erro=False, tentativas=None, deadline=None):
+    if tentativas is None:
+        tentativas = MAX_RETRIES
+
+    for attempt in range(tentativas):
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        if deadline is not None:
+            restante = deadline - time.time()
+            if restante <= 0:
+                break
+            timeout = (min(CONNECT_TIMEOUT, restante), min(READ_TIMEOUT, restante))
+
+        # Consultado a cada tentativa: se o circuito abrir no meio dos retries,
+        # ou se outra thread já for a sonda do meio-aberto, desiste aqui
+        if not breaker.permitir():
+            break
+
+        try:
+            with metrics.medir("upstream"):
+                produtos = _buscar_catalogo(timeout, deadline)
+            _resultado_upstream("ok").incrementar()
+
+            if simular_erro:
+                _simular_erros(produtos)
+                snapshot = build_snapshot(produtos)
+            else:
+                snapshot = _snapshot_para(produtos, cache_key)
+                cache.set(cache_key, snapshot, ttl=DEFAULT_TTL)
+                _persistir(produtos, snapshot)
+
+            breaker.registrar_sucesso()
+            _registrar_fetch(200, False)
+
+            return snapshot, 200, False
+
+        except Exception as e:
+            _resultado_upstream("error").incrementar()
+            breaker.registrar_falha()
+
+            if attempt < tentativas - 1:
+                sleep_time = BACKOFF_FACTOR ** attempt
+                time.sleep(sleep_time)
+
+    return _fallback(cache_key)
@@ -0,0 +1,198 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import merge
+
+ORDENACOES = ("price", "-price")
+
+
+class _FaixaPrecos:
+    # Posições de um grupo de produtos ordenadas por (preço, posição), com os
+    # preços em paralelo para busca binária; tudo em arrays tipados
+    def __init__(self, precos, posicoes):
+        ordenadas = sorted(posicoes, key=lambda i: (precos[i], i))
+        self.posicoes_originais = array("l", posicoes)
+        self.posicoes = array("l", ordenadas)
+        self.precos = array("d", (precos[i] for i in ordenadas))
+
+    def substituir(self, alteracoes):
+        """Cópia com os preços de algumas posições trocados, sem reordenar tudo.
+
+        `alteracoes` é uma lista de (posicao, preco_antigo, preco_novo); o
+        conjunto de posições do grupo não muda.
+        """
+        novo = _FaixaPrecos.__new__(_FaixaPrecos)
+        novo.posicoes_originais = self.posicoes_originais
+        posicoes = array("l", self.posicoes)
+        precos = array("d", self.precos)
+
+        # Dentro de um mesmo preço as posições estão em ordem crescente
+        for posicao, antigo, _ in alteracoes:
+            i = bisect_left(posicoes, posicao, bisect_left(precos, antigo), bisect_right(precos, antigo))
+            del posicoes[i]
+            del precos[i]
+        for posicao, _, preco in alteracoes:
+            i = bisect_left(posicoes, posicao, bisect_left(precos, preco), bisect_right(precos, preco))
+            posicoes.insert(i, posicao)
+            precos.insert(i, preco)
+
+        novo.posicoes = posicoes
+        novo.precos = precos
+        return novo
+
+    def intervalo(self, min_price=None, max_price=None):
+        inicio = 0 if min_price is None else bisect_left(self.precos, min_price)
+        fim = len(self.precos) if max_price is None else bisect_right(self.precos, max_price)
+        return inicio, max(inicio, fim)
+
+
+class IndiceCatalogo:
+    """Índices de um snapshot: categoria -> posições e preços ordenados.
+
+    As posições se referem à lista `produtos` do snapshot, que não muda depois
+    de construída.
+    """
+
+    def __init__(self, produtos):
+        self.produtos = produtos
+
+        por_categoria = {}
+        self.nomes_categoria = {}
+        for posicao, produto in enumerate(produtos):
+            chave = produto.category.lower()
+            por_categoria.setdefault(chave, []).append(posicao)
+            self.nomes_categoria.setdefault(chave, produto.category)
+
+        self.posicao_por_id = {produto.id: posicao for posicao, produto in enumerate(produtos)}
+        self.precos = precos = array("d", (p.price for p in produtos))
+        self.todos = _FaixaPrecos(precos, range(len(produtos)))
+        self.por_categoria = {
+            chave: _FaixaPrecos(precos, posicoes)
+            for chave, posicoes in por_categoria.items()
+        }
+
+    @classmethod
+    def derivar(cls, anterior, produtos, alteradas):
+        """Índice para `produtos` a partir do `anterior`, com o mesmo layout.
+
+        Os ids continuam nas mesmas posições e só as posições em `alteradas`
+        mudaram: o índice geral é corrigido no lugar (numa cópia) e apenas as
+        categorias envolvidas são reconstruídas; as demais são compartilhadas.
+        """
+        novo = cls.__new__(cls)
+        novo.produtos = produtos
+        novo.posicao_por_id = anterior.posicao_por_id
+        novo.precos = precos = array("d", anterior.precos)
+
+        alteracoes = []
+        por_grupo = {}  # categoria -> alterações só de preço
+        reagrupadas = set()  # categorias que ganharam ou perderam produtos
+        for posicao in alteradas:
+            antigo, atual = anterior.produtos[posicao], produtos[posicao]
+            precos[posicao] = atual.price
+            if antigo.category != atual.category:
+                reagrupadas.add(antigo.category.lower())
+                reagrupadas.add(atual.category.lower())
+            if antigo.price != atual.price:
+                alteracao = (posicao, anterior.precos[posicao], atual.price)
+                alteracoes.append(alteracao)
+                por_grupo.setdefault(atual.category.lower(), []).append(alteracao)
+
+        novo.todos = anterior.todos.substituir(alteracoes) if alteracoes else anterior.todos
+
+        novo.nomes_categoria = {c: n for c, n in anterior.nomes_categoria.items() if c not in reagrupadas}
+        novo.por_categoria = {}
+        for chave, grupo in anterior.por_categoria.items():
+            if chave in reagrupadas:
+                continue
+            novo.por_categoria[chave] = grupo.substituir(por_grupo[chave]) if chave in por_grupo else grupo
+
+        if reagrupadas:
+            membros = {
+                chave: set(anterior.por_categoria[chave].posicoes_originais) if chave in anterior.por_categoria else set()
+                for chave in reagrupadas
+            }
+            for posicao in alteradas:
+                chave_antiga = anterior.produtos[posicao].category.lower()
+                if chave_antiga in membros:
+                    membros[chave_antiga].discard(posicao)
+                chave = produtos[posicao].category.lower()
+                if chave in membros:
+                    membros[chave].add(posicao)
+
+            for chave, posicoes in membros.items():
+                if posicoes:
+                    posicoes = sorted(posicoes)
+                    novo.por_categoria[chave] = _FaixaPrecos(precos, posicoes)
+                    novo.nomes_categoria[chave] = produtos[posicoes[0]].category
+        return novo
+
+    def _grupos(self, categorias):
+        if not categorias:
+            return [self.todos]
+        chaves = dict.fromkeys(c.lower() for c in categorias)
+        return [self.por_categoria[c] for c in chaves if c in self.por_categoria]
+
+    def filtrar(self, categorias=None, min_price=None, max_price=None, sort=None, candidatas=None):
+        """Posições dos produtos filtrados, na ordem pedida.
+
+        Sem `sort` a ordem é a do upstream; com "price"/"-price" a ordem é por
+        preço (desempate pela posição). `candidatas` (posições crescentes, ex.:
+        resultado de uma busca) restringe o resultado a esse conjunto.
+        """
+        if candidatas is not None:
+            return self._filtrar_candidatas(candidatas, categorias, min_price, max_price, sort)
+
+        grupos = self._grupos(categorias)
+
+        if sort is None and min_price is None and max_price is None:
+            if len(grupos) == 1:
+                return grupos[0].posicoes_originais
+            return array("l", merge(*(g.posicoes_originais for g in grupos)))
+
+        intervalos = [(g, *g.intervalo(min_price, max_price)) for g in grupos]
+
+        if sort is None:
+            posicoes = []
+            for grupo, inicio, fim in intervalos:
+                posicoes.extend(grupo.posicoes[inicio:fim])
+            posicoes.sort()
+            return array("l", posicoes)
+
+        if len(intervalos) == 1:
+            grupo, inicio, fim = intervalos[0]
+            posicoes = grupo.posicoes[inicio:fim]
+        else:
+            fatias = [zip(g.precos[inicio:fim], g.posicoes[inicio:fim]) for g, inicio, fim in intervalos]
+            posicoes = array("l", (posicao for _, posicao in merge(*fatias)))
+
+        if sort == "-price":
+            posicoes = posicoes[::-1]
+        return posicoes
+
+    def _filtrar_candidatas(self, candidatas, categorias, min_price, max_price, sort):
+        # Custo proporcional ao número de candidatas, não ao tamanho do catálogo
+        chaves = {c.lower() for c in categorias} if categorias else None
+        produtos, precos = self.produtos, self.precos
+        posicoes = [
+            i for i in candidatas
+            if (chaves is None or produtos[i].category.lower() in chaves)
+            and (min_price is None or precos[i] >= min_price)
+            and (max_price is None or precos[i] <= max_price)
+        ]
+        if sort is not None:
+            posicoes.sort(key=self.chave_ordenacao(sort))
+        return array("l", posicoes)
+
+    def chave_ordenacao(self, sort):
+        # Chave crescente compatível com a ordem devolvida por filtrar()
+        precos = self.precos
+        if sort == "price":
+            return lambda i: (precos[i], i)
+        if sort == "-price":
+            return lambda i: (-precos[i], -i)
+        return lambda i: i
+
+    def categorias(self, posicoes=None):
+        if posicoes is None:
+            return sorted(self.nomes_categoria.values())
+        return sorted({self.produtos[i].category for i in posicoes})
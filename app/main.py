@@ -1,26 +1,36 @@
-from collections import Counter
-from statistics import mean, median
+import admission
+import circuit_breaker
 import fetcher
+import metrics
+import refresher
 
-from flask import Flask, jsonify, request, url_for
+from flask import Flask, Response, g, jsonify, request, stream_with_context, url_for
 from models import Produto
-from pydantic import ValidationError
 import time
 
+import csv
+import io
+import math
 import os
 import platform
 from datetime import datetime, timedelta
 import socket
 from typing import List
+from urllib.parse import quote
 from cache import cache
-from fetcher import CIRCUIT_OPEN, failure_count 
+from config import verdadeiro
+from indexes import ORDENACOES
+from pagination import Cursor, CursorExpirado, CursorInvalido, cursor_para, localizar
+from response_cache import RESPONSE_TTL, comprimir, gerar_etag, negociar_codificacao, respostas
+from search import tokenizar
+from snapshot import SOURCE_URL
 
 app = Flask(__name__)
 start_time = time.time()
-request_count = 0
+request_count = metrics.Contador()
 
-def processar_produtos(produtos, status_code, is_fallback):
-    if produtos is None:
+def processar_produtos(snapshot, status_code, is_fallback):
+    if snapshot is None:
         return jsonify({
             "error": "Serviço indisponível",
             "meta": {
@@ -30,77 +40,124 @@ def processar_produtos(produtos, status_code, is_fallback):
             }
         }), status_code
 
-    integridade = {
-        "erros_por_campo": {},
-        "lista_erros_detectados": set(),
-        "source_url": "https://dummyjson.com/products",
-        "acoes_tomadas": {
-            "aceitos": 0,
-            "descartados": 0
-        }
-    }
-
-    validos = []
-
-    for item in produtos:
-        try:
-            produto_validado = Produto(**item)
-            validos.append(produto_validado)
-            integridade["acoes_tomadas"]["aceitos"] += 1
-        except ValidationError as e:
-            integridade["acoes_tomadas"]["descartados"] += 1
-
-            for erro in e.errors():
-                campo = erro["loc"][0]
-                tipo = erro["type"]
-                valor = item.get(campo, "ausente")
-
-                if campo not in integridade["erros_por_campo"]:
-                    integridade["erros_por_campo"][campo] = {
-                        "quantidade": 0,
-                        "exemplos": []
-                    }
+    return jsonify(_montar_resumo(snapshot, is_fallback)), status_code
 
-                integridade["erros_por_campo"][campo]["quantidade"] += 1
-                integridade["erros_por_campo"][campo]["exemplos"].append(str(valor))
-                integridade["lista_erros_detectados"].add(tipo)
 
-    integridade["lista_erros_detectados"] = list(integridade["lista_erros_detectados"])
-
-    precos = [p.price for p in validos]
-    media_preco = mean(precos) if precos else 0
-    mediana_preco = median(precos) if precos else 0
-
-    categorias = [p.category for p in validos]
-    contagem_por_categoria = dict(Counter(categorias))
-
-    response = {
+def _montar_resumo(snapshot, is_fallback):
+    return {
         "data": {
-            "total_registros": len(produtos),
-            "validos": len(validos),
-            "invalidos": integridade["acoes_tomadas"]["descartados"],
-            "media_preco": media_preco,
-            "mediana_preco": mediana_preco,
-            "contagem_por_categoria": contagem_por_categoria
+            "total_registros": snapshot.total_registros,
+            "validos": len(snapshot.produtos),
+            "invalidos": snapshot.descartados,
+            "media_preco": snapshot.media_preco,
+            "mediana_preco": snapshot.mediana_preco,
+            "contagem_por_categoria": snapshot.contagem_por_categoria,
+            "estatisticas_preco": snapshot.colunas.estatisticas_preco,
+            "estatisticas_por_categoria": snapshot.colunas.estatisticas_por_categoria
         },
         "meta": {
-            "integrity_report": integridade,
+            "integrity_report": snapshot.integridade_resumo,
             "resilience": {
                 "fallback_ativado": is_fallback
             }
         }
     }
 
-    return jsonify(response), status_code
+
+def _corpo_serializado(chave, montar, codificacao):
+    with metrics.medir("response_cache"):
+        corpo = respostas.get((chave, codificacao) if codificacao else chave)
+    if corpo is not None:
+        return corpo
+
+    with metrics.medir("response_cache"):
+        corpo = respostas.get(chave)
+    if corpo is None:
+        with metrics.medir("serialize"):
+            # Mesmos separadores compactos do jsonify fora do modo debug
+            corpo = (app.json.dumps(montar(), separators=(",", ":")) + "\n").encode("utf-8")
+        respostas.set(chave, corpo, ttl=RESPONSE_TTL, fallback=False)
+    if codificacao:
+        with metrics.medir("compress"):
+            corpo = comprimir(corpo, codificacao)
+        respostas.set((chave, codificacao), corpo, ttl=RESPONSE_TTL, fallback=False)
+    return corpo
+
+
+def _resposta_cacheada(endpoint, parametros, snapshot, is_fallback, status_code, montar):
+    # Corpo serializado (e comprimido) uma vez por (endpoint, parâmetros, versão
+    # do snapshot); clientes com o ETag atual recebem 304 sem nenhuma serialização
+    chave = (endpoint, request.host_url, parametros, snapshot.versao, is_fallback)
+    codificacao = negociar_codificacao(request.accept_encodings)
+    etag = gerar_etag(snapshot.versao, chave, codificacao)
+
+    if request.if_none_match.contains_weak(etag):
+        resposta = Response(status=304)
+    else:
+        corpo = _corpo_serializado(chave, montar, codificacao)
+        resposta = Response(corpo, status=status_code, mimetype=app.json.mimetype)
+        if codificacao:
+            resposta.headers["Content-Encoding"] = codificacao
+
+    resposta.set_etag(etag)
+    resposta.headers["Cache-Control"] = "no-cache"
+    resposta.vary.add("Accept-Encoding")
+    return resposta
 
 @app.before_request
 def before_request():
-    global request_count
-    request_count += 1
+    request_count.incrementar()
+    g.inicio_requisicao = time.perf_counter()
+    metrics.iniciar_requisicao()
+
+
+@app.after_request
+def after_request(resposta):
+    duracao = time.perf_counter() - g.inicio_requisicao
+    endpoint = request.endpoint or "desconhecido"
+
+    metrics.registro.contador(
+        "middleware_requests_total",
+        "Requisições atendidas por endpoint e status",
+        endpoint=endpoint,
+        status=resposta.status_code
+    ).incrementar()
+    metrics.registro.histograma(
+        "middleware_request_duration_seconds",
+        "Duração total das requisições por endpoint",
+        endpoint=endpoint
+    ).observar(duracao)
+
+    resposta.headers["Server-Timing"] = metrics.server_timing(total=duracao)
+    if resposta.status_code == 503 and "Retry-After" not in resposta.headers:
+        # Upstream fora e sem fallback (ou carga descartada): indica quando tentar de novo
+        resposta.headers["Retry-After"] = str(admission.RETRY_AFTER)
+    return resposta
+
+
+# Chave do environ com o catálogo já obtido de forma assíncrona (ver asgi.py)
+CATALOGO_ASGI = "client_middleware.catalogo"
+
+
+def _fetch_medido(simular_erro=False):
+    # O refresher é iniciado por processo no primeiro uso do catálogo, não no
+    # import: um worker criado por fork (gunicorn --preload) não herda a thread,
+    # e uma thread que morreu é recriada aqui. Sem pré-aquecimento: a busca
+    # roda na thread do refresher e a requisição segue com o fallback
+    if refresher.REFRESHER_ENABLED and not refresher.refresher.ativo:
+        refresher.refresher.iniciar(prewarm=False)
+
+    pre_buscado = request.environ.get(CATALOGO_ASGI)
+    if pre_buscado is not None and pre_buscado[0] == simular_erro:
+        _, resultado, duracao = pre_buscado
+        metrics.registrar_etapa("fetch", duracao)
+        return resultado
+
+    with metrics.medir("fetch"):
+        return fetcher.fetch_produtos(simular_erro=simular_erro)
 
 @app.route("/status")
 def status():
-    global request_count
     current_time = time.time()
     uptime = current_time - start_time
     
@@ -120,7 +177,7 @@ def status():
             "uptime": f"{hours}h {minutes}m {seconds}s",
             "uptime_seconds": uptime,
             "started_at": datetime.fromtimestamp(start_time).isoformat(),
-            "total_requests": request_count
+            "total_requests": request_count.valor
         },
         
         "system": {
@@ -130,28 +187,183 @@ def status():
         },
         "dependencies": {
             "cache": cache.stats(),
-            "circuit_breaker": {
-                "open": fetcher.CIRCUIT_OPEN,
-                "failure_count": fetcher.failure_count
-            },
-            "last_fetch": {
-                "timestamp": fetcher.LAST_FETCH_TIMESTAMP,
-                "status_code": fetcher.LAST_FETCH_STATUS,
-                "fallback_used": fetcher.LAST_FETCH_FALLBACK
-            }
+            "response_cache": respostas.stats(),
+            "http_pool": fetcher.pool_stats(),
+            "refresher": refresher.refresher.stats(),
+            "circuit_breaker": fetcher.breaker.stats(),
+            "admission": fetcher.admissao.stats(),
+            "last_fetch": fetcher.ultimo_fetch()
         }
     })
 
+@app.route("/metrics")
+def metricas():
+    # Formato texto do Prometheus: contadores e histogramas do registro mais
+    # gauges lidos na hora do cache, do circuit breaker e do pool HTTP
+    caches = (("catalogo", cache.stats()), ("respostas", respostas.stats()))
+    extras = [
+        (
+            f"middleware_cache_{campo}",
+            f"Cache: {campo} por instância",
+            [({"cache": nome_cache}, stats[campo]) for nome_cache, stats in caches if campo in stats]
+        )
+        for campo in ("hits", "misses", "evictions", "expirations", "keys", "bytes")
+    ]
+
+    breakers = [({"upstream": nome}, b.stats()) for nome, b in circuit_breaker.todos().items()]
+    pool = fetcher.pool_stats()
+    admissao = fetcher.admissao.stats()
+    extras += [
+        ("middleware_circuit_breaker_open", "1 se o circuit breaker está aberto ou meio-aberto",
+         [(labels, stats["open"]) for labels, stats in breakers]),
+        ("middleware_circuit_breaker_failures", "Falhas consecutivas do upstream",
+         [(labels, stats["failure_count"]) for labels, stats in breakers]),
+        ("middleware_circuit_breaker_window_failure_rate", "Taxa de falhas na janela deslizante",
+         [(labels, stats["window_failure_rate"]) for labels, stats in breakers]),
+        ("middleware_circuit_breaker_rejected", "Chamadas barradas pelo circuito aberto",
+         [(labels, stats["rejected"]) for labels, stats in breakers]),
+        ("middleware_http_pool_requests", "Requisições enviadas ao upstream", [({}, pool["requests"])]),
+        ("middleware_http_pool_connections_opened", "Conexões novas abertas com o upstream", [({}, pool["connections_opened"])]),
+        ("middleware_admission_in_flight", "Requisições admitidas esperando o upstream",
+         [({"limiter": fetcher.admissao.nome}, admissao["in_flight"])]),
+        ("middleware_admission_queue_depth", "Requisições na fila do controle de admissão",
+         [({"limiter": fetcher.admissao.nome}, admissao["queue_depth"])]),
+        ("middleware_uptime_seconds", "Tempo desde o início do processo", [({}, time.time() - start_time)]),
+    ]
+
+    return Response(
+        metrics.registro.renderizar(extras),
+        content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.route("/data/summary")
 def produtos_summary():
-    produtos, status_code, is_fallback = fetcher.fetch_produtos(simular_erro=False)
-    return processar_produtos(produtos, status_code, is_fallback)
+    snapshot, status_code, is_fallback = _fetch_medido(simular_erro=False)
+    if snapshot is None:
+        return processar_produtos(snapshot, status_code, is_fallback)
+    return _resposta_cacheada(
+        "summary", (), snapshot, is_fallback, status_code,
+        lambda: _montar_resumo(snapshot, is_fallback)
+    )
 
 
 @app.route("/data/summary-test")
 def produtos_summary_test():
-    produtos, status_code, is_fallback = fetcher.fetch_produtos(simular_erro=True)
-    return processar_produtos(produtos, status_code, is_fallback)
+    snapshot, status_code, is_fallback = _fetch_medido(simular_erro=True)
+    return processar_produtos(snapshot, status_code, is_fallback)
+
+PARAMETROS_LISTAGEM = ("page", "limit", "cursor", "q", "category", "min_price", "max_price", "sort", "fields")
+CAMPOS_PRODUTO = tuple(Produto.model_fields)
+MAX_IDS_LOTE = 100
+
+def _parametros_invalidos(errors):
+    return jsonify({
+        "status": "error",
+        "message": "Parâmetros inválidos",
+        "details": errors
+    }), 400
+
+
+def _servico_indisponivel(status_code, is_fallback):
+    # Sem catálogo nem última versão válida para servir
+    return jsonify({
+        "status": "error",
+        "message": "Serviço indisponível",
+        "meta": {
+            "resilience": {
+                "fallback_ativado": is_fallback
+            }
+        }
+    }), status_code
+
+
+def _montar_link(base_url, limit, filtros, page=None, cursor=None):
+    if cursor is not None:
+        link = f"{base_url}?cursor={cursor}&limit={limit}"
+    else:
+        link = f"{base_url}?page={page}&limit={limit}"
+    for nome, valor in filtros.items():
+        if valor:
+            link += f"&{nome}={quote(str(valor), safe=',')}"
+    return link
+
+def _ler_filtros(errors):
+    # Filtros comuns à listagem e à exportação: q, category, min_price, max_price e sort
+    categoria_param = request.args.get("category")
+
+    busca = request.args.get("q", "").strip() or None
+    if busca is not None and not tokenizar(busca):
+        errors.append(f"q inválido: '{busca}' (deve conter ao menos uma letra ou número)")
+
+    precos = {}
+    for nome in ("min_price", "max_price"):
+        valor_str = request.args.get(nome)
+        if valor_str is None:
+            precos[nome] = None
+            continue
+        try:
+            precos[nome] = float(valor_str)
+        except ValueError:
+            precos[nome] = None
+        # nan/inf passam no float(), mas não são JSON válido nem ordenáveis na busca binária
+        if precos[nome] is None or not math.isfinite(precos[nome]):
+            errors.append(f"{nome} inválido: '{valor_str}' (deve ser um número)")
+            precos[nome] = None
+    if precos["min_price"] is not None and precos["max_price"] is not None \
+            and precos["min_price"] > precos["max_price"]:
+        errors.append("min_price não pode ser maior que max_price")
+
+    sort = request.args.get("sort") or None
+    if sort is not None and sort not in ORDENACOES:
+        errors.append(f"sort inválido: '{sort}' (valores aceitos: {', '.join(ORDENACOES)})")
+
+    return categoria_param, precos, sort, busca
+
+
+def _ler_campos(errors):
+    # fields=id,price → só esses atributos são serializados; None = produto completo
+    campos_str = request.args.get("fields")
+    if not campos_str:
+        return None
+    pedidos = {campo.strip() for campo in campos_str.split(",") if campo.strip()}
+    desconhecidos = sorted(pedidos - set(CAMPOS_PRODUTO))
+    if desconhecidos:
+        errors.append(
+            f"fields inválido: {', '.join(desconhecidos)} (campos aceitos: {', '.join(CAMPOS_PRODUTO)})"
+        )
+        return None
+    return tuple(campo for campo in CAMPOS_PRODUTO if campo in pedidos) or None
+
+
+def _projetar(produto, campos):
+    # Campos escalares saem direto dos atributos; só "meta" precisa do model_dump
+    if campos is None:
+        return produto.model_dump()
+    if "meta" in campos:
+        return produto.model_dump(include=set(campos))
+    return {campo: getattr(produto, campo) for campo in campos}
+
+
+def _filtrar_posicoes(snapshot, categoria_param, precos, sort, busca=None):
+    categorias_desejadas = None
+    if categoria_param:
+        categorias_desejadas = [
+            cat.strip()
+            for cat in categoria_param.split(",")
+            if cat.strip()
+        ]
+
+    with metrics.medir("filter"):
+        candidatas = snapshot.busca.buscar(busca) if busca else None
+        posicoes = snapshot.indice.filtrar(
+            categorias=categorias_desejadas,
+            min_price=precos["min_price"],
+            max_price=precos["max_price"],
+            sort=sort,
+            candidatas=candidatas
+        )
+    return categorias_desejadas, posicoes
 
 @app.route("/data/products", methods=["GET"])
 def list_products():
@@ -176,112 +388,107 @@ def list_products():
     except ValueError:
         errors.append(f"limit inválido: '{limit_str}' (deve ser um número inteiro)")
 
-    categoria_param = request.args.get("category")
+    categoria_param, precos, sort, busca = _ler_filtros(errors)
+    campos = _ler_campos(errors)
+
+    cursor = None
+    cursor_str = request.args.get("cursor")
+    if cursor_str:
+        try:
+            cursor = Cursor.decodificar(cursor_str)
+            if cursor.sort != sort:
+                errors.append(f"cursor gerado para outra ordenação (sort={cursor.sort or 'nenhuma'})")
+        except CursorInvalido as e:
+            errors.append(str(e))
 
-    simular_erro_str = request.args.get("simular_erro", "false").lower()
-    simular_erro = simular_erro_str in ("true", "1", "yes", "sim")
+    simular_erro = verdadeiro(request.args.get("simular_erro", "false"))
 
     if errors:
-        return jsonify({
-            "status": "error",
-            "message": "Parâmetros inválidos",
-            "details": errors
-        }), 400
+        return _parametros_invalidos(errors)
 
     try:
-        produtos_raw, status_code, is_fallback = fetcher.fetch_produtos(simular_erro=simular_erro)
+        snapshot, status_code, is_fallback = _fetch_medido(simular_erro=simular_erro)
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": f"Não foi possível obter os dados da fonte: {str(e)}"
         }), 503
 
-    if produtos_raw is None:
+    if snapshot is None:
+        return _servico_indisponivel(status_code, is_fallback)
+
+    montar = lambda: _montar_listagem(snapshot, page, limit, categoria_param, precos, sort, busca, cursor, campos)
+
+    try:
+        if simular_erro:
+            return jsonify(montar())
+
+        parametros = tuple(sorted(
+            (nome, valor)
+            for nome, valor in request.args.items(multi=True)
+            if nome in PARAMETROS_LISTAGEM
+        ))
+        return _resposta_cacheada("products", parametros, snapshot, is_fallback, status_code, montar)
+    except CursorExpirado as e:
         return jsonify({
             "status": "error",
-            "message": "Serviço indisponível",
-            "meta": {
-                "resilience": {
-                    "fallback_ativado": is_fallback
-                }
-            }
-        }), status_code
+            "message": str(e)
+        }), 410
 
-    validos: List[Produto] = []
-    integridade = {
-        "erros_por_campo": {},
-        "tipos_erros_detectados": set(),
-        "source_url": "https://dummyjson.com/products",
-        "acoes_tomadas": {"aceitos": 0, "descartados": 0}
-    }
 
-    for item in produtos_raw:
-        try:
-            prod = Produto(**item)
-            validos.append(prod)
-            integridade["acoes_tomadas"]["aceitos"] += 1
-        except ValidationError as e:
-            integridade["acoes_tomadas"]["descartados"] += 1
-            for erro in e.errors():
-                campo = erro["loc"][0] if erro["loc"] else "desconhecido"
-                tipo_erro = erro["type"]
-                integridade["tipos_erros_detectados"].add(tipo_erro)
-
-                if campo not in integridade["erros_por_campo"]:
-                    integridade["erros_por_campo"][campo] = {
-                        "quantidade": 0,
-                        "exemplos": []
-                    }
-                integridade["erros_por_campo"][campo]["quantidade"] += 1
-                if len(integridade["erros_por_campo"][campo]["exemplos"]) < 3:
-                    integridade["erros_por_campo"][campo]["exemplos"].append(str(item.get(campo, "ausente")))
-
-    integridade["tipos_erros_detectados"] = list(integridade["tipos_erros_detectados"])
-
-    produtos_filtrados = validos
+def _montar_listagem(snapshot, page, limit, categoria_param, precos, sort, busca=None, cursor=None, campos=None):
+    validos: List[Produto] = snapshot.produtos
 
-    if categoria_param:
-        categorias_desejadas = [
-            cat.strip().lower()
-            for cat in categoria_param.split(",")
-            if cat.strip()
-        ]
-        if categorias_desejadas:
-            produtos_filtrados = [
-                p for p in validos
-                if p.category.lower() in categorias_desejadas
-            ]
+    categorias_desejadas, posicoes_filtradas = _filtrar_posicoes(snapshot, categoria_param, precos, sort, busca)
 
-    total_itens_filtrados = len(produtos_filtrados)
+    total_itens_filtrados = len(posicoes_filtradas)
     total_paginas = (total_itens_filtrados + limit - 1) // limit if limit > 0 else 1
 
-    if page > total_paginas and total_paginas > 0:
-        page = total_paginas
-
-    start = (page - 1) * limit
-    end = start + limit
-    produtos_paginados = produtos_filtrados[start:end]
-
-    produtos_json = [p.model_dump() for p in produtos_paginados]
-
-    base_url = url_for("list_products", _external=True)
-    links = {
-        "self": f"{base_url}?page={page}&limit={limit}"
+    if cursor is not None:
+        # Keyset: retoma direto da posição do cursor, sem depender de offset
+        start, end = localizar(snapshot, posicoes_filtradas, cursor, limit)
+        page = start // limit + 1
+    else:
+        if page > total_paginas and total_paginas > 0:
+            page = total_paginas
+
+        start = (page - 1) * limit
+        end = start + limit
+
+    posicoes_pagina = posicoes_filtradas[start:end]
+    produtos_paginados = [validos[i] for i in posicoes_pagina]
+
+    produtos_json = [_projetar(p, campos) for p in produtos_paginados]
+
+    if busca or categorias_desejadas or precos["min_price"] is not None or precos["max_price"] is not None:
+        categorias_encontradas = snapshot.indice.categorias(posicoes_filtradas)
+    else:
+        categorias_encontradas = snapshot.indice.categorias()
+
+    filtros_link = {
+        "q": busca,
+        "category": categoria_param,
+        "min_price": request.args.get("min_price"),
+        "max_price": request.args.get("max_price"),
+        "sort": sort,
+        "fields": ",".join(campos) if campos else None
     }
-    if categoria_param:
-        links["self"] += f"&category={categoria_param}"
+    base_url = url_for("list_products", _external=True)
+    if cursor is not None:
+        links = {"self": _montar_link(base_url, limit, filtros_link, cursor=request.args.get("cursor"))}
+    else:
+        links = {"self": _montar_link(base_url, limit, filtros_link, page=page)}
 
-    if page > 1:
-        links["prev"] = f"{base_url}?page={page-1}&limit={limit}"
-        if categoria_param:
-            links["prev"] += f"&category={categoria_param}"
+    # prev/next carregam cursores: a próxima página é estável mesmo que o snapshot mude
+    if posicoes_pagina and start > 0:
+        anterior = cursor_para(snapshot, sort, posicoes_pagina[0], "prev")
+        links["prev"] = _montar_link(base_url, limit, filtros_link, cursor=anterior.codificar())
 
-    if page < total_paginas:
-        links["next"] = f"{base_url}?page={page+1}&limit={limit}"
-        if categoria_param:
-            links["next"] += f"&category={categoria_param}"
+    if posicoes_pagina and start + len(posicoes_pagina) < total_itens_filtrados:
+        proximo = cursor_para(snapshot, sort, posicoes_pagina[-1], "next")
+        links["next"] = _montar_link(base_url, limit, filtros_link, cursor=proximo.codificar())
 
-    return jsonify({
+    return {
         "status": "success",
         "data": {
             "produtos": produtos_json,
@@ -293,17 +500,152 @@ def list_products():
                 "links": links
             },
             "total_validos_antes_filtro": len(validos),
-            "total_registros_originais": len(produtos_raw),
+            "total_registros_originais": snapshot.total_registros,
+            "busca_aplicada": busca,
             "filtro_categoria_aplicado": categoria_param or "nenhum (todos)",
-            "categorias_encontradas": list(sorted(set(p.category for p in produtos_filtrados)))
+            "filtro_preco_aplicado": {
+                "min_price": precos["min_price"],
+                "max_price": precos["max_price"]
+            },
+            "ordenacao_aplicada": sort or "nenhuma (ordem da fonte)",
+            "categorias_encontradas": categorias_encontradas
         },
         "meta": {
-            "integrity_report": integridade,
-            "fonte": "https://dummyjson.com/products",
-            "timestamp": datetime.utcnow().isoformat() + "Z"
+            "integrity_report": snapshot.integridade_produtos,
+            "fonte": SOURCE_URL,
+            "timestamp": snapshot.criado_em + "Z"
         }
-    })
-        
+    }
+
+
+@app.route("/data/products/batch", methods=["GET"])
+def batch_products():
+    errors = []
+
+    ids_str = request.args.get("ids", "")
+    ids = []
+    for parte in ids_str.split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        try:
+            ids.append(int(parte))
+        except ValueError:
+            errors.append(f"ids inválido: '{parte}' (deve ser uma lista de inteiros separados por vírgula)")
+    ids = list(dict.fromkeys(ids))  # sem repetições, na ordem pedida
+    if not ids and not errors:
+        errors.append("ids é obrigatório (ex.: ids=1,2,3)")
+    if len(ids) > MAX_IDS_LOTE:
+        errors.append(f"máximo de {MAX_IDS_LOTE} ids por chamada")
+
+    campos = _ler_campos(errors)
+
+    if errors:
+        return _parametros_invalidos(errors)
+
+    snapshot, status_code, is_fallback = _fetch_medido(simular_erro=False)
+    if snapshot is None:
+        return _servico_indisponivel(status_code, is_fallback)
+
+    return _resposta_cacheada(
+        "batch", (tuple(ids), campos), snapshot, is_fallback, status_code,
+        lambda: _montar_lote(snapshot, ids, campos)
+    )
+
+
+def _montar_lote(snapshot, ids, campos):
+    # Busca direta pelo mapa id -> posição do snapshot, sem percorrer o catálogo
+    posicao_por_id = snapshot.indice.posicao_por_id
+    produtos = []
+    nao_encontrados = []
+    for id_produto in ids:
+        posicao = posicao_por_id.get(id_produto)
+        if posicao is None:
+            nao_encontrados.append(id_produto)
+        else:
+            produtos.append(_projetar(snapshot.produtos[posicao], campos))
+
+    return {
+        "status": "success",
+        "data": {
+            "produtos": produtos,
+            "total_encontrados": len(produtos),
+            "ids_nao_encontrados": nao_encontrados,
+            "campos": list(campos or CAMPOS_PRODUTO)
+        },
+        "meta": {
+            "fonte": SOURCE_URL,
+            "timestamp": snapshot.criado_em + "Z"
+        }
+    }
+
+
+FORMATOS_EXPORTACAO = ("ndjson", "csv")
+COLUNAS_CSV = ("id", "title", "price", "category", "createdAt", "updatedAt")
+EXPORT_CHUNK_SIZE = 500
+
+
+def _exportar_ndjson(produtos, posicoes):
+    # Agrupa as linhas em blocos para não gerar um write por produto
+    bloco = []
+    for posicao in posicoes:
+        bloco.append(app.json.dumps(produtos[posicao].model_dump()))
+        if len(bloco) >= EXPORT_CHUNK_SIZE:
+            yield "\n".join(bloco) + "\n"
+            bloco = []
+    if bloco:
+        yield "\n".join(bloco) + "\n"
+
+
+def _exportar_csv(produtos, posicoes):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUNAS_CSV)
+
+    for i, posicao in enumerate(posicoes, start=1):
+        p = produtos[posicao]
+        escritor.writerow((
+            p.id, p.title, p.price, p.category,
+            p.meta.createdAt.isoformat(), p.meta.updatedAt.isoformat()
+        ))
+        if i % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@app.route("/data/products/export", methods=["GET"])
+def export_products():
+    errors = []
+    categoria_param, precos, sort, busca = _ler_filtros(errors)
+
+    formato = request.args.get("format", "ndjson").lower()
+    if formato not in FORMATOS_EXPORTACAO:
+        errors.append(f"format inválido: '{formato}' (valores aceitos: {', '.join(FORMATOS_EXPORTACAO)})")
+
+    if errors:
+        return _parametros_invalidos(errors)
+
+    snapshot, status_code, is_fallback = _fetch_medido(simular_erro=False)
+    if snapshot is None:
+        return _servico_indisponivel(status_code, is_fallback)
+
+    _, posicoes = _filtrar_posicoes(snapshot, categoria_param, precos, sort, busca)
+
+    # Gerador sobre o snapshot imutável: memória constante, corpo enviado em chunks
+    if formato == "csv":
+        resposta = Response(stream_with_context(_exportar_csv(snapshot.produtos, posicoes)), mimetype="text/csv")
+        resposta.headers["Content-Disposition"] = "attachment; filename=produtos.csv"
+    else:
+        resposta = Response(stream_with_context(_exportar_ndjson(snapshot.produtos, posicoes)), mimetype="application/x-ndjson")
+
+    resposta.headers["X-Total-Itens"] = str(len(posicoes))
+    resposta.headers["X-Snapshot-Version"] = snapshot.versao
+    return resposta
+
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,188 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+# Limites dos buckets (segundos), do sub-milissegundo até o timeout do upstream
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUANTIS = (0.5, 0.95, 0.99)
+AMOSTRAS_RECENTES = 1024
+
+# Tempos por etapa da requisição atual, para o header Server-Timing
+_tempos_requisicao = contextvars.ContextVar("tempos_requisicao", default=None)
+
+
+def _formatar_labels(labels):
+    if not labels:
+        return ""
+    pares = ",".join(f'{nome}="{valor}"' for nome, valor in labels)
+    return "{" + pares + "}"
+
+
+def _formatar_valor(valor):
+    if valor is None:
+        return "NaN"
+    if isinstance(valor, bool):
+        return "1" if valor else "0"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.valor = 0
+
+    def incrementar(self, quantidade=1):
+        with self.lock:
+            self.valor += quantidade
+
+
+class Histograma:
+    # Buckets cumulativos no formato do Prometheus e uma janela das amostras
+    # mais recentes para os percentis
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contagens = [0] * (len(BUCKETS) + 1)
+        self.soma = 0.0
+        self.total = 0
+        self.recentes = deque(maxlen=AMOSTRAS_RECENTES)
+
+    def observar(self, valor):
+        with self.lock:
+            self.contagens[bisect_left(BUCKETS, valor)] += 1
+            self.soma += valor
+            self.total += 1
+            self.recentes.append(valor)
+
+    def quantis(self):
+        with self.lock:
+            amostras = sorted(self.recentes)
+        if not amostras:
+            return {q: None for q in QUANTIS}
+        return {q: amostras[min(int(q * len(amostras)), len(amostras) - 1)] for q in QUANTIS}
+
+    def copia(self):
+        with self.lock:
+            return list(self.contagens), self.soma, self.total
+
+
+class Registro:
+    """Contadores e histogramas do processo, exportados no formato texto do Prometheus."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contadores = {}
+        self.histogramas = {}
+        self.ajuda = {}
+
+    def _obter(self, tabela, fabrica, nome, ajuda, labels):
+        chave = (nome, tuple(sorted(labels.items())))
+        metrica = tabela.get(chave)
+        if metrica is None:
+            with self.lock:
+                metrica = tabela.get(chave)
+                if metrica is None:
+                    metrica = tabela[chave] = fabrica()
+                    self.ajuda.setdefault(nome, ajuda)
+        return metrica
+
+    def contador(self, nome, ajuda="", **labels):
+        return self._obter(self.contadores, Contador, nome, ajuda, labels)
+
+    def histograma(self, nome, ajuda="", **labels):
+        return self._obter(self.histogramas, Histograma, nome, ajuda, labels)
+
+    def renderizar(self, extras=()):
+        """Texto no formato de exposição do Prometheus.
+
+        `extras` são gauges calculados na hora: (nome, ajuda, [(labels, valor)]).
+        """
+        linhas = []
+
+        with self.lock:
+            contadores = sorted(self.contadores.items())
+            histogramas = sorted(self.histogramas.items())
+
+        ultimo = None
+        for (nome, labels), contador in contadores:
+            if nome != ultimo:
+                linhas.append(f"# HELP {nome} {self.ajuda.get(nome, '')}")
+                linhas.append(f"# TYPE {nome} counter")
+                ultimo = nome
+            linhas.append(f"{nome}{_formatar_labels(labels)} {contador.valor}")
+
+        ultimo = None
+        for (nome, labels), histograma in histogramas:
+            if nome != ultimo:
+                linhas.append(f"# HELP {nome} {self.ajuda.get(nome, '')}")
+                linhas.append(f"# TYPE {nome} histogram")
+                ultimo = nome
+            contagens, soma, total = histograma.copia()
+            acumulado = 0
+            for limite, contagem in zip(BUCKETS, contagens):
+                acumulado += contagem
+                linhas.append(f"{nome}_bucket{_formatar_labels(labels + (('le', limite),))} {acumulado}")
+            linhas.append(f"{nome}_bucket{_formatar_labels(labels + (('le', '+Inf'),))} {total}")
+            linhas.append(f"{nome}_sum{_formatar_labels(labels)} {_formatar_valor(soma)}")
+            linhas.append(f"{nome}_count{_formatar_labels(labels)} {total}")
+
+        ultimo = None
+        for (nome, labels), histograma in histogramas:
+            nome_quantil = f"{nome}_quantile"
+            if nome_quantil != ultimo:
+                linhas.append(f"# HELP {nome_quantil} Percentis das {AMOSTRAS_RECENTES} amostras mais recentes de {nome}")
+                linhas.append(f"# TYPE {nome_quantil} gauge")
+                ultimo = nome_quantil
+            for quantil, valor in histograma.quantis().items():
+                rotulos = _formatar_labels(labels + (("quantile", quantil),))
+                linhas.append(f"{nome_quantil}{rotulos} {_formatar_valor(valor)}")
+
+        for nome, ajuda, amostras in extras:
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} gauge")
+            for labels, valor in amostras:
+                linhas.append(f"{nome}{_formatar_labels(tuple(labels.items()))} {_formatar_valor(valor)}")
+
+        return "\n".join(linhas) + "\n"
+
+
+registro = Registro()
+
+
+def iniciar_requisicao():
+    _tempos_requisicao.set({})
+
+
+def tempos_requisicao():
+    return _tempos_requisicao.get() or {}
+
+
+def registrar_etapa(etapa, duracao):
+    registro.histograma(
+        "middleware_stage_duration_seconds",
+        "Duração de cada etapa do processamento",
+        stage=etapa
+    ).observar(duracao)
+
+    tempos = _tempos_requisicao.get()
+    if tempos is not None:
+        tempos[etapa] = tempos.get(etapa, 0.0) + duracao
+
+
+@contextmanager
+def medir(etapa):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_etapa(etapa, time.perf_counter() - inicio)
+
+
+def server_timing(total=None):
+    # Header Server-Timing com as etapas da requisição atual, em milissegundos
+    partes = [f"{etapa};dur={duracao * 1000:.3f}" for etapa, duracao in tempos_requisicao().items()]
+    if total is not None:
+        partes.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(partes)
@@ -0,0 +1,107 @@
+import base64
+import binascii
+import json
+from bisect import bisect_left, bisect_right
+
+from indexes import ORDENACOES
+
+DIRECOES = ("next", "prev")
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+class CursorExpirado(LookupError):
+    pass
+
+
+class Cursor:
+    """Posição opaca na listagem: versão do snapshot, ordenação, chave, id e posição do item de referência.
+
+    Com direção "next" a página começa logo depois do item; com "prev" ela
+    termina logo antes dele. A posição é o desempate entre itens de mesma
+    chave, usado quando o item de referência some do catálogo.
+    """
+
+    def __init__(self, versao, sort, chave, id_produto, direcao="next", posicao=None):
+        self.versao = versao
+        self.sort = sort
+        self.chave = chave
+        self.id_produto = id_produto
+        self.direcao = direcao
+        self.posicao = posicao
+
+    def codificar(self):
+        payload = {
+            "v": self.versao, "s": self.sort, "k": self.chave, "i": self.id_produto,
+            "d": self.direcao, "p": self.posicao
+        }
+        bruto = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(bruto).decode("ascii").rstrip("=")
+
+    @classmethod
+    def decodificar(cls, token):
+        try:
+            bruto = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            payload = json.loads(bruto)
+            cursor = cls(payload["v"], payload["s"], payload["k"], payload["i"], payload["d"], payload.get("p"))
+        except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+            raise CursorInvalido(f"cursor inválido: '{token}'")
+
+        if cursor.sort not in (None, *ORDENACOES) or cursor.direcao not in DIRECOES \
+                or not isinstance(cursor.id_produto, int) \
+                or (cursor.posicao is not None and (not isinstance(cursor.posicao, int) or cursor.posicao < 0)) \
+                or (cursor.sort is not None and not isinstance(cursor.chave, (int, float))):
+            raise CursorInvalido(f"cursor inválido: '{token}'")
+        return cursor
+
+
+def cursor_para(snapshot, sort, posicao, direcao):
+    produto = snapshot.produtos[posicao]
+    chave = produto.price if sort is not None else None
+    return Cursor(snapshot.versao, sort, chave, produto.id, direcao, posicao)
+
+
+def _posicao_atual(snapshot, cursor):
+    # Mesma versão: a posição gravada no cursor vale; senão reencontra pelo id
+    produtos = snapshot.produtos
+    if cursor.versao == snapshot.versao and cursor.posicao is not None \
+            and cursor.posicao < len(produtos) and produtos[cursor.posicao].id == cursor.id_produto:
+        return cursor.posicao
+    return snapshot.indice.posicao_por_id.get(cursor.id_produto)
+
+
+def localizar(snapshot, posicoes, cursor, limit):
+    """Intervalo [inicio, fim) de `posicoes` que o cursor pede, por busca binária.
+
+    Se o snapshot mudou desde que o cursor foi emitido, o item de referência é
+    reencontrado pelo id (e, na ordenação por preço, pela chave do cursor).
+    Se ele foi removido, a busca recomeça exatamente no lugar que ele ocupava:
+    entre os itens de mesmo preço, pela posição gravada no cursor.
+    """
+    chave = snapshot.indice.chave_ordenacao(cursor.sort)
+    posicao = _posicao_atual(snapshot, cursor)
+
+    if posicao is None and (cursor.sort is None or cursor.posicao is None):
+        raise CursorExpirado("o produto de referência do cursor não existe mais; recomece a paginação")
+
+    if cursor.sort is None:
+        alvo = posicao
+    else:
+        preco = cursor.chave if cursor.sort == "price" else -cursor.chave
+        if posicao is not None:
+            alvo = (preco, posicao if cursor.sort == "price" else -posicao)
+        else:
+            # Produto removido: os que vinham depois dele desceram uma posição e
+            # ocupam a dele; meia posição abaixo separa os já vistos dos demais
+            desempate = cursor.posicao - 0.5
+            alvo = (preco, desempate if cursor.sort == "price" else -desempate)
+
+    # O item de referência (se existir) fica fora das duas direções
+    if cursor.direcao == "next":
+        inicio = bisect_right(posicoes, alvo, key=chave)
+        return inicio, min(inicio + limit, len(posicoes))
+
+    fim = bisect_left(posicoes, alvo, key=chave)
+    return max(fim - limit, 0), fim
@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import time
+
+from cache import DATA_DIR
+from config import env_bool
+
+# Última versão válida do catálogo em disco, para reinícios já "aquecidos"
+SNAPSHOT_PERSISTENCE = env_bool("SNAPSHOT_PERSISTENCE", "true")
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(DATA_DIR, "catalogo.jsonl"))
+FORMATO = 2
+# Opt-in: um arquivo cujo hash confere com a versão gravada é recarregado
+# sem validar de novo, usando o relatório de erros salvo no cabeçalho
+TRUSTED_VALIDATION = env_bool("TRUSTED_VALIDATION", "false")
+
+
+def salvar_catalogo(produtos, versao, path=None, erros=None, fonte=None):
+    """Grava o payload bruto em JSON lines: um cabeçalho e um produto por linha.
+
+    `fonte` é a URL do upstream de onde o catálogo veio. `erros` (opcional) é
+    o relatório da validação desta versão; com ele o catálogo pode ser
+    recarregado sem validar de novo (TRUSTED_VALIDATION).
+
+    A escrita é atômica (arquivo temporário no mesmo diretório + os.replace),
+    então um leitor nunca vê um arquivo pela metade.
+    """
+    path = path or SNAPSHOT_PATH
+    diretorio = os.path.dirname(os.path.abspath(path))
+    os.makedirs(diretorio, mode=0o700, exist_ok=True)
+
+    cabecalho = {
+        "formato": FORMATO,
+        "fonte": fonte,
+        "versao": versao,
+        "salvo_em": time.time(),
+        "total": len(produtos)
+    }
+    if erros is not None:
+        cabecalho["erros"] = [list(erro) for erro in erros]
+
+    fd, temporario = tempfile.mkstemp(dir=diretorio, prefix=".catalogo-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as arquivo:
+            arquivo.write(json.dumps(cabecalho, separators=(",", ":")) + "\n")
+            for item in produtos:
+                arquivo.write(json.dumps(item, separators=(",", ":"), default=str) + "\n")
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, path)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+def _cabecalho_valido(cabecalho, fonte):
+    if not isinstance(cabecalho, dict) or cabecalho.get("formato") != FORMATO:
+        return False
+    if fonte is not None and cabecalho.get("fonte") != fonte:
+        return False  # catálogo de outro upstream
+    salvo_em = cabecalho.get("salvo_em")
+    if not isinstance(salvo_em, (int, float)) or salvo_em > time.time():
+        return False  # sem horário ou gravado "no futuro": não dá para confiar no TTL
+    return isinstance(cabecalho.get("versao"), str) and isinstance(cabecalho.get("total"), int)
+
+
+def carregar_catalogo(path=None, fonte=None):
+    # Retorna (cabecalho, produtos) ou None se não houver arquivo utilizável.
+    # Com `fonte`, só aceita um arquivo gravado para esse mesmo upstream
+    path = path or SNAPSHOT_PATH
+    try:
+        with open(path, encoding="utf-8") as arquivo:
+            cabecalho = json.loads(arquivo.readline())
+            if not _cabecalho_valido(cabecalho, fonte):
+                return None
+            produtos = [json.loads(linha) for linha in arquivo if linha.strip()]
+    except (OSError, ValueError):
+        return None
+
+    if len(produtos) != cabecalho["total"]:
+        return None  # arquivo truncado ou corrompido
+    return cabecalho, produtos
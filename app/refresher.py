@@ -0,0 +1,107 @@
+import threading
+import time
+from datetime import datetime
+
+import fetcher
+from config import env_bool
+
+REFRESHER_ENABLED = env_bool("REFRESHER_ENABLED", "false")
+
+# Um pouco abaixo do TTL, para o cache nunca expirar entre duas execuções
+REFRESH_INTERVAL = fetcher.DEFAULT_TTL * 0.8
+# Após uma falha, tenta de novo antes do próximo ciclo normal
+REFRESH_RETRY_INTERVAL = 10
+
+
+def _iso(instante):
+    return datetime.utcfromtimestamp(instante).isoformat() if instante else None
+
+
+class RefresherCatalogo:
+    """Thread que assume a busca ao upstream e mantém o cache sempre aquecido."""
+
+    def __init__(self, intervalo=REFRESH_INTERVAL, intervalo_retry=REFRESH_RETRY_INTERVAL):
+        self.intervalo = intervalo
+        self.intervalo_retry = intervalo_retry
+        self.lock = threading.Lock()
+        self._inicio_lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+        self.execucoes = 0
+        self.ultima_execucao = None
+        self.ultima_duracao = None
+        self.ultimo_status = None
+        self.proxima_execucao = None
+
+    @property
+    def ativo(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def executar_agora(self):
+        inicio = time.time()
+        snapshot, status_code, is_fallback = fetcher.atualizar_catalogo()
+        fim = time.time()
+
+        sucesso = snapshot is not None and not is_fallback
+        with self.lock:
+            self.execucoes += 1
+            self.ultima_execucao = inicio
+            self.ultima_duracao = fim - inicio
+            self.ultimo_status = 200 if sucesso else 503
+            self.proxima_execucao = fim + (self.intervalo if sucesso else self.intervalo_retry)
+        return sucesso
+
+    def _loop(self):
+        while True:
+            with self.lock:
+                espera = max(self.proxima_execucao - time.time(), 0)
+            if self._parar.wait(espera):
+                return
+            try:
+                self.executar_agora()
+            except Exception:
+                with self.lock:
+                    self.ultimo_status = 503
+                    self.proxima_execucao = time.time() + self.intervalo_retry
+
+    def iniciar(self, prewarm=True):
+        # Idempotente e seguro entre threads: as primeiras requisições
+        # concorrentes de um processo disparam um único início
+        with self._inicio_lock:
+            if self.ativo:
+                return
+
+            # Pré-aquecimento síncrono: o app só começa a servir com o cache carregado
+            if prewarm:
+                self.executar_agora()
+            else:
+                with self.lock:
+                    self.proxima_execucao = time.time()
+
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._loop, name="refresher-catalogo", daemon=True)
+            self._thread.start()
+            fetcher.refresher_catalogo = self
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+        if fetcher.refresher_catalogo is self:
+            fetcher.refresher_catalogo = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": self.ativo,
+                "runs": self.execucoes,
+                "last_run": _iso(self.ultima_execucao),
+                "last_duration_seconds": self.ultima_duracao,
+                "last_status": self.ultimo_status,
+                "next_run": _iso(self.proxima_execucao)
+            }
+
+
+refresher = RefresherCatalogo()
@@ -0,0 +1,48 @@
+import gzip
+import hashlib
+import zlib
+
+from cache import SimpleTTLCache, criar_backend
+from config import env_bool
+
+RESPONSE_CACHE_MAX_ENTRIES = 512
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# As chaves já incluem a versão do snapshot; o TTL só limpa versões antigas
+RESPONSE_TTL = 600
+
+RESPONSE_COMPRESSION = env_bool("RESPONSE_COMPRESSION", "true")
+COMPRESSION_LEVEL = 6
+# Em caso de empate no Accept-Encoding vale a ordem desta tupla
+CODIFICACOES = ("gzip", "deflate")
+
+
+def gerar_etag(versao, chave, codificacao=None):
+    # ETag forte: muda sempre que muda a versão do snapshot ou a representação pedida
+    digest = hashlib.sha1(repr(chave).encode("utf-8")).hexdigest()[:12]
+    if codificacao:
+        return f"{versao[:20]}-{digest}-{codificacao}"
+    return f"{versao[:20]}-{digest}"
+
+
+def negociar_codificacao(accept_encodings):
+    # None = corpo sem compressão (cliente não aceita nenhuma, ou compressão desligada)
+    if not RESPONSE_COMPRESSION:
+        return None
+    return accept_encodings.best_match(CODIFICACOES)
+
+
+def comprimir(corpo, codificacao):
+    if codificacao == "gzip":
+        # mtime fixo: o mesmo corpo gera sempre os mesmos bytes
+        return gzip.compress(corpo, compresslevel=COMPRESSION_LEVEL, mtime=0)
+    return zlib.compress(corpo, COMPRESSION_LEVEL)
+
+
+# Corpos de resposta já serializados, por (endpoint, parâmetros, versão), e
+# as versões comprimidas deles, por (chave, codificação).
+# Não entram no fallback: só o catálogo tem "última versão válida"
+respostas = SimpleTTLCache(backend=criar_backend(
+    "respostas",
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES
+))
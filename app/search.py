@@ -0,0 +1,83 @@
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+_PALAVRA = re.compile(r"\w+")
+
+
+def normalizar(texto):
+    # Minúsculas e sem acentos: "Café Orgânico" -> "cafe organico"
+    decomposto = unicodedata.normalize("NFKD", texto.casefold())
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def tokenizar(texto):
+    return _PALAVRA.findall(normalizar(texto))
+
+
+class IndiceBusca:
+    """Índice invertido do título: token normalizado -> posições dos produtos.
+
+    As posições se referem à lista `produtos` do snapshot e ficam em ordem
+    crescente em arrays tipados, então uma busca só toca as listas dos tokens
+    pedidos, nunca o catálogo inteiro.
+    """
+
+    def __init__(self, produtos):
+        postings = {}
+        for posicao, produto in enumerate(produtos):
+            for token in set(tokenizar(produto.title)):
+                postings.setdefault(token, []).append(posicao)
+        self.postings = {token: array("l", posicoes) for token, posicoes in postings.items()}
+
+    @classmethod
+    def derivar(cls, anterior, produtos_anteriores, produtos, alteradas):
+        # Mesmo layout do snapshot anterior: só os tokens de títulos alterados mudam
+        novo = cls.__new__(cls)
+        novo.postings = dict(anterior.postings)
+
+        saidas, entradas = {}, {}
+        for posicao in alteradas:
+            antes = set(tokenizar(produtos_anteriores[posicao].title))
+            depois = set(tokenizar(produtos[posicao].title))
+            for token in antes - depois:
+                saidas.setdefault(token, set()).add(posicao)
+            for token in depois - antes:
+                entradas.setdefault(token, set()).add(posicao)
+
+        for token in saidas.keys() | entradas.keys():
+            posicoes = set(novo.postings.get(token, ()))
+            posicoes -= saidas.get(token, set())
+            posicoes |= entradas.get(token, set())
+            if posicoes:
+                novo.postings[token] = array("l", sorted(posicoes))
+            else:
+                novo.postings.pop(token, None)
+        return novo
+
+    def buscar(self, consulta):
+        """Posições (crescentes) cujo título contém todos os tokens da consulta."""
+        tokens = set(tokenizar(consulta))
+        listas = []
+        for token in tokens:
+            posicoes = self.postings.get(token)
+            if posicoes is None:
+                return array("l")
+            listas.append(posicoes)
+        if not listas:
+            return array("l")
+
+        # Parte da lista mais curta e confere as demais por busca binária
+        listas.sort(key=len)
+        resultado = listas[0]
+        for outra in listas[1:]:
+            resultado = array("l", (p for p in resultado if _contem(outra, p)))
+            if not resultado:
+                break
+        return resultado
+
+
+def _contem(ordenadas, valor):
+    i = bisect_left(ordenadas, valor)
+    return i < len(ordenadas) and ordenadas[i] == valor
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from pydantic import TypeAdapter, ValidationError
+
+import metrics
+from columnar import ColunasProdutos
+from indexes import IndiceCatalogo
+from models import Meta, Produto
+from search import IndiceBusca
+
+# UPSTREAM_URL permite apontar para outra fonte (ex.: o servidor falso do benchmark)
+SOURCE_URL = os.getenv("UPSTREAM_URL", "https://dummyjson.com/products")
+MAX_EXEMPLOS_PRODUTOS = 3
+
+# Itens por chamada ao pydantic-core: um item inválido só obriga a validar
+# de novo o restante do próprio lote
+LOTE_VALIDACAO = 32
+
+_validador_lote = TypeAdapter(list[Produto])
+
+
+def calcular_versao(produtos):
+    # Hash estável do payload bruto: mesma resposta do upstream => mesma versão
+    payload = json.dumps(produtos, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class CatalogSnapshot:
+    """Catálogo validado de uma versão do upstream, compartilhado pelos endpoints.
+
+    Tudo aqui é calculado uma única vez na construção e tratado como somente
+    leitura pelos handlers. Com `anterior` (mesmos ids nas mesmas posições) e
+    `alteradas`, colunas e índices são derivados do snapshot anterior em vez
+    de recalculados do zero.
+    """
+
+    def __init__(self, versao, total_registros, validos, erros, anterior=None, alteradas=None):
+        self.versao = versao
+        self.criado_em = datetime.utcnow().isoformat()
+        self.total_registros = total_registros
+        self.produtos = validos
+        self.erros = erros
+        self.descartados = len({indice for indice, _, _, _ in erros})
+
+        self.integridade_resumo = self._montar_relatorio(
+            erros, "lista_erros_detectados", max_exemplos=None
+        )
+        self.integridade_produtos = self._montar_relatorio(
+            erros, "tipos_erros_detectados", max_exemplos=MAX_EXEMPLOS_PRODUTOS
+        )
+
+        if anterior is not None:
+            self.colunas = ColunasProdutos.derivar(anterior.colunas, validos, alteradas)
+        else:
+            self.colunas = ColunasProdutos(validos)
+        self.media_preco = self.colunas.estatisticas_preco["media"]
+        self.mediana_preco = self.colunas.estatisticas_preco["mediana"]
+        self.contagem_por_categoria = self.colunas.contagem_por_categoria()
+        if anterior is not None:
+            self.indice = IndiceCatalogo.derivar(anterior.indice, validos, alteradas)
+            self.busca = IndiceBusca.derivar(anterior.busca, anterior.produtos, validos, alteradas)
+        else:
+            self.indice = IndiceCatalogo(validos)
+            self.busca = IndiceBusca(validos)
+
+    def _montar_relatorio(self, erros, chave_tipos, max_exemplos):
+        erros_por_campo = {}
+        tipos = set()
+
+        for _, campo, tipo, valor in erros:
+            tipos.add(tipo)
+            if campo not in erros_por_campo:
+                erros_por_campo[campo] = {
+                    "quantidade": 0,
+                    "exemplos": []
+                }
+            erros_por_campo[campo]["quantidade"] += 1
+            exemplos = erros_por_campo[campo]["exemplos"]
+            if max_exemplos is None or len(exemplos) < max_exemplos:
+                exemplos.append(valor)
+
+        return {
+            "erros_por_campo": erros_por_campo,
+            chave_tipos: list(tipos),
+            "source_url": SOURCE_URL,
+            "acoes_tomadas": {
+                "aceitos": len(self.produtos),
+                "descartados": self.descartados
+            }
+        }
+
+
+def validar_produtos(produtos):
+    """Valida a lista em lotes, cada lote numa única chamada ao pydantic-core.
+
+    Retorna (validos, erros), com os erros como tuplas
+    (indice, campo, tipo, valor) lidas do ValidationError do lote.
+    """
+    validos = []
+    erros = []
+
+    for inicio in range(0, len(produtos), LOTE_VALIDACAO):
+        lote = produtos[inicio:inicio + LOTE_VALIDACAO]
+        try:
+            validos.extend(_validador_lote.validate_python(lote))
+            continue
+        except ValidationError as e:
+            invalidos = set()
+            for erro in e.errors(include_url=False):
+                posicao = erro["loc"][0]
+                campo = erro["loc"][1] if len(erro["loc"]) > 1 else "desconhecido"
+                item = lote[posicao]
+                valor = item.get(campo, "ausente") if isinstance(item, dict) else item
+                erros.append((inicio + posicao, campo, erro["type"], str(valor)))
+                invalidos.add(posicao)
+
+        # O restante do lote já passou na validação acima, então não falha de novo
+        validos.extend(_validador_lote.validate_python(
+            [item for i, item in enumerate(lote) if i not in invalidos]
+        ))
+
+    return validos, erros
+
+
+def _produto_confiavel(item):
+    # Sem validação: só para itens que já foram validados nesta mesma versão
+    meta = item["meta"]
+    return Produto.model_construct(
+        id=int(item["id"]),
+        title=str(item["title"]),
+        price=float(item["price"]),
+        category=str(item["category"]),
+        meta=Meta.model_construct(
+            createdAt=datetime.fromisoformat(meta["createdAt"]),
+            updatedAt=datetime.fromisoformat(meta["updatedAt"])
+        )
+    )
+
+
+def build_snapshot(produtos, versao=None):
+    with metrics.medir("validate"):
+        validos, erros = validar_produtos(produtos)
+
+    if versao is None:
+        versao = calcular_versao(produtos)
+
+    # Índices, colunas e agregados são montados uma vez por snapshot
+    with metrics.medir("index"):
+        return CatalogSnapshot(versao, len(produtos), validos, erros)
+
+
+def build_snapshot_confiavel(produtos, versao, erros):
+    """Reconstrói um snapshot já validado antes, sem passar pelo pydantic.
+
+    `erros` é o relatório da validação original: os índices ali são descartados
+    e os demais itens são montados direto. Cabe a quem chama garantir que
+    `produtos` é exatamente o payload daquela versão.
+    """
+    erros = [tuple(erro) for erro in erros]
+    descartados = {indice for indice, _, _, _ in erros}
+
+    with metrics.medir("validate"):
+        validos = [
+            _produto_confiavel(item)
+            for indice, item in enumerate(produtos)
+            if indice not in descartados
+        ]
+
+    with metrics.medir("index"):
+        return CatalogSnapshot(versao, len(produtos), validos, erros)
+
+
+def _mesma_atualizacao(produto, item):
+    try:
+        return datetime.fromisoformat(item["meta"]["updatedAt"]) == produto.meta.updatedAt
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def atualizar_snapshot(anterior, produtos, versao=None):
+    """Snapshot novo revalidando só o que mudou em relação ao `anterior`.
+
+    Itens com o mesmo id e o mesmo `meta.updatedAt` de um produto válido do
+    snapshot anterior reaproveitam o Produto já validado; os novos, os
+    alterados e os que eram inválidos passam pela validação. Se os ids válidos
+    continuam nas mesmas posições, colunas e índices também são derivados do
+    anterior (ver CatalogSnapshot).
+    """
+    anteriores = {p.id: p for p in anterior.produtos}
+    if len(anteriores) != len(anterior.produtos):
+        return build_snapshot(produtos, versao)  # ids repetidos: o diff por id não se aplica
+
+    reaproveitados = {}
+    pendentes = []
+    for indice, item in enumerate(produtos):
+        produto = anteriores.get(item.get("id")) if isinstance(item, dict) else None
+        if produto is not None and _mesma_atualizacao(produto, item):
+            reaproveitados[indice] = produto
+        else:
+            pendentes.append(indice)
+
+    with metrics.medir("validate"):
+        novos, erros_pendentes = validar_produtos([produtos[i] for i in pendentes])
+
+    erros = [(pendentes[i], campo, tipo, valor) for i, campo, tipo, valor in erros_pendentes]
+    invalidos = {indice for indice, _, _, _ in erros}
+    novos = iter(novos)
+    for indice in pendentes:
+        if indice not in invalidos:
+            reaproveitados[indice] = next(novos)
+    validos = [reaproveitados[i] for i in sorted(reaproveitados)]
+
+    metrics.registro.contador(
+        "middleware_delta_refresh_items_total",
+        "Itens do catálogo no refresh incremental",
+        result="reused"
+    ).incrementar(len(produtos) - len(pendentes))
+    metrics.registro.contador(
+        "middleware_delta_refresh_items_total",
+        "Itens do catálogo no refresh incremental",
+        result="validated"
+    ).incrementar(len(pendentes))
+
+    if versao is None:
+        versao = calcular_versao(produtos)
+
+    with metrics.medir("index"):
+        if len(validos) == len(anterior.produtos) and \
+                all(a.id == b.id for a, b in zip(validos, anterior.produtos)):
+            alteradas = [i for i, (a, b) in enumerate(zip(validos, anterior.produtos)) if a is not b]
+            return CatalogSnapshot(versao, len(produtos), validos, erros, anterior, alteradas)
+        return CatalogSnapshot(versao, len(produtos), validos, erros)
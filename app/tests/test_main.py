@@ -1,9 +1,29 @@
+import asyncio
+import gzip
+import json
+import os
 import pytest
 import requests_mock
+import sys
+import threading
+import time
+import zlib
 from flask import Flask
+import main
 from main import app 
+import admission
+import asgi
+import circuit_breaker
+import fetcher
+import persistence
+import refresher
+import snapshot as snapshot_mod
+from cache import cache
+from response_cache import respostas
 
 from datetime import datetime
+from models import Produto
+from pydantic import ValidationError
 
 # Cria um cliente de teste do Flask que simula requisições HTTP sem rodar um servidor real
 # Ativa modo TESTING para desativar verificações de produção
@@ -20,6 +40,23 @@ def mock_all_requests():
     with requests_mock.Mocker(real_http=False) as m:
         yield m  # O objeto 'm' é injetado nos testes para configurar respostas mockadas
 
+# Isola o estado do cache e do circuit breaker entre os testes e aguarda os
+# refreshes em background antes de desligar o mock do upstream
+@pytest.fixture(autouse=True)
+def estado_limpo(mock_all_requests, monkeypatch, tmp_path):
+    monkeypatch.setattr(fetcher, "MAX_RETRIES", 1)
+    monkeypatch.setattr(persistence, "SNAPSHOT_PATH", str(tmp_path / "catalogo.jsonl"))
+    monkeypatch.setattr(fetcher, "_disco_verificado", False)
+    monkeypatch.setattr(fetcher, "_versao_persistida", None)
+    fetcher.breaker.reset()
+    fetcher.admissao.reset()
+    cache.clear()
+    respostas.clear()
+    yield
+    for chamada in list(fetcher._inflight.values()):
+        chamada.evento.wait(5)
+    fetcher.aguardar_persistencia(5)
+
 # Dados de mock para testes, representando uma resposta típica da API externa
 MOCK_DATA_SAFE = {
     "products": [
@@ -149,4 +186,1379 @@ def test_borda_paginacao_vazia(mock_all_requests, client):
     # Deve retornar uma lista vazia de produtos ou um fallback aceitável (última válida)
     assert len(data["produtos"]) <= 10  # Mesmo que seja fallback, não deve exceder o limite solicitado
     # Verifica que a paginação indica corretamente a página solicitada ou o total de itens encontrados
-    assert data["paginacao"]["pagina_atual"] == 5 or data["paginacao"]["total_itens"] >= 0
\ No newline at end of file
+    assert data["paginacao"]["pagina_atual"] == 5 or data["paginacao"]["total_itens"] >= 0
+
+# Teste 11: o catálogo validado é construído uma vez e reaproveitado nos cache hits
+def test_snapshot_validado_reaproveitado(mock_all_requests, client, monkeypatch):
+    cache.clear()
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    primeiro = client.get("/data/summary")
+    assert primeiro.status_code == 200
+
+    # Qualquer nova validação a partir daqui é uma falha do cache de snapshot
+    def falhar(*args, **kwargs):
+        raise AssertionError("snapshot reconstruído em cache hit")
+    monkeypatch.setattr(fetcher, "build_snapshot", falhar)
+
+    resumo = client.get("/data/summary")
+    produtos = client.get("/data/products")
+    assert resumo.status_code == 200
+    assert produtos.status_code == 200
+    assert resumo.json["data"]["validos"] == 12
+    assert produtos.json["data"]["total_validos_antes_filtro"] == 12
+
+
+# Teste 12: payload idêntico após expirar o TTL reaproveita o mesmo snapshot
+def test_snapshot_mesma_versao_nao_revalida(mock_all_requests, monkeypatch):
+    monkeypatch.setattr(fetcher, "STALE_WHILE_REVALIDATE", False)
+    cache.clear()
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    snapshot, status_code, _ = fetcher.fetch_produtos()
+    assert status_code == 200
+
+    cache.set("produtos_all", snapshot, ttl=-1)  # simula expiração do TTL
+    novo, status_code, _ = fetcher.fetch_produtos()
+    assert status_code == 200
+    assert novo is snapshot
+
+
+# Teste 13: misses concorrentes são coalescidos em uma única chamada ao upstream
+def test_single_flight_coalesce_misses(mock_all_requests):
+    cache.clear()
+    chamadas = []
+
+    def upstream_lento(request, context):
+        chamadas.append(1)
+        time.sleep(0.2)
+        return MOCK_DATA_SAFE
+    mock_all_requests.get("https://dummyjson.com/products", json=upstream_lento)
+
+    resultados = []
+    threads = [
+        threading.Thread(target=lambda: resultados.append(fetcher.fetch_produtos()))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(chamadas) == 1
+    assert len(resultados) == 8
+    assert all(r[1] == 200 and r[0] is resultados[0][0] for r in resultados)
+
+
+# Teste 14: stale-while-revalidate serve o valor expirado e atualiza em background
+def test_stale_while_revalidate(mock_all_requests, monkeypatch):
+    monkeypatch.setattr(fetcher, "STALE_WHILE_REVALIDATE", True)
+    cache.clear()
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    antigo, _, _ = fetcher.fetch_produtos()
+    cache.set("produtos_all", antigo, ttl=-1)  # força a expiração
+
+    novos = {"products": MOCK_DATA_SAFE["products"][:3]}
+    mock_all_requests.get("https://dummyjson.com/products", json=novos)
+
+    servido, status_code, is_fallback = fetcher.fetch_produtos()
+    assert servido is antigo
+    assert status_code == 200 and not is_fallback
+
+    limite = time.time() + 2
+    while cache.get("produtos_all") is None and time.time() < limite:
+        time.sleep(0.01)
+    atualizado, _, _ = fetcher.fetch_produtos()
+    assert atualizado.total_registros == 3
+
+
+# Teste 15: falha do upstream não prende a thread da requisição em retries
+def test_falha_upstream_nao_bloqueia_requisicao(mock_all_requests, monkeypatch):
+    monkeypatch.setattr(fetcher, "MAX_RETRIES", 3)
+    agendados = []
+    monkeypatch.setattr(fetcher, "_revalidar_em_background", agendados.append)
+    mock_all_requests.get("https://dummyjson.com/products", status_code=500)
+
+    inicio = time.time()
+    snapshot, status_code, is_fallback = fetcher.fetch_produtos()
+
+    assert time.time() - inicio < 1
+    assert mock_all_requests.call_count == 1
+    assert snapshot is None and status_code == 503 and is_fallback
+    assert agendados == ["produtos_all"]
+
+
+# Teste 16: requisição esperando uma busca lenta desiste no deadline e usa o fallback
+def test_espera_respeita_deadline(mock_all_requests, monkeypatch):
+    monkeypatch.setattr(fetcher, "REQUEST_DEADLINE", 0.1)
+    chamada, _ = fetcher._registrar_chamada("produtos_all")
+    try:
+        inicio = time.time()
+        snapshot, status_code, is_fallback = fetcher.fetch_produtos()
+        assert time.time() - inicio < 1
+        assert snapshot is None and status_code == 503 and is_fallback
+    finally:
+        fetcher._executar_chamada("produtos_all", chamada, lambda: None)
+
+
+# Teste 17: /status expõe os contadores do pool HTTP compartilhado
+def test_status_expoe_pool_http(client):
+    response = client.get("/status")
+    pool = response.json["dependencies"]["http_pool"]
+    assert {"requests", "connections_opened", "connections_reused"} <= set(pool)
+    assert pool["connections_reused"] == max(pool["requests"] - pool["connections_opened"], 0)
+
+
+# Teste 18: o catálogo completo é carregado página a página a partir do "total"
+def test_catalogo_completo_paginado(mock_all_requests):
+    catalogo = [
+        {"id": i + 1, "title": f"Produto {i+1}", "price": float(i), "category": f"cat{i % 3}",
+         "meta": {"createdAt": "2023-01-01T00:00:00.000Z", "updatedAt": "2023-01-01T00:00:00.000Z"}}
+        for i in range(250)
+    ]
+
+    def paginado(request, context):
+        skip = int(request.qs.get("skip", ["0"])[0])
+        limit = int(request.qs.get("limit", ["30"])[0])
+        return {"products": catalogo[skip:skip + limit], "total": len(catalogo), "skip": skip, "limit": limit}
+    mock_all_requests.get("https://dummyjson.com/products", json=paginado)
+
+    snapshot, status_code, _ = fetcher.fetch_produtos()
+    assert status_code == 200
+    assert mock_all_requests.call_count == 3
+    assert snapshot.total_registros == 250
+    assert [p.id for p in snapshot.produtos] == list(range(1, 251))
+
+
+# Teste 19: falha em uma das páginas invalida a tentativa inteira
+def test_catalogo_falha_em_pagina(mock_all_requests):
+    def pagina_quebrada(request, context):
+        skip = int(request.qs.get("skip", ["0"])[0])
+        if skip > 0:
+            context.status_code = 500
+            return {}
+        return {"products": MOCK_DATA_SAFE["products"], "total": 40}
+    mock_all_requests.get("https://dummyjson.com/products", json=pagina_quebrada)
+
+    snapshot, status_code, is_fallback = fetcher.fetch_produtos()
+    assert snapshot is None and status_code == 503 and is_fallback
+    assert cache.get_last_valid("produtos_all") is None
+
+
+# Teste 20: o refresher pré-aquece o cache e passa a ser o único a buscar no upstream
+def test_refresher_prewarm_e_agenda(mock_all_requests, client, monkeypatch):
+    monkeypatch.setattr(persistence, "SNAPSHOT_PERSISTENCE", False)
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    refresher_teste = refresher.RefresherCatalogo(intervalo=60)
+    refresher_teste.iniciar()
+    try:
+        assert fetcher.refresher_ativo()
+        assert cache.get("produtos_all") is not None
+        chamadas = mock_all_requests.call_count
+
+        # Handlers só leem: um miss não dispara nova busca ao upstream
+        cache.clear()
+        snapshot, status_code, is_fallback = fetcher.fetch_produtos()
+        assert snapshot is None and status_code == 503 and is_fallback
+        assert mock_all_requests.call_count == chamadas
+
+        stats = refresher_teste.stats()
+        assert stats["enabled"] and stats["runs"] == 1 and stats["last_status"] == 200
+        assert stats["next_run"] > stats["last_run"]
+    finally:
+        refresher_teste.parar()
+    assert not fetcher.refresher_ativo()
+    assert "refresher" in client.get("/status").json["dependencies"]
+
+
+# Teste 21: índices de categoria/preço equivalem ao filtro linear
+def test_indice_equivale_filtro_linear():
+    import random
+    from indexes import IndiceCatalogo
+    from models import Produto
+
+    gerador = random.Random(42)
+    produtos = [
+        Produto(id=i, title=f"P{i}", price=float(gerador.randint(0, 50)),
+                category=gerador.choice(["A", "b", "C", "d"]),
+                meta={"createdAt": "2023-01-01T00:00:00", "updatedAt": "2023-01-01T00:00:00"})
+        for i in range(300)
+    ]
+    indice = IndiceCatalogo(produtos)
+
+    for categorias in (None, ["a"], ["B", "c"], ["x"]):
+        for min_price, max_price in ((None, None), (10, None), (None, 20), (15, 15), (30, 5)):
+            esperado = [
+                i for i, p in enumerate(produtos)
+                if (not categorias or p.category.lower() in [c.lower() for c in categorias])
+                and (min_price is None or p.price >= min_price)
+                and (max_price is None or p.price <= max_price)
+            ]
+            assert list(indice.filtrar(categorias, min_price, max_price)) == esperado
+            por_preco = sorted(esperado, key=lambda i: (produtos[i].price, i))
+            assert list(indice.filtrar(categorias, min_price, max_price, sort="price")) == por_preco
+            assert list(indice.filtrar(categorias, min_price, max_price, sort="-price")) == por_preco[::-1]
+
+
+# Teste 22: filtros de preço e ordenação em /data/products
+def test_products_filtro_preco_e_ordenacao(mock_all_requests, client):
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    response = client.get("/data/products?min_price=120&max_price=160&sort=-price")
+    assert response.status_code == 200
+    data = response.json["data"]
+    precos = [p["price"] for p in data["produtos"]]
+    assert precos == sorted(precos, reverse=True)
+    assert precos and all(120 <= preco <= 160 for preco in precos)
+    assert "sort=-price" in data["paginacao"]["links"]["self"]
+
+    invalido = client.get("/data/products?sort=preco&min_price=abc")
+    assert invalido.status_code == 400
+    assert len(invalido.json["details"]) == 2
+
+    for valor in ("nan", "inf", "-Infinity"):
+        response = client.get(f"/data/products?min_price={valor}")
+        assert response.status_code == 400
+        assert response.json["details"] == [f"min_price inválido: '{valor}' (deve ser um número)"]
+    assert client.get("/data/products/export?max_price=NaN").status_code == 400
+
+
+# Teste 23: estatísticas colunares batem com o cálculo direto sobre a lista
+def test_estatisticas_colunares(mock_all_requests, client):
+    from statistics import mean, median, quantiles
+
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    data = client.get("/data/summary").json["data"]
+    precos = [p["price"] for p in MOCK_DATA_SAFE["products"]]
+
+    assert data["media_preco"] == pytest.approx(mean(precos))
+    assert data["mediana_preco"] == pytest.approx(median(precos))
+    stats = data["estatisticas_preco"]
+    assert stats["min"] == min(precos) and stats["max"] == max(precos)
+    p25, _, p75 = quantiles(precos, n=4, method="inclusive")
+    assert stats["percentis"]["p25"] == pytest.approx(p25)
+    assert stats["percentis"]["p75"] == pytest.approx(p75)
+    categoria = data["estatisticas_por_categoria"]["eletronicos"]
+    assert categoria["quantidade"] == 12
+    assert categoria["media"] == pytest.approx(mean(precos))
+
+
+# Teste 24: respostas pré-serializadas com ETag forte e 304 para If-None-Match
+def test_etag_e_304(mock_all_requests, client, monkeypatch):
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    primeira = client.get("/data/summary")
+    etag = primeira.headers["ETag"]
+    assert primeira.status_code == 200
+    assert not etag.startswith("W/")
+
+    # Nem 304 nem cache hit devem montar a resposta de novo
+    def falhar(*args, **kwargs):
+        raise AssertionError("resposta remontada")
+    monkeypatch.setattr(main, "_montar_resumo", falhar)
+
+    revalidada = client.get("/data/summary", headers={"If-None-Match": etag})
+    assert revalidada.status_code == 304
+    assert revalidada.data == b""
+    assert revalidada.headers["ETag"] == etag
+
+    repetida = client.get("/data/summary")
+    assert repetida.status_code == 200
+    assert repetida.data == primeira.data
+
+
+# Teste 25: ETag muda com os parâmetros e com a versão do snapshot
+def test_etag_por_parametros_e_versao(mock_all_requests, client):
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    pagina1 = client.get("/data/products?limit=5&page=1")
+    reordenada = client.get("/data/products?page=1&limit=5")
+    pagina2 = client.get("/data/products?limit=5&page=2")
+    assert pagina1.headers["ETag"] == reordenada.headers["ETag"]
+    assert pagina1.headers["ETag"] != pagina2.headers["ETag"]
+
+    cache.clear()
+    novos = {"products": MOCK_DATA_SAFE["products"][:4]}
+    mock_all_requests.get("https://dummyjson.com/products", json=novos)
+    nova_versao = client.get("/data/products?limit=5&page=1", headers={"If-None-Match": pagina1.headers["ETag"]})
+    assert nova_versao.status_code == 200
+    assert len(nova_versao.json["data"]["produtos"]) == 4
+
+
+# Teste 26: cache limitado por entradas/bytes com despejo LRU, sem perder o fallback
+def test_cache_lru_limitado():
+    from cache import SimpleTTLCache
+
+    limitado = SimpleTTLCache(max_entries=2, max_bytes=10)
+    limitado.set("a", b"1234", ttl=60)
+    limitado.set("b", b"1234", ttl=60, fallback=False)
+    assert limitado.get("a") == b"1234"  # "a" passa a ser a mais recente
+    limitado.set("c", b"1234", ttl=60, fallback=False)
+
+    assert limitado.get("b") is None
+    assert limitado.get("a") == b"1234" and limitado.get("c") == b"1234"
+
+    limitado.set("d", b"123456789", ttl=60, fallback=False)  # estoura max_bytes
+    stats = limitado.stats()
+    assert stats["bytes"] <= 10
+    assert stats["evictions"] == 3
+    assert limitado.get_last_valid("a") == b"1234"
+    assert limitado.get_last_valid("b") is None
+    assert stats["fallback_keys"] == 1
+
+    # Objetos não têm tamanho estimável: com max_bytes é preciso informar size=
+    with pytest.raises(ValueError):
+        limitado.set("e", {"objeto": 1}, ttl=60)
+    limitado.set("e", {"objeto": 1}, ttl=60, size=3)
+    assert limitado.stats()["bytes"] <= 10
+    # Sem max_bytes (o cache do catálogo), o total de bytes não é reportado
+    assert "bytes" not in SimpleTTLCache(max_entries=2).stats()
+    assert "bytes" not in cache.stats()
+
+
+# Teste 27: a varredura periódica remove entradas expiradas nunca relidas
+def test_cache_varredura_expirados():
+    from cache import SimpleTTLCache
+
+    varrido = SimpleTTLCache(sweep_interval=0)
+    for i in range(5):
+        varrido.set(f"k{i}", i, ttl=-1, fallback=False)
+    varrido.set("viva", 1, ttl=60, fallback=False)
+
+    stats = varrido.stats()
+    assert stats["keys"] == 1
+    assert stats["expirations"] == 5
+
+
+def _gravar_em_outro_processo(path):
+    from cache_backends import SQLiteBackend
+
+    backend = SQLiteBackend(path, namespace="teste")
+    backend.set("produtos_all", {"versao": "abc"}, ttl=60)
+    backend.get("produtos_all")
+    backend.stats()  # força o flush dos contadores deste processo
+
+
+# Teste 28: backend SQLite compartilha entradas e contadores entre processos
+def test_cache_sqlite_compartilhado_entre_processos(tmp_path):
+    import multiprocessing
+    from cache import SimpleTTLCache
+    from cache_backends import SQLiteBackend
+
+    path = str(tmp_path / "cache.sqlite3")
+    compartilhado = SimpleTTLCache(backend=SQLiteBackend(path, namespace="teste"))
+    assert compartilhado.get("produtos_all") is None
+
+    processo = multiprocessing.get_context("spawn").Process(target=_gravar_em_outro_processo, args=(path,))
+    processo.start()
+    processo.join(30)
+    assert processo.exitcode == 0
+
+    assert compartilhado.get("produtos_all") == {"versao": "abc"}
+    assert compartilhado.get_last_valid("produtos_all") == {"versao": "abc"}
+    stats = compartilhado.stats()
+    assert stats["backend"] == "sqlite"
+    assert stats["workers"] == 2
+    assert stats["hits"] == 2 and stats["misses"] == 1
+
+
+# Teste 29: após reiniciar sem upstream, o catálogo salvo em disco vira fallback
+def test_snapshot_persistido_para_reinicio(mock_all_requests, monkeypatch):
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    salvar = persistence.salvar_catalogo
+    gravacoes = []
+
+    def salvar_registrado(*args, **kwargs):
+        gravacoes.append(threading.current_thread())
+        return salvar(*args, **kwargs)
+    monkeypatch.setattr(persistence, "salvar_catalogo", salvar_registrado)
+
+    original, _, _ = fetcher.fetch_produtos()
+    fetcher.aguardar_persistencia(5)
+    # O fsync não roda na thread da requisição que liderou a busca
+    assert len(gravacoes) == 1 and gravacoes[0] is not threading.current_thread()
+    cabecalho, produtos = persistence.carregar_catalogo()
+    assert cabecalho["versao"] == original.versao
+    assert len(produtos) == 12
+
+    # Simula um novo processo: memória vazia e upstream fora do ar
+    cache.clear()
+    monkeypatch.setattr(fetcher, "_disco_verificado", False)
+    monkeypatch.setattr(fetcher, "STALE_WHILE_REVALIDATE", False)
+    monkeypatch.setattr(fetcher, "_revalidar_em_background", lambda cache_key: None)
+    cabecalho["salvo_em"] -= 3600
+    with open(persistence.SNAPSHOT_PATH, "r+", encoding="utf-8") as arquivo:
+        linhas = arquivo.readlines()
+        linhas[0] = json.dumps(cabecalho) + "\n"
+        arquivo.seek(0)
+        arquivo.writelines(linhas)
+        arquivo.truncate()
+    mock_all_requests.get("https://dummyjson.com/products", status_code=500)
+
+    snapshot, status_code, is_fallback = fetcher.fetch_produtos()
+    assert status_code == 200 and is_fallback
+    assert snapshot.versao == original.versao
+    assert len(snapshot.produtos) == 12
+
+
+# Teste 30: arquivo truncado é ignorado em vez de virar um catálogo parcial
+def test_snapshot_persistido_truncado(tmp_path):
+    path = str(tmp_path / "truncado.jsonl")
+    persistence.salvar_catalogo(MOCK_DATA_SAFE["products"], "v1", path=path)
+    with open(path, "r+", encoding="utf-8") as arquivo:
+        linhas = arquivo.readlines()
+        arquivo.seek(0)
+        arquivo.writelines(linhas[:-2])
+        arquivo.truncate()
+    assert persistence.carregar_catalogo(path) is None
+
+
+# Teste 31: exportação NDJSON em streaming respeita os filtros da listagem
+def test_export_ndjson_streaming(mock_all_requests, client):
+    produtos = [dict(p, category="livros" if p["id"] % 2 else "eletronicos") for p in MOCK_DATA_SAFE["products"]]
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": produtos})
+
+    response = client.get("/data/products/export?category=Livros&sort=-price")
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == "application/x-ndjson"
+
+    linhas = [json.loads(linha) for linha in response.get_data(as_text=True).splitlines()]
+    assert len(linhas) == 6 == int(response.headers["X-Total-Itens"])
+    assert all(p["category"] == "livros" for p in linhas)
+    assert [p["price"] for p in linhas] == sorted((p["price"] for p in linhas), reverse=True)
+
+
+# Teste 32: exportação CSV e validação do formato
+def test_export_csv(mock_all_requests, client):
+    import csv
+    import io
+
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    response = client.get("/data/products/export?format=csv&max_price=130")
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    linhas = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert linhas[0] == ["id", "title", "price", "category", "createdAt", "updatedAt"]
+    assert [int(linha[0]) for linha in linhas[1:]] == [1, 2, 3, 4]
+
+    assert client.get("/data/products/export?format=xml").status_code == 400
+
+
+def _catalogo(quantidade, preco=lambda i: float(i % 7)):
+    return [
+        {"id": i + 1, "title": f"Produto {i+1}", "price": preco(i), "category": "eletronicos",
+         "meta": {"createdAt": "2023-01-01T00:00:00.000Z", "updatedAt": "2023-01-01T00:00:00.000Z"}}
+        for i in range(quantidade)
+    ]
+
+
+def _seguir_links(client, url, direcao="next"):
+    vistos = []
+    while url:
+        response = client.get(url.replace("http://localhost", ""))
+        assert response.status_code == 200
+        vistos.extend(p["id"] for p in response.json["data"]["produtos"])
+        url = response.json["data"]["paginacao"]["links"].get(direcao)
+    return vistos
+
+
+# Teste 33: links next/prev com cursor percorrem o catálogo inteiro sem repetir itens
+def test_cursor_percorre_catalogo(mock_all_requests, client):
+    catalogo = _catalogo(23)
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": catalogo})
+
+    for sort, esperado in (
+        ("", [p["id"] for p in catalogo]),
+        ("price", [p["id"] for p in sorted(catalogo, key=lambda p: (p["price"], p["id"]))]),
+        ("-price", [p["id"] for p in sorted(catalogo, key=lambda p: (p["price"], p["id"]))][::-1]),
+    ):
+        primeira = client.get(f"/data/products?limit=5&sort={sort}")
+        links = primeira.json["data"]["paginacao"]["links"]
+        assert "cursor=" in links["next"] and "page=" not in links["next"]
+        assert _seguir_links(client, f"/data/products?limit=5&sort={sort}") == esperado
+
+        # Da última página, os links "prev" voltam até o início
+        ultima = client.get(f"/data/products?limit=5&page=5&sort={sort}")
+        ids_ultima = [p["id"] for p in ultima.json["data"]["produtos"]]
+        anteriores = _seguir_links(client, ultima.json["data"]["paginacao"]["links"]["prev"], "prev")
+        assert len(anteriores) + len(ids_ultima) == 23
+
+
+# Teste 34: cursor continua de onde parou mesmo se o snapshot mudar
+def test_cursor_estavel_entre_snapshots(mock_all_requests, client):
+    catalogo = _catalogo(10)
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": catalogo})
+    proximo = client.get("/data/products?limit=4&sort=price").json["data"]["paginacao"]["links"]["next"]
+    vistos = [p["id"] for p in client.get("/data/products?limit=4&sort=price").json["data"]["produtos"]]
+
+    # Novo snapshot com um item barato inserido antes do cursor
+    cache.clear()
+    novo = [dict(catalogo[0], id=99, price=0.0)] + catalogo
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": novo})
+    restante = _seguir_links(client, proximo)
+    assert not set(vistos) & set(restante)
+    assert 99 not in restante
+    assert len(vistos) + len(restante) == 10
+
+
+# Teste 35: cursores inválidos, de outra ordenação ou de produto removido
+def test_cursor_invalido_ou_expirado(mock_all_requests, client):
+    catalogo = _catalogo(6)
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": catalogo})
+    assert client.get("/data/products?cursor=lixo!").status_code == 400
+
+    proximo = client.get("/data/products?limit=2&sort=price").json["data"]["paginacao"]["links"]["next"]
+    token = proximo.split("cursor=")[1].split("&")[0]
+    assert client.get(f"/data/products?limit=2&cursor={token}").status_code == 400
+
+    proximo = client.get("/data/products?limit=2").json["data"]["paginacao"]["links"]["next"]
+    cache.clear()
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": catalogo[2:]})
+    assert client.get(proximo.replace("http://localhost", "")).status_code == 410
+
+
+# Teste 36: Server-Timing traz as etapas da requisição e /metrics exporta os histogramas
+def test_server_timing_e_metrics(mock_all_requests, client):
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": _catalogo(8)})
+
+    response = client.get("/data/products?limit=3&sort=price")
+    etapas = {parte.split(";")[0] for parte in response.headers["Server-Timing"].split(", ")}
+    assert {"fetch", "upstream", "validate", "filter", "serialize", "total"} <= etapas
+
+    # Segunda chamada: catálogo em cache, sem upstream nem validação
+    response = client.get("/data/products?limit=3&sort=price")
+    etapas = {parte.split(";")[0] for parte in response.headers["Server-Timing"].split(", ")}
+    assert "upstream" not in etapas and "validate" not in etapas
+
+    texto = client.get("/metrics").get_data(as_text=True)
+    assert 'middleware_requests_total{endpoint="list_products",status="200"}' in texto
+    assert 'middleware_stage_duration_seconds_bucket{stage="upstream",le="+Inf"}' in texto
+    assert 'middleware_stage_duration_seconds_quantile{stage="upstream",quantile="0.99"}' in texto
+    assert 'middleware_upstream_fetches_total{result="ok"}' in texto
+    assert 'middleware_cache_hits{cache="catalogo"}' in texto
+    assert 'middleware_circuit_breaker_open{upstream="https://dummyjson.com/products"} 0' in texto
+
+
+# Teste 37: contador de requisições não perde incrementos com threads concorrentes
+def test_contador_requisicoes_thread_safe(client):
+    antes = main.request_count.valor
+
+    def disparar():
+        with app.test_client() as c:
+            for _ in range(25):
+                c.get("/metrics")
+
+    threads = [threading.Thread(target=disparar) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert main.request_count.valor - antes == 200
+
+
+# Teste 38: circuito abre após falhas seguidas e, no meio-aberto, só uma sonda chega ao upstream
+def test_circuit_breaker_meio_aberto_admite_uma_sonda():
+    breaker = circuit_breaker.CircuitBreaker("teste", failure_threshold=3, reset_timeout=0.05)
+    for _ in range(3):
+        assert breaker.permitir()
+        breaker.registrar_falha()
+    assert breaker.stats()["state"] == "open"
+    assert not breaker.permitir()
+
+    time.sleep(0.06)
+    admitidas = []
+    barreira = threading.Barrier(10)
+
+    def tentar():
+        barreira.wait()
+        admitidas.append(breaker.permitir())
+
+    threads = [threading.Thread(target=tentar) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert admitidas.count(True) == 1
+    assert breaker.stats()["state"] == "half_open"
+
+    # Sonda falhou: reabre por mais um período; depois, sonda com sucesso fecha
+    breaker.registrar_falha()
+    assert breaker.stats()["state"] == "open" and not breaker.permitir()
+    time.sleep(0.06)
+    assert breaker.permitir()
+    breaker.registrar_sucesso()
+    assert breaker.stats()["state"] == "closed" and breaker.permitir()
+
+
+# Teste 39: taxa de falhas na janela deslizante abre o circuito sem falhas consecutivas
+def test_circuit_breaker_taxa_na_janela():
+    breaker = circuit_breaker.CircuitBreaker("teste", failure_threshold=100, taxa_falhas=0.5, minimo_janela=6)
+    for sucesso in (True, False, True, False, True):
+        breaker.registrar_sucesso() if sucesso else breaker.registrar_falha()
+    assert breaker.stats()["state"] == "closed"
+    breaker.registrar_falha()  # 3 de 6 → 50%
+    assert breaker.stats()["state"] == "open"
+
+    # Instâncias por upstream são independentes
+    assert circuit_breaker.breaker_para("http://outra-fonte") is not fetcher.breaker
+    assert circuit_breaker.breaker_para("http://outra-fonte").stats()["state"] == "closed"
+
+
+# Teste 40: com o circuito aberto, o upstream não é chamado e /status mostra o estado atual
+def test_circuito_aberto_nao_chama_upstream(mock_all_requests, client):
+    mock_all_requests.get("https://dummyjson.com/products", status_code=500)
+    for _ in range(fetcher.breaker.failure_threshold):
+        fetcher._buscar_upstream(fetcher.CACHE_KEY, tentativas=1)
+    chamadas = mock_all_requests.call_count
+
+    response = client.get("/data/summary")
+    assert response.status_code == 503
+    assert mock_all_requests.call_count == chamadas
+
+    status = client.get("/status").json["dependencies"]
+    assert status["circuit_breaker"]["state"] == "open"
+    assert status["circuit_breaker"]["rejected"] >= 1
+    assert status["last_fetch"]["fallback_used"] is True
+
+
+async def _chamar_asgi(caminho, cabecalhos=()):
+    caminho, _, query = caminho.partition("?")
+    scope = {
+        "type": "http", "method": "GET", "path": caminho, "query_string": query.encode(),
+        "headers": [(b"host", b"localhost")] + [(n.encode(), v.encode()) for n, v in cabecalhos],
+        "server": ("localhost", 80), "scheme": "http", "http_version": "1.1",
+    }
+    mensagens = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(mensagem):
+        mensagens.append(mensagem)
+
+    await asgi.application(scope, receive, send)
+    cabecalhos = {n.decode(): v.decode() for n, v in mensagens[0]["headers"]}
+    corpo = b"".join(m.get("body", b"") for m in mensagens[1:])
+    return mensagens[0]["status"], cabecalhos, corpo
+
+
+# Teste 41: modo ASGI responde com os mesmos contratos do app Flask
+def test_asgi_mesmos_contratos(mock_all_requests, client):
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": _catalogo(15)})
+
+    for caminho in (
+        "/data/summary",
+        "/data/products?limit=4&sort=-price&category=cat-1",
+        "/data/products?page=0",
+        "/data/products?limit=3&simular_erro=true",
+    ):
+        esperado = client.get(caminho)
+        status, cabecalhos, corpo = asyncio.run(_chamar_asgi(caminho))
+        assert status == esperado.status_code
+        recebido, esperado = json.loads(corpo), esperado.json
+        if "simular_erro" in caminho:  # snapshot novo a cada chamada
+            recebido["meta"].pop("timestamp"), esperado["meta"].pop("timestamp")
+        assert recebido == esperado
+        assert "fetch" in cabecalhos["server-timing"] or status == 400
+
+    status, cabecalhos, corpo = asyncio.run(_chamar_asgi("/status"))
+    assert status == 200 and set(json.loads(corpo)) == set(client.get("/status").json)
+
+    # ETag/304 e exportação em streaming também passam pelo adaptador
+    etag = client.get("/data/summary").headers["ETag"]
+    status, _, corpo = asyncio.run(_chamar_asgi("/data/summary", [("if-none-match", etag)]))
+    assert status == 304 and corpo == b""
+    status, cabecalhos, corpo = asyncio.run(_chamar_asgi("/data/products/export?format=ndjson"))
+    assert status == 200 and len(corpo.splitlines()) == int(cabecalhos["x-total-itens"])
+
+
+# Teste 42: muitas requisições concorrentes com upstream lento → uma busca e uma thread só
+def test_asgi_concorrencia_upstream_lento(mock_all_requests):
+    catalogo = {"products": _catalogo(10)}
+
+    def lento(request, context):
+        time.sleep(0.3)
+        return catalogo
+
+    mock_all_requests.get("https://dummyjson.com/products", json=lento)
+
+    async def disparar():
+        threads_antes = threading.active_count()
+        tarefas = [asyncio.create_task(_chamar_asgi("/data/summary")) for _ in range(300)]
+        await asyncio.sleep(0.1)
+        threads_durante = threading.active_count()
+        return await asyncio.gather(*tarefas), threads_durante - threads_antes
+
+    respostas_asgi, threads_extras = asyncio.run(disparar())
+    assert {status for status, _, _ in respostas_asgi} == {200}
+    assert mock_all_requests.call_count == 1
+    assert threads_extras <= 2
+
+
+def _catalogo_com_invalidos(quantidade):
+    catalogo = _catalogo(quantidade)
+    catalogo[3]["price"] = -1
+    catalogo[40]["title"] = None
+    del catalogo[41]["meta"]
+    catalogo[70]["meta"]["createdAt"] = "ontem"
+    catalogo[71]["price"] = "12.5"  # coerção do modo lax continua valendo
+    return catalogo
+
+
+# Teste 43: validação em lote gera os mesmos produtos e erros da validação item a item
+def test_validacao_em_lote_equivale_a_item_a_item():
+    catalogo = _catalogo_com_invalidos(100)
+
+    esperados, erros_esperados = [], []
+    for indice, item in enumerate(catalogo):
+        try:
+            esperados.append(Produto(**item))
+        except ValidationError as e:
+            for erro in e.errors():
+                campo = erro["loc"][0] if erro["loc"] else "desconhecido"
+                erros_esperados.append((indice, campo, erro["type"], str(item.get(campo, "ausente"))))
+
+    validos, erros = snapshot_mod.validar_produtos(catalogo)
+    assert [p.model_dump() for p in validos] == [p.model_dump() for p in esperados]
+    assert erros == erros_esperados
+
+    snapshot = snapshot_mod.build_snapshot(catalogo)
+    assert snapshot.descartados == 4
+    assert set(snapshot.integridade_resumo["erros_por_campo"]) == {"price", "title", "meta"}
+
+
+# Teste 44: modo confiável recarrega do disco sem validar quando o hash confere
+def test_recarga_confiavel_sem_validacao(mock_all_requests, monkeypatch):
+    catalogo = _catalogo_com_invalidos(80)
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": catalogo})
+    original, _, _ = fetcher.fetch_produtos()
+    fetcher.aguardar_persistencia(5)
+
+    def recarregar():
+        cache.clear()
+        monkeypatch.setattr(fetcher, "_disco_verificado", False)
+        fetcher._carregar_do_disco(fetcher.CACHE_KEY)
+        return cache.get_last_valid(fetcher.CACHE_KEY)
+
+    monkeypatch.setattr(persistence, "TRUSTED_VALIDATION", True)
+    validar = snapshot_mod.validar_produtos
+    monkeypatch.setattr(snapshot_mod, "validar_produtos", lambda produtos: pytest.fail("validou de novo"))
+    recarregado = recarregar()
+    assert recarregado.versao == original.versao
+    assert [p.model_dump() for p in recarregado.produtos] == [p.model_dump() for p in original.produtos]
+    assert recarregado.integridade_resumo == original.integridade_resumo
+    assert recarregado.contagem_por_categoria == original.contagem_por_categoria
+
+    # Arquivo alterado: o hash não confere e a validação completa volta a rodar
+    chamadas = []
+    monkeypatch.setattr(snapshot_mod, "validar_produtos", lambda produtos: chamadas.append(1) or validar(produtos))
+    with open(persistence.SNAPSHOT_PATH, "r+", encoding="utf-8") as arquivo:
+        linhas = arquivo.readlines()
+        linhas[1] = linhas[1].replace('"Produto 1"', '"Produto X"')
+        arquivo.seek(0)
+        arquivo.writelines(linhas)
+        arquivo.truncate()
+    assert recarregar().produtos[0].title == "Produto X"
+    assert chamadas == [1]
+
+
+def _comparar_snapshots(derivado, completo):
+    assert [p.model_dump() for p in derivado.produtos] == [p.model_dump() for p in completo.produtos]
+    assert derivado.integridade_resumo == completo.integridade_resumo
+    assert derivado.colunas.estatisticas_preco == completo.colunas.estatisticas_preco
+    assert derivado.colunas.estatisticas_por_categoria == completo.colunas.estatisticas_por_categoria
+    assert derivado.contagem_por_categoria == completo.contagem_por_categoria
+    assert list(derivado.colunas.precos_ordenados) == list(completo.colunas.precos_ordenados)
+    assert derivado.indice.categorias() == completo.indice.categorias()
+    assert derivado.busca.postings == completo.busca.postings
+    for categorias in (None, ["cat-0"], ["CAT-1", "cat-2"], ["nova"]):
+        for sort in (None, "price", "-price"):
+            for faixa in ((None, None), (2.0, 5.0)):
+                assert list(derivado.indice.filtrar(categorias, *faixa, sort)) == \
+                    list(completo.indice.filtrar(categorias, *faixa, sort))
+
+
+# Teste 45: refresh incremental revalida só o que mudou e chega ao mesmo snapshot de um rebuild
+def test_refresh_incremental_equivale_a_rebuild(monkeypatch):
+    import random
+    aleatorio = random.Random(7)
+
+    catalogo = _catalogo(300, preco=lambda i: float(i % 9))
+    for i, item in enumerate(catalogo):
+        item["category"] = f"cat-{i % 4}"
+    anterior = snapshot_mod.build_snapshot(catalogo)
+
+    validados = []
+    validar = snapshot_mod.validar_produtos
+    monkeypatch.setattr(snapshot_mod, "validar_produtos", lambda itens: validados.append(len(itens)) or validar(itens))
+
+    for rodada in range(20):
+        novo = json.loads(json.dumps(catalogo))
+        for i in aleatorio.sample(range(len(novo)), 5):
+            novo[i]["meta"]["updatedAt"] = f"2024-01-{rodada + 1:02d}T00:00:00.000Z"
+            novo[i]["price"] = float(aleatorio.randint(0, 9))
+            if aleatorio.random() < 0.4:
+                novo[i]["category"] = aleatorio.choice(["cat-0", "Cat-1", "nova"])
+            if aleatorio.random() < 0.3:
+                novo[i]["title"] = aleatorio.choice(["Café Especial", f"Produto {rodada}", "Chá"])
+        if rodada % 5 == 4:
+            invalido = novo[aleatorio.randrange(len(novo))]
+            invalido["meta"]["updatedAt"] = "2025-01-01T00:00:00.000Z"
+            invalido["price"] = -3
+        if rodada % 7 == 6:
+            del novo[aleatorio.randrange(len(novo))]  # layout muda: índices reconstruídos
+            novo.append(dict(novo[0], id=1000 + rodada))
+
+        validados.clear()
+        derivado = snapshot_mod.atualizar_snapshot(anterior, novo)
+        assert sum(validados) <= 12  # alterados + novos + os que já eram inválidos
+
+        validados.clear()
+        monkeypatch.setattr(snapshot_mod, "validar_produtos", validar)
+        completo = snapshot_mod.build_snapshot(novo)
+        monkeypatch.setattr(snapshot_mod, "validar_produtos", lambda itens: validados.append(len(itens)) or validar(itens))
+        _comparar_snapshots(derivado, completo)
+        anterior, catalogo = derivado, novo
+
+
+# Teste 46: fetch com payload levemente alterado usa o refresh incremental
+def test_fetch_usa_refresh_incremental(mock_all_requests):
+    catalogo = _catalogo(50)
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": catalogo})
+    primeiro, _, _ = fetcher.fetch_produtos()
+
+    alterado = json.loads(json.dumps(catalogo))
+    alterado[10]["price"] = 123.0
+    alterado[10]["meta"]["updatedAt"] = "2024-06-01T00:00:00.000Z"
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": alterado})
+    segundo, _, _ = fetcher._buscar_upstream(fetcher.CACHE_KEY, tentativas=1)
+
+    assert segundo.versao != primeiro.versao
+    assert segundo.produtos[10].price == 123.0
+    assert segundo.produtos[0] is primeiro.produtos[0]
+    assert segundo.colunas.estatisticas_preco["max"] == 123.0
+    assert segundo.indice.posicao_por_id is primeiro.indice.posicao_por_id
+
+
+# Teste 47: busca q= por tokens normalizados, combinada com categoria, preço, ordenação e cursor
+def test_busca_por_texto(mock_all_requests, client):
+    titulos = ["Café Orgânico Premium", "Cafeteira Elétrica", "Chá Verde Orgânico", "CAFE orgánico moído",
+               "Caneca de Café", "Filtro de papel"]
+    catalogo = _catalogo(len(titulos), preco=lambda i: float(10 - i))
+    for item, titulo in zip(catalogo, titulos):
+        item["title"] = titulo
+    catalogo[4]["category"] = "utensilios"
+    mock_all_requests.get("https://dummyjson.com/products", json={"products": catalogo})
+
+    def ids(url):
+        response = client.get(url)
+        assert response.status_code == 200
+        return [p["id"] for p in response.json["data"]["produtos"]]
+
+    assert ids("/data/products?q=cafe") == [1, 4, 5]
+    assert ids("/data/products?q=ORGANICO%20café") == [1, 4]
+    assert ids("/data/products?q=cafe&category=eletronicos") == [1, 4]
+    assert ids("/data/products?q=cafe&sort=price") == [5, 4, 1]
+    assert ids("/data/products?q=cafe&max_price=7") == [4, 5]
+    assert ids("/data/products?q=inexistente") == []
+
+    response = client.get("/data/products?q=café&limit=1")
+    assert response.json["data"]["busca_aplicada"] == "café"
+    assert response.json["data"]["paginacao"]["total_itens"] == 3
+    assert "q=caf%C3%A9" in response.json["data"]["paginacao"]["links"]["next"]
+    assert _seguir_links(client, "/data/products?q=café&limit=1&sort=-price") == [1, 4, 5]
+
+    export = client.get("/data/products/export?q=orgânico")
+    assert [json.loads(linha)["id"] for linha in export.get_data(as_text=True).splitlines()] == [1, 3, 4]
+
+    assert client.get("/data/products?q=!!!").status_code == 400
+
+
+# Teste 48: lote por ids na ordem pedida e projeção fields= na listagem e no lote
+def test_lote_por_ids_e_projecao(mock_all_requests, client):
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+
+    response = client.get("/data/products/batch?ids=5,2,99,5,1")
+    assert response.status_code == 200
+    data = response.json["data"]
+    assert [p["id"] for p in data["produtos"]] == [5, 2, 1]
+    assert data["total_encontrados"] == 3
+    assert data["ids_nao_encontrados"] == [99]
+    completo = client.get("/data/products?limit=12").json["data"]["produtos"]
+    assert data["produtos"][0] == completo[4]
+
+    response = client.get("/data/products/batch?ids=3,4&fields=price,id")
+    assert response.json["data"]["produtos"] == [{"id": 3, "price": completo[2]["price"]},
+                                                 {"id": 4, "price": completo[3]["price"]}]
+    assert response.json["data"]["campos"] == ["id", "price"]
+    com_meta = client.get("/data/products/batch?ids=3&fields=meta").json["data"]["produtos"]
+    assert com_meta == [{"meta": completo[2]["meta"]}]
+
+    listagem = client.get("/data/products?limit=2&fields=id,title").json["data"]
+    assert listagem["produtos"] == [{"id": 1, "title": "Produto 1"}, {"id": 2, "title": "Produto 2"}]
+    assert "fields=id,title" in listagem["paginacao"]["links"]["next"]
+
+    assert client.get("/data/products?fields=id,senha").status_code == 400
+    assert client.get("/data/products/batch?ids=1&fields=preco").status_code == 400
+    assert client.get("/data/products/batch").status_code == 400
+    assert client.get("/data/products/batch?ids=1,a").status_code == 400
+    ids_demais = ",".join(str(i) for i in range(main.MAX_IDS_LOTE + 1))
+    assert client.get(f"/data/products/batch?ids={ids_demais}").status_code == 400
+
+
+# Teste 49: corpo comprimido negociado por Accept-Encoding e comprimido uma vez por versão
+def test_resposta_comprimida(mock_all_requests, client, monkeypatch):
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    compressoes = []
+    comprimir = main.comprimir
+    monkeypatch.setattr(main, "comprimir", lambda corpo, cod: compressoes.append(cod) or comprimir(corpo, cod))
+
+    identidade = client.get("/data/products?limit=12")
+    assert "Content-Encoding" not in identidade.headers
+    assert "Accept-Encoding" in identidade.headers["Vary"]
+
+    gz = client.get("/data/products?limit=12", headers={"Accept-Encoding": "gzip, deflate"})
+    assert gz.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in gz.headers["Vary"]
+    assert gzip.decompress(gz.data) == identidade.data
+    assert len(gz.data) < len(identidade.data)
+    assert gz.headers["ETag"] != identidade.headers["ETag"]
+
+    df = client.get("/data/products?limit=12", headers={"Accept-Encoding": "gzip;q=0.5, deflate"})
+    assert df.headers["Content-Encoding"] == "deflate"
+    assert zlib.decompress(df.data) == identidade.data
+
+    for _ in range(3):
+        repetida = client.get("/data/products?limit=12", headers={"Accept-Encoding": "gzip"})
+        assert repetida.data == gz.data
+    assert compressoes == ["gzip", "deflate"]
+
+    nao_modificada = client.get("/data/products?limit=12", headers={
+        "Accept-Encoding": "gzip", "If-None-Match": gz.headers["ETag"]
+    })
+    assert nao_modificada.status_code == 304
+    recusada = client.get("/data/products?limit=12", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in recusada.headers
+    assert recusada.data == identidade.data
+
+    resumo = client.get("/data/summary", headers={"Accept-Encoding": "gzip"})
+    assert json.loads(gzip.decompress(resumo.data)) == client.get("/data/summary").json
+
+
+# Teste 50: limitador admite até o máximo, enfileira com prazo e descarta o excesso na hora
+def test_limitador_concorrencia_fila_e_descarte():
+    limitador = admission.LimitadorConcorrencia("teste", max_concorrentes=1, max_fila=1, timeout_fila=0.1)
+    assert limitador.adquirir()
+
+    resultados = []
+    na_fila = threading.Thread(target=lambda: resultados.append(limitador.adquirir()))
+    na_fila.start()
+    limite = time.time() + 1
+    while limitador.stats()["queue_depth"] == 0 and time.time() < limite:
+        time.sleep(0.005)
+
+    inicio = time.time()
+    assert not limitador.adquirir()  # fila cheia: descartada sem esperar
+    assert time.time() - inicio < 0.05
+    na_fila.join()
+    assert resultados == [False]  # estourou o timeout da fila
+
+    # Vaga liberada durante a espera: a requisição da fila é admitida
+    na_fila = threading.Thread(target=lambda: resultados.append(limitador.adquirir(time.time() + 1)))
+    na_fila.start()
+    time.sleep(0.02)
+    limitador.liberar()
+    na_fila.join()
+    assert resultados == [False, True]
+
+    stats = limitador.stats()
+    assert stats["in_flight"] == 1 and stats["queue_depth"] == 0
+    assert stats["admitted"] == 2
+    assert stats["shed"] == {"queue_full": 1, "timeout": 1}
+    assert stats["peak_queue_depth"] == 1
+
+
+# Teste 51: com o upstream lento e o limite atingido, o excesso cai no fallback ou em 503 com Retry-After
+def test_sobrecarga_descarta_para_fallback(mock_all_requests, client, monkeypatch):
+    monkeypatch.setattr(fetcher, "STALE_WHILE_REVALIDATE", False)
+    monkeypatch.setattr(fetcher, "_revalidar_em_background", lambda cache_key: None)
+    monkeypatch.setattr(fetcher, "admissao", admission.LimitadorConcorrencia("teste", max_concorrentes=1, max_fila=0))
+    liberar_upstream = threading.Event()
+
+    def upstream_lento(request, context):
+        liberar_upstream.wait(2)
+        return MOCK_DATA_SAFE
+    mock_all_requests.get("https://dummyjson.com/products", json=upstream_lento)
+
+    # A vaga fica com uma busca que não é compartilhada (erro simulado): quem
+    # chega depois lidera a própria busca e precisa de outra vaga
+    def ocupar_vaga():
+        lider = threading.Thread(target=fetcher.fetch_produtos, kwargs={"simular_erro": True})
+        lider.start()
+        limite = time.time() + 1
+        while fetcher.admissao.stats()["in_flight"] == 0 and time.time() < limite:
+            time.sleep(0.005)
+        return lider
+
+    # Sem última versão válida: 503 imediato com Retry-After
+    lider = ocupar_vaga()
+    inicio = time.time()
+    response = client.get("/data/products")
+    assert time.time() - inicio < 0.5
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(admission.RETRY_AFTER)
+    liberar_upstream.set()
+    lider.join()
+
+    # Com última versão válida: o excesso recebe o fallback
+    fetcher.fetch_produtos()
+    cache.set("produtos_all", cache.get_last_valid("produtos_all"), ttl=-1)
+    liberar_upstream.clear()
+    lider = ocupar_vaga()
+    response = client.get("/data/summary")
+    assert response.status_code == 200
+    assert response.json["meta"]["resilience"]["fallback_ativado"] is True
+    liberar_upstream.set()
+    lider.join()
+
+    admissao = client.get("/status").json["dependencies"]["admission"]
+    assert admissao["shed"]["queue_full"] == 2
+    assert admissao["in_flight"] == 0 and admissao["queue_depth"] == 0
+    metricas = client.get("/metrics").get_data(as_text=True)
+    assert 'middleware_admission_shed_total{limiter="teste",reason="queue_full"}' in metricas
+    assert 'middleware_admission_queue_depth{limiter="teste"} 0' in metricas
+
+
+def _servidor_falso(**config):
+    # Upstream HTTP de verdade (o do benchmark), para exercitar o pool de conexões
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "bench"))
+    try:
+        from fake_dummyjson import ServidorFalso
+    finally:
+        sys.path.pop(0)
+    return ServidorFalso(**config).iniciar()
+
+
+# Teste 52: buscas repetidas a um servidor real reaproveitam as conexões keep-alive
+def test_pool_http_reaproveita_conexoes(mock_all_requests, monkeypatch):
+    servidor = _servidor_falso(produtos=250)
+    try:
+        mock_all_requests.get(servidor.url, real_http=True)
+        monkeypatch.setattr(fetcher, "SOURCE_URL", servidor.url)
+        antes = fetcher.pool_stats()
+
+        for _ in range(5):
+            assert len(fetcher._buscar_catalogo((1, 5))) == 250
+
+        depois = fetcher.pool_stats()
+        requisicoes = depois["requests"] - antes["requests"]
+        abertas = depois["connections_opened"] - antes["connections_opened"]
+        assert requisicoes == 15  # 3 páginas por busca
+        assert 0 < abertas < requisicoes
+        assert servidor.stats()["requests"] == requisicoes
+    finally:
+        servidor.parar()
+
+
+# Teste 53: refresher é iniciado no primeiro uso do processo; sem a thread viva os handlers buscam sozinhos
+def test_refresher_por_processo(mock_all_requests, client, monkeypatch):
+    monkeypatch.setattr(persistence, "SNAPSHOT_PERSISTENCE", False)
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+
+    # Como num worker criado por fork: o objeto registrado veio do pai, a thread não
+    herdado = refresher.RefresherCatalogo(intervalo=60)
+    herdado._thread = threading.Thread(target=lambda: None)
+    herdado._thread.start()
+    herdado._thread.join()
+    monkeypatch.setattr(fetcher, "refresher_catalogo", herdado)
+    assert not fetcher.refresher_ativo()
+    snapshot, status_code, is_fallback = fetcher.fetch_produtos()
+    assert snapshot is not None and status_code == 200 and not is_fallback
+
+    # Com REFRESHER_ENABLED, a primeira requisição do processo inicia a thread
+    cache.clear()
+    refresher_processo = refresher.RefresherCatalogo(intervalo=60)
+    monkeypatch.setattr(refresher, "REFRESHER_ENABLED", True)
+    monkeypatch.setattr(refresher, "refresher", refresher_processo)
+    liberar_upstream = threading.Event()
+
+    def upstream_lento(request, context):
+        liberar_upstream.wait(5)
+        return MOCK_DATA_SAFE
+    mock_all_requests.get("https://dummyjson.com/products", json=upstream_lento)
+    try:
+        # /status e /metrics nunca iniciam o refresher
+        assert not client.get("/status").json["dependencies"]["refresher"]["enabled"]
+        client.get("/metrics")
+        assert not fetcher.refresher_ativo()
+
+        # O primeiro uso do catálogo inicia a thread sem esperar o upstream lento
+        inicio = time.time()
+        response = client.get("/data/summary")
+        assert time.time() - inicio < 1
+        assert response.status_code == 503 and response.headers["Retry-After"]
+        assert fetcher.refresher_ativo() and fetcher.refresher_catalogo is refresher_processo
+
+        liberar_upstream.set()
+        limite = time.time() + 5
+        while cache.get("produtos_all") is None and time.time() < limite:
+            time.sleep(0.01)
+        assert client.get("/data/summary").status_code == 200
+    finally:
+        liberar_upstream.set()
+        refresher_processo.parar()
+    assert not fetcher.refresher_ativo()
+
+
+# Teste 54: corpo guardado no cache de respostas é o mesmo JSON compacto do jsonify
+def test_corpo_cacheado_compacto(mock_all_requests, client):
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    for url in ("/data/products?limit=12", "/data/summary", "/data/products/batch?ids=1,2"):
+        response = client.get(url)
+        with app.app_context():
+            esperado = main.jsonify(response.json).get_data()
+        assert response.data == esperado
+
+
+# Teste 55: cache SQLite em diretório privado, recusa arquivo de outro usuário e revalida com um único lease
+def test_cache_sqlite_seguro_e_lease(mock_all_requests, monkeypatch, tmp_path):
+    import cache_backends
+    from cache import SimpleTTLCache
+    from cache_backends import SQLiteBackend
+
+    path = str(tmp_path / "privado" / "cache.sqlite3")
+    worker_a = SimpleTTLCache(backend=SQLiteBackend(path, namespace="catalogo"))
+    worker_b = SimpleTTLCache(backend=SQLiteBackend(path, namespace="catalogo"))
+    assert os.stat(tmp_path / "privado").st_mode & 0o777 == 0o700
+    assert os.stat(path).st_mode & 0o077 == 0
+
+    with monkeypatch.context() as m:
+        m.setattr(cache_backends.os, "getuid", lambda: os.stat(path).st_uid + 1)
+        with pytest.raises(PermissionError):
+            SQLiteBackend(path, namespace="catalogo")
+
+    assert worker_a.adquirir_lease("k", 0.05)
+    assert not worker_b.adquirir_lease("k", 30)
+    time.sleep(0.06)
+    assert worker_b.adquirir_lease("k", 30)  # o lease vencido é retomado
+    worker_b.liberar_lease("k")
+    assert worker_a.adquirir_lease("k", 30)
+    worker_a.liberar_lease("k")
+
+    # Entrada expirada: com o lease em outro worker, este só serve o valor antigo
+    monkeypatch.setattr(fetcher, "cache", worker_a)
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    antigo, _, _ = fetcher.fetch_produtos()
+    worker_a.set("produtos_all", antigo, ttl=-1)
+    chamadas = mock_all_requests.call_count
+
+    assert worker_b.adquirir_lease("produtos_all", 30)
+    servido, status_code, _ = fetcher.fetch_produtos()
+    assert servido.versao == antigo.versao and status_code == 200
+    assert mock_all_requests.call_count == chamadas and not fetcher._inflight
+
+    worker_b.liberar_lease("produtos_all")
+    fetcher.fetch_produtos()
+    limite = time.time() + 2
+    while (fetcher._inflight or worker_a.get("produtos_all") is None) and time.time() < limite:
+        time.sleep(0.01)
+    assert worker_b.get("produtos_all") is not None
+    assert mock_all_requests.call_count == chamadas + 1
+    assert worker_b.adquirir_lease("produtos_all", 30)  # liberado após o sucesso
+
+
+
+# Teste 56: arquivo persistido de outro upstream, datado no futuro ou com cabeçalho inválido é ignorado
+def test_snapshot_persistido_invalido_ignorado(mock_all_requests, monkeypatch):
+    monkeypatch.setattr(fetcher, "STALE_WHILE_REVALIDATE", False)
+    monkeypatch.setattr(fetcher, "_revalidar_em_background", lambda cache_key: None)
+    mock_all_requests.get("https://dummyjson.com/products", status_code=500)
+    produtos = MOCK_DATA_SAFE["products"]
+
+    def reiniciar_com(cabecalho_extra=None, primeira_linha=None, fonte=fetcher.SOURCE_URL, versao="v1", erros=None):
+        persistence.salvar_catalogo(produtos, versao, fonte=fonte, erros=erros)
+        with open(persistence.SNAPSHOT_PATH, "r+", encoding="utf-8") as arquivo:
+            linhas = arquivo.readlines()
+            cabecalho = json.loads(linhas[0])
+            cabecalho.update(cabecalho_extra or {})
+            linhas[0] = (primeira_linha or json.dumps(cabecalho)) + "\n"
+            arquivo.seek(0)
+            arquivo.writelines(linhas)
+            arquivo.truncate()
+        cache.clear()
+        monkeypatch.setattr(fetcher, "_disco_verificado", False)
+        return fetcher.fetch_produtos()
+
+    snapshot, status_code, is_fallback = reiniciar_com()
+    assert snapshot.versao == "v1" and status_code == 200 and not is_fallback
+
+    indisponivel = (None, 503, True)
+    assert reiniciar_com(fonte="http://127.0.0.1:9/products") == indisponivel
+    assert reiniciar_com({"salvo_em": time.time() + 3600}) == indisponivel
+    assert reiniciar_com({"versao": None}) == indisponivel
+    assert reiniciar_com(primeira_linha="[1, 2]") == indisponivel
+    assert reiniciar_com(primeira_linha='"texto"') == indisponivel
+
+    # Relatório de erros inesperado no modo confiável: revalida tudo em vez de descartar
+    monkeypatch.setattr(persistence, "TRUSTED_VALIDATION", True)
+    versao = snapshot_mod.calcular_versao(produtos)
+    snapshot, status_code, _ = reiniciar_com(versao=versao, erros=[["sem", "campos"]])
+    assert snapshot.versao == versao and status_code == 200
+
+
+# Teste 57: modo ASGI carrega o disco no lifespan e não faz I/O bloqueante de cache no event loop
+def test_asgi_sem_io_bloqueante_no_loop(mock_all_requests, monkeypatch, tmp_path):
+    from cache import SimpleTTLCache
+    from cache_backends import SQLiteBackend
+
+    mock_all_requests.get("https://dummyjson.com/products", json=MOCK_DATA_SAFE)
+    threads = {}
+
+    def registrar(nome, funcao):
+        def wrapper(*args, **kwargs):
+            threads.setdefault(nome, []).append(threading.current_thread())
+            return funcao(*args, **kwargs)
+        monkeypatch.setattr(fetcher, nome, wrapper)
+
+    # Catálogo salvo por um processo anterior, carregado no startup fora do loop
+    persistence.salvar_catalogo(MOCK_DATA_SAFE["products"], "v-disco", fonte=fetcher.SOURCE_URL)
+    registrar("_carregar_do_disco", fetcher._carregar_do_disco)
+    parar = refresher.refresher.parar
+
+    def parar_registrado():
+        threads.setdefault("parar", []).append(threading.current_thread())
+        parar()
+    monkeypatch.setattr(refresher.refresher, "parar", parar_registrado)
+    mensagens = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+    enviadas = []
+
+    async def receive():
+        return next(mensagens)
+
+    async def send(mensagem):
+        enviadas.append(mensagem["type"])
+
+    asyncio.run(asgi.application({"type": "lifespan"}, receive, send))
+    assert enviadas == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert threads["_carregar_do_disco"][0] is not threading.main_thread()
+    assert threads["parar"][0] is not threading.main_thread()
+    assert not fetcher.disco_pendente()
+    assert cache.get("produtos_all").versao == "v-disco"
+
+    # Cache em memória já aquecido: a leitura fica no loop, sem custo de thread
+    registrar("servir_sem_upstream", fetcher.servir_sem_upstream)
+    assert asyncio.run(_chamar_asgi("/data/summary"))[0] == 200
+    assert threads["servir_sem_upstream"] == [threading.main_thread()]
+
+    # Backend SQLite: leitura de cache e despacho saem do event loop
+    monkeypatch.setattr(fetcher, "cache", SimpleTTLCache(backend=SQLiteBackend(str(tmp_path / "c.sqlite3"))))
+    threads.clear()
+    assert asyncio.run(_chamar_asgi("/data/summary"))[0] == 200
+    assert threads["servir_sem_upstream"][0] is not threading.main_thread()
+
+
+# Teste 58: modo confiável que falha na reconstrução cai na validação completa do arquivo
+def test_snapshot_confiavel_recorre_a_validacao(mock_all_requests, monkeypatch):
+    monkeypatch.setattr(fetcher, "STALE_WHILE_REVALIDATE", False)
+    monkeypatch.setattr(fetcher, "_revalidar_em_background", lambda cache_key: None)
+    monkeypatch.setattr(persistence, "TRUSTED_VALIDATION", True)
+    mock_all_requests.get("https://dummyjson.com/products", status_code=500)
+
+    # updatedAt em epoch: o pydantic aceita, datetime.fromisoformat não
+    produtos = [
+        {**item, "meta": {**item["meta"], "updatedAt": 1672531200}}
+        for item in MOCK_DATA_SAFE["products"]
+    ]
+    versao = snapshot_mod.calcular_versao(produtos)
+    persistence.salvar_catalogo(produtos, versao, erros=[], fonte=fetcher.SOURCE_URL)
+    monkeypatch.setattr(fetcher, "_disco_verificado", False)
+
+    snapshot, status_code, is_fallback = fetcher.fetch_produtos()
+    assert status_code == 200 and not is_fallback
+    assert snapshot.versao == versao
+    assert len(snapshot.produtos) == len(produtos) and not snapshot.erros
+
+
+# Teste 59: requisições simultâneas durante a carga do disco esperam por ela em vez de ignorá-la
+def test_carga_do_disco_concorrente(mock_all_requests, monkeypatch):
+    monkeypatch.setattr(fetcher, "STALE_WHILE_REVALIDATE", False)
+    mock_all_requests.get("https://dummyjson.com/products", status_code=500)
+    persistence.salvar_catalogo(MOCK_DATA_SAFE["products"], "v-disco", fonte=fetcher.SOURCE_URL)
+
+    carregar = persistence.carregar_catalogo
+    leituras = []
+
+    def carregar_lento(*args, **kwargs):
+        leituras.append(1)
+        time.sleep(0.2)
+        return carregar(*args, **kwargs)
+    monkeypatch.setattr(persistence, "carregar_catalogo", carregar_lento)
+
+    resultados = []
+    threads = [
+        threading.Thread(target=lambda: resultados.append(fetcher.servir_sem_upstream()))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(leituras) == 1
+    assert [resultado[0].versao for resultado in resultados] == ["v-disco"] * 4
+
+
+# Teste 60: item de referência removido que divide o preço com itens ainda não vistos
+def test_cursor_item_removido_com_empate(mock_all_requests, client):
+    catalogo = _catalogo(10, preco=lambda i: 5.0)
+
+    def remover(id_produto):
+        cache.clear()
+        restante = [p for p in catalogo if p["id"] != id_produto]
+        mock_all_requests.get("https://dummyjson.com/products", json={"products": restante})
+
+    for sort, esperado in (("price", list(range(1, 11))), ("-price", list(range(10, 0, -1)))):
+        mock_all_requests.get("https://dummyjson.com/products", json={"products": catalogo})
+        cache.clear()
+        primeira = client.get(f"/data/products?limit=4&sort={sort}").json["data"]
+        assert [p["id"] for p in primeira["produtos"]] == esperado[:4]
+
+        # "next" a partir do último item da página, que some do catálogo
+        remover(esperado[3])
+        assert _seguir_links(client, primeira["paginacao"]["links"]["next"]) == esperado[4:]
+
+        # "prev" a partir do primeiro item da segunda página, que some do catálogo
+        mock_all_requests.get("https://dummyjson.com/products", json={"products": catalogo})
+        cache.clear()
+        segunda = client.get(f"/data/products?limit=4&page=2&sort={sort}").json["data"]
+        assert [p["id"] for p in segunda["produtos"]] == esperado[4:8]
+        remover(esperado[4])
+        assert _seguir_links(client, segunda["paginacao"]["links"]["prev"], "prev") == esperado[:4]
+
+
+# Teste 61: quem espera a busca em andamento (single-flight) não ocupa vaga de admissão
+def test_seguidores_nao_ocupam_admissao(mock_all_requests, monkeypatch):
+    monkeypatch.setattr(fetcher, "STALE_WHILE_REVALIDATE", False)
+    monkeypatch.setattr(fetcher, "admissao", admission.LimitadorConcorrencia("teste", max_concorrentes=1, max_fila=0))
+    liberar_upstream = threading.Event()
+
+    def upstream_lento(request, context):
+        liberar_upstream.wait(2)
+        return MOCK_DATA_SAFE
+    mock_all_requests.get("https://dummyjson.com/products", json=upstream_lento)
+
+    resultados = []
+    threads = [threading.Thread(target=lambda: resultados.append(fetcher.fetch_produtos())) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    limite = time.time() + 1
+    while len(fetcher._inflight) == 0 and time.time() < limite:
+        time.sleep(0.005)
+    time.sleep(0.05)
+    stats = fetcher.admissao.stats()
+    assert stats["in_flight"] == 1 and stats["admitted"] == 1
+    liberar_upstream.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert [status for _, status, _ in resultados] == [200] * 5
+    assert not any(is_fallback for _, _, is_fallback in resultados)
+    assert fetcher.admissao.stats()["shed_total"] == 0
+    assert mock_all_requests.call_count == 1
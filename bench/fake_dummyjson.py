@@ -0,0 +1,162 @@
+"""Servidor falso do dummyjson para o benchmark.
+
+Responde `/products?limit=&skip=` como o upstream real, com tamanho de
+catálogo, latência e taxa de erros configuráveis.
+
+    python bench/fake_dummyjson.py --produtos 5000 --latencia-ms 30 --taxa-erro 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CATEGORIAS = (
+    "beauty", "fragrances", "furniture", "groceries", "home-decoration",
+    "kitchen-accessories", "laptops", "mens-shirts", "smartphones", "tablets"
+)
+
+
+def gerar_catalogo(quantidade, taxa_invalidos=0.0, seed=42):
+    aleatorio = random.Random(seed)
+    produtos = []
+    for i in range(1, quantidade + 1):
+        produto = {
+            "id": i,
+            "title": f"Produto {i}",
+            "price": round(aleatorio.uniform(1, 2000), 2),
+            "category": CATEGORIAS[i % len(CATEGORIAS)],
+            "meta": {
+                "createdAt": "2024-05-23T08:56:21.618Z",
+                "updatedAt": "2024-05-23T08:56:21.618Z"
+            }
+        }
+        if aleatorio.random() < taxa_invalidos:
+            produto["price"] = -produto["price"]  # reprovado na validação
+        produtos.append(produto)
+    return produtos
+
+
+class ServidorFalso:
+    def __init__(self, produtos=1000, latencia_ms=0.0, jitter_ms=0.0, taxa_erro=0.0,
+                 taxa_invalidos=0.0, host="127.0.0.1", porta=0, seed=42):
+        self.catalogo = gerar_catalogo(produtos, taxa_invalidos, seed)
+        self.latencia = latencia_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.taxa_erro = taxa_erro
+        self.aleatorio = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requisicoes = 0
+        self.erros = 0
+
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, como o upstream real
+
+            def do_GET(self):
+                servidor._responder(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, porta), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, porta = self.httpd.server_address[:2]
+        return f"http://{host}:{porta}/products"
+
+    def _sortear(self):
+        with self.lock:
+            self.requisicoes += 1
+            atraso = self.latencia + self.aleatorio.uniform(0, self.jitter)
+            falhar = self.aleatorio.random() < self.taxa_erro
+            if falhar:
+                self.erros += 1
+        return atraso, falhar
+
+    def _responder(self, handler):
+        atraso, falhar = self._sortear()
+        if atraso:
+            time.sleep(atraso)
+
+        url = urlparse(handler.path)
+        if url.path.rstrip("/") != "/products":
+            self._enviar(handler, 404, {"message": "not found"})
+            return
+        if falhar:
+            self._enviar(handler, 500, {"message": "erro injetado"})
+            return
+
+        parametros = parse_qs(url.query)
+        try:
+            limit = int(parametros.get("limit", ["30"])[0])
+            skip = int(parametros.get("skip", ["0"])[0])
+        except ValueError:
+            self._enviar(handler, 400, {"message": "limit/skip inválidos"})
+            return
+
+        # Como no dummyjson, limit=0 devolve o catálogo inteiro
+        fim = len(self.catalogo) if limit == 0 else skip + limit
+        pagina = self.catalogo[skip:fim]
+        self._enviar(handler, 200, {
+            "products": pagina,
+            "total": len(self.catalogo),
+            "skip": skip,
+            "limit": len(pagina)
+        })
+
+    def _enviar(self, handler, status, corpo):
+        dados = json.dumps(corpo).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(dados)))
+        handler.end_headers()
+        handler.wfile.write(dados)
+
+    def iniciar(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-dummyjson", daemon=True)
+        self.thread.start()
+        return self
+
+    def parar(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requisicoes, "errors_injected": self.erros}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--porta", type=int, default=8100)
+    parser.add_argument("--produtos", type=int, default=1000)
+    parser.add_argument("--latencia-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--taxa-erro", type=float, default=0.0)
+    parser.add_argument("--taxa-invalidos", type=float, default=0.0)
+    args = parser.parse_args()
+
+    servidor = ServidorFalso(
+        produtos=args.produtos,
+        latencia_ms=args.latencia_ms,
+        jitter_ms=args.jitter_ms,
+        taxa_erro=args.taxa_erro,
+        taxa_invalidos=args.taxa_invalidos,
+        porta=args.porta
+    )
+    print(f"Servindo {args.produtos} produtos em {servidor.url}")
+    try:
+        servidor.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
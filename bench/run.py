@@ -0,0 +1,312 @@
+"""Benchmark do middleware contra um dummyjson falso local.
+
+Sobe o servidor falso (ver fake_dummyjson.py), inicia o app Flask em um
+subprocesso apontando UPSTREAM_URL para ele e dispara /data/summary,
+/data/products (com filtros e páginas profundas) e /status com a
+concorrência pedida. O resultado (req/s, p50/p95/p99 por cenário e pico de
+RSS do servidor) vai para um arquivo JSON, que pode ser comparado com o de
+uma execução anterior:
+
+    python bench/run.py --produtos 5000 --concorrencia 16 --duracao 20
+    python bench/run.py --comparar bench/resultados/anterior.json
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from fake_dummyjson import CATEGORIAS, ServidorFalso
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRETORIO_APP = os.path.join(RAIZ, "app")
+DIRETORIO_RESULTADOS = os.path.join(RAIZ, "bench", "resultados")
+PERCENTIS = (50, 95, 99)
+
+
+def cenarios(produtos):
+    # Página mais profunda possível com limit=100
+    ultima_pagina = max((produtos + 99) // 100, 1)
+    return {
+        "summary": "/data/summary",
+        "products": "/data/products?limit=20",
+        "products_filtros": f"/data/products?category={CATEGORIAS[0]},{CATEGORIAS[1]}&min_price=100&max_price=900&sort=price&limit=50",
+        "products_pagina_profunda": f"/data/products?page={ultima_pagina}&limit=100&sort=-price",
+        "status": "/status",
+    }
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def iniciar_middleware(upstream_url, porta, diretorio_dados):
+    # Catálogo persistido e cache SQLite num diretório novo a cada execução:
+    # nenhuma execução reaproveita o estado deixado por outra
+    env = dict(
+        os.environ,
+        UPSTREAM_URL=upstream_url,
+        PYTHONUNBUFFERED="1",
+        DATA_DIR=diretorio_dados,
+        SNAPSHOT_PATH=os.path.join(diretorio_dados, "catalogo.jsonl"),
+        CACHE_SQLITE_PATH=os.path.join(diretorio_dados, "cache.sqlite3")
+    )
+    codigo = f"from main import app; app.run(host='127.0.0.1', port={porta}, threaded=True)"
+    processo = subprocess.Popen(
+        [sys.executable, "-c", codigo],
+        cwd=DIRETORIO_APP,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    base = f"http://127.0.0.1:{porta}"
+    limite = time.time() + 30
+    while time.time() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError("o middleware terminou antes de ficar pronto")
+        try:
+            requests.get(base + "/status", timeout=1)
+            return processo, base
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    processo.kill()
+    raise RuntimeError("o middleware não respondeu em 30s")
+
+
+def _pico_rss_kb(pid):
+    # VmHWM é o pico de memória residente do processo (Linux)
+    try:
+        with open(f"/proc/{pid}/status") as arquivo:
+            for linha in arquivo:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _parar_middleware(processo):
+    pico = _pico_rss_kb(processo.pid)
+    processo.terminate()
+    try:
+        processo.wait(10)
+    except subprocess.TimeoutExpired:
+        processo.kill()
+        processo.wait()
+    if pico is None:
+        # Fora do Linux: maior RSS entre os filhos já encerrados (bytes no macOS)
+        pico = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        if sys.platform == "darwin":
+            pico //= 1024
+    return pico
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    indice = min(int(round(p / 100 * len(ordenados) + 0.5)) - 1, len(ordenados) - 1)
+    return ordenados[max(indice, 0)]
+
+
+def disparar(base, rotas, concorrencia, duracao, requisicoes):
+    nomes = list(rotas)
+    amostras = {nome: [] for nome in nomes}
+    status = {nome: {} for nome in nomes}
+    lock = threading.Lock()
+    contador = iter(range(requisicoes)) if requisicoes else None
+    fim = time.perf_counter() + duracao
+
+    def trabalhador(numero):
+        sessao = requests.Session()
+        locais = []
+        i = numero
+        while True:
+            if contador is not None:
+                with lock:
+                    if next(contador, None) is None:
+                        break
+            elif time.perf_counter() >= fim:
+                break
+
+            nome = nomes[i % len(nomes)]
+            i += 1
+            inicio = time.perf_counter()
+            try:
+                codigo = sessao.get(base + rotas[nome], timeout=30).status_code
+            except requests.RequestException:
+                codigo = "erro_conexao"
+            locais.append((nome, time.perf_counter() - inicio, codigo))
+
+        with lock:
+            for nome, duracao_req, codigo in locais:
+                amostras[nome].append(duracao_req)
+                status[nome][str(codigo)] = status[nome].get(str(codigo), 0) + 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(trabalhador, range(concorrencia)))
+    decorrido = time.perf_counter() - inicio
+
+    return _resumir(amostras, status, decorrido)
+
+
+def _resumir(amostras, status, decorrido):
+    def resumo(latencias, codigos):
+        ordenados = sorted(latencias)
+        total = len(ordenados)
+        erros = sum(n for codigo, n in codigos.items() if not codigo.startswith(("2", "3")))
+        return {
+            "requests": total,
+            "errors": erros,
+            "status_codes": codigos,
+            "req_per_s": round(total / decorrido, 2) if decorrido else None,
+            "latency_ms": {
+                "mean": round(sum(ordenados) / total * 1000, 3) if total else None,
+                **{
+                    f"p{p}": round(_percentil(ordenados, p) * 1000, 3) if total else None
+                    for p in PERCENTIS
+                },
+                "max": round(ordenados[-1] * 1000, 3) if total else None
+            }
+        }
+
+    todas = [lat for latencias in amostras.values() for lat in latencias]
+    todos_codigos = {}
+    for codigos in status.values():
+        for codigo, n in codigos.items():
+            todos_codigos[codigo] = todos_codigos.get(codigo, 0) + n
+
+    return {
+        "duration_seconds": round(decorrido, 3),
+        "total": resumo(todas, todos_codigos),
+        "scenarios": {nome: resumo(amostras[nome], status[nome]) for nome in amostras}
+    }
+
+
+def _versao_git():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(atual, anterior):
+    # Tabela simples: req/s e p95 de cada cenário, antes → depois
+    linhas = [f"{'cenário':<28}{'req/s':>22}{'p95 (ms)':>26}"]
+    for nome, dados in atual["results"]["scenarios"].items():
+        antes = anterior["results"]["scenarios"].get(nome)
+        if antes is None:
+            continue
+        rps = f"{antes['req_per_s']} → {dados['req_per_s']}"
+        p95 = f"{antes['latency_ms']['p95']} → {dados['latency_ms']['p95']}"
+        linhas.append(f"{nome:<28}{rps:>22}{p95:>26}")
+    rss = f"{anterior.get('peak_rss_kb')} → {atual.get('peak_rss_kb')}"
+    linhas.append(f"{'pico RSS (kB)':<28}{rss:>22}")
+    return "\n".join(linhas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--produtos", type=int, default=1000, help="tamanho do catálogo falso")
+    parser.add_argument("--latencia-ms", type=float, default=20.0, help="latência do upstream falso")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fração de respostas 500 do upstream")
+    parser.add_argument("--taxa-invalidos", type=float, default=0.02, help="fração de produtos inválidos")
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--duracao", type=float, default=10.0, help="segundos de carga")
+    parser.add_argument("--requisicoes", type=int, default=0, help="total fixo de requisições (ignora --duracao)")
+    parser.add_argument("--aquecimento", type=int, default=20, help="requisições descartadas antes da medição")
+    parser.add_argument("--cenarios", default="", help="subconjunto separado por vírgula (padrão: todos)")
+    parser.add_argument("--saida", default=None, help="arquivo JSON de resultado")
+    parser.add_argument("--comparar", default=None, help="resultado anterior para comparação")
+    args = parser.parse_args()
+
+    rotas = cenarios(args.produtos)
+    if args.cenarios:
+        escolhidos = [nome.strip() for nome in args.cenarios.split(",") if nome.strip()]
+        desconhecidos = set(escolhidos) - set(rotas)
+        if desconhecidos:
+            parser.error(f"cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+        rotas = {nome: rotas[nome] for nome in escolhidos}
+
+    upstream = ServidorFalso(
+        produtos=args.produtos,
+        latencia_ms=args.latencia_ms,
+        jitter_ms=args.jitter_ms,
+        taxa_erro=args.taxa_erro,
+        taxa_invalidos=args.taxa_invalidos
+    ).iniciar()
+    diretorio_dados = tempfile.mkdtemp(prefix="bench-middleware-")
+    try:
+        processo, base = iniciar_middleware(upstream.url, _porta_livre(), diretorio_dados)
+        try:
+            if args.aquecimento:
+                disparar(base, rotas, 1, 0, args.aquecimento)
+            resultados = disparar(base, rotas, args.concorrencia, args.duracao, args.requisicoes)
+            estado = requests.get(base + "/status", timeout=5).json().get("dependencies")
+        finally:
+            pico_rss = _parar_middleware(processo)
+    finally:
+        upstream.parar()
+        shutil.rmtree(diretorio_dados, ignore_errors=True)
+
+    relatorio = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _versao_git(),
+        "python": sys.version.split()[0],
+        "config": {
+            "produtos": args.produtos,
+            "latencia_ms": args.latencia_ms,
+            "jitter_ms": args.jitter_ms,
+            "taxa_erro": args.taxa_erro,
+            "taxa_invalidos": args.taxa_invalidos,
+            "concorrencia": args.concorrencia,
+            "duracao": args.duracao,
+            "requisicoes": args.requisicoes,
+            "cenarios": rotas,
+            # Estado em disco (catálogo persistido, cache SQLite) começa vazio a cada execução
+            "estado_em_disco": "isolado (diretório temporário novo por execução)"
+        },
+        "results": resultados,
+        "peak_rss_kb": pico_rss,
+        "upstream": upstream.stats(),
+        "middleware_status": estado
+    }
+
+    saida = args.saida
+    if saida is None:
+        os.makedirs(DIRETORIO_RESULTADOS, exist_ok=True)
+        saida = os.path.join(DIRETORIO_RESULTADOS, f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(saida, "w", encoding="utf-8") as arquivo:
+        json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+
+    total = resultados["total"]
+    print(f"{total['requests']} requisições em {resultados['duration_seconds']}s: "
+          f"{total['req_per_s']} req/s, p50={total['latency_ms']['p50']}ms "
+          f"p95={total['latency_ms']['p95']}ms p99={total['latency_ms']['p99']}ms, "
+          f"pico RSS={pico_rss} kB")
+    print(f"Resultado salvo em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            print(comparar(relatorio, json.load(arquivo)))
+
+
+if __name__ == "__main__":
+    main()